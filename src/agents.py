@@ -1,10 +1,54 @@
-from camel.models import ModelFactory
-from camel.types import ModelPlatformType, ModelType
-from camel.agents import ChatAgent
-from tools import genes_articles_tool, aberowl_hpo_tool, phenotypes_articles_tool
-from tools import aberowl_hpo, genes_articles, phenotypes_articles
+from tools import aberowl_hpo, genes_articles, phenotypes_articles, select_gene_articles
+from retrieval.retriever import ArticleRetriever
+from context import ContextPacker
+from llm_cache import wrap_model
+from ranking import GeneRanking, GeneRankings, Interpretation, gene_key, parse_rankings, render_markdown
+from tracing import span
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, List
+import threading
+import queue
+
+# camel is imported where models and agents are created, so VCF-only and
+# packed-context code paths never pay for it
+if TYPE_CHECKING:
+    from camel.agents import ChatAgent
+
+def _split_terms(terms: str) -> List[str]:
+    return [term.strip() for term in terms.split(',') if term.strip()]
+
+def build_packed_context(genes: str, phenotypes: str, token_budget: int):
+    """Retrieve gene and phenotype context directly and pack it into a token budget"""
+    gene_list = _split_terms(genes)
+    pheno_list = _split_terms(phenotypes)
+    gene_articles = select_gene_articles(gene_list, pheno_list)
+    pheno_articles = ArticleRetriever().retrieve_phenos(pheno_list)
+    background = {pheno: aberowl_hpo(pheno) for pheno in pheno_list}
+    packed = ContextPacker(token_budget).pack(gene_articles, pheno_articles, background)
+    print(f"Context token usage:\n{packed.report()}")
+    return packed
+
+def build_packed_phenotypes(phenotypes: str, token_budget: int):
+    """Retrieve and pack only the phenotype sections, to be shared by several gene packs"""
+    pheno_list = _split_terms(phenotypes)
+    pheno_articles = ArticleRetriever().retrieve_phenos(pheno_list)
+    background = {pheno: aberowl_hpo(pheno) for pheno in pheno_list}
+    packed = ContextPacker(token_budget).pack_phenotypes(pheno_articles, background)
+    print(f"Phenotype context token usage:\n{packed.report()}")
+    return packed
+
+def build_packed_genes(genes: str, phenotypes: str, token_budget: int, phenotype_sections):
+    """Retrieve gene articles and pack them into what the shared phenotype sections leave of the budget"""
+    gene_articles = select_gene_articles(_split_terms(genes), _split_terms(phenotypes))
+    packed = ContextPacker(token_budget).pack_genes(gene_articles, phenotype_sections)
+    print(f"Gene context token usage:\n{packed.report()}")
+    return packed
+
+def create_model(model_type: str):
+    from camel.models import ModelFactory
+    from camel.types import ModelPlatformType
 
-def generate_interpretation(genes: str, phenotypes: str, model_type="deepseek/deepseek-chat-v3-0324:free") -> str:
     model = ModelFactory.create(
     model_platform=ModelPlatformType.OPENROUTER,
     model_type=model_type,
@@ -12,40 +56,161 @@ def generate_interpretation(genes: str, phenotypes: str, model_type="deepseek/de
     #model_type="google/gemini-2.0-flash-001",
     model_config_dict={"temperature": 0.3, "max_tokens": 100000},
     )
+    return wrap_model(model)
+
+class AgentSet:
+    def __init__(self, model):
+        """The ranking agent and the three retrieval agents used for one patient at a time"""
+        from camel.agents import ChatAgent
+        from tools import aberowl_hpo_tool, genes_articles_tool, phenotypes_articles_tool
+
+        self.gl_agent = ChatAgent(
+            system_message="You are a clinical geneticist analyzing research about "
+            "genetic variants and rare diseases. Based on the articles tool and background knowledge of phenotypes",
+            model=model)
+
+        self.genes_agent = ChatAgent(
+            system_message="You are a helpful assistant that retrieves articles related to genes.",
+            tools=[genes_articles_tool,],
+            model=model)
+
+        self.aberowl_pheno_agent = ChatAgent(
+            system_message="You are a helpful assistant that retrieves articles and background knowledge related to phenotypes.",
+            tools=[aberowl_hpo_tool,],
+            model=model)
+
+        self.pubmed_pheno_agent = ChatAgent(
+            system_message="You are a helpful assistant that retrieves articles to phenotypes.",
+            tools=[phenotypes_articles_tool,],
+            model=model)
+
+    def reset(self):
+        """Clear the message history of every agent, keeping the system messages"""
+        for agent in (self.gl_agent, self.genes_agent, self.aberowl_pheno_agent, self.pubmed_pheno_agent):
+            agent.reset()
+
+class AgentPool:
+    def __init__(self, model_type: str, size: int = 4):
+        """Agent sets sharing one model backend, created on demand and reused across patients"""
+        self.model = create_model(model_type)
+        self.size = size
+        self.created = 0
+        self.available = queue.Queue()
+        self.lock = threading.Lock()
+
+    def warm(self) -> None:
+        """Create all `size` agent sets up front, so the first patients do not pay for it"""
+        with self.lock:
+            while self.created < self.size:
+                self.created += 1
+                self.available.put(AgentSet(self.model))
+
+    @contextmanager
+    def acquire(self):
+        """Borrow an agent set with a fresh history, blocking while all `size` sets are in use"""
+        agents = None
+        with self.lock:
+            if self.available.empty() and self.created < self.size:
+                self.created += 1
+                agents = AgentSet(self.model)
+        if agents is None:
+            agents = self.available.get()
+        agents.reset()
+        try:
+            yield agents
+        finally:
+            self.available.put(agents)
+
+_pools = {}
+_pools_lock = threading.Lock()
+# Runs the independent retrieval agent steps of a patient concurrently
+_step_executor = ThreadPoolExecutor(max_workers=12)
 
-    gl_agent = ChatAgent(
-        system_message="You are a clinical geneticist analyzing research about "
-        "genetic variants and rare diseases. Based on the articles tool and background knowledge of phenotypes",
-        model=model)
+def get_agent_pool(model_type: str, size: int = 4, purpose: str = "patients") -> AgentPool:
+    """Return the process-wide agent pool of a model, growing it to at least `size` agent sets
 
-    genes_agent = ChatAgent(
-        system_message="You are a helpful assistant that retrieves articles related to genes.",
-        tools=[genes_articles_tool,],
-        model=model)
+    Shard ranking borrows from a separate "shards" pool, so patients holding
+    every agent set of their pool never wait on each other's shards.
+    """
+    with _pools_lock:
+        if (model_type, purpose) not in _pools:
+            _pools[model_type, purpose] = AgentPool(model_type, size)
+        pool = _pools[model_type, purpose]
+        pool.size = max(pool.size, size)
+        return pool
 
-    aberowl_pheno_agent = ChatAgent(
-        system_message="You are a helpful assistant that retrieves articles and background knowledge related to phenotypes.",
-        tools=[aberowl_hpo_tool,],
-        model=model)
+def _step(agent: "ChatAgent", name: str, prompt: str, **kwargs):
+    """Run one agent step in a span named after the agent"""
+    with span("agent.step", agent=name):
+        return agent.step(prompt, **kwargs)
 
-    pubmed_pheno_agent = ChatAgent(
-        system_message="You are a helpful assistant that retrieves articles to phenotypes.",
-        tools=[phenotypes_articles_tool,],
-        model=model)
+def generate_interpretation(genes: str, phenotypes: str, model_type="deepseek/deepseek-chat-v3-0324:free",
+                            token_budget: int = None, shard_size: int = None, shard_concurrency: int = 4,
+                            shard_top: int = 5, hints: Dict[str, float] = None) -> str:
+    """Rank the candidate genes for the phenotypes and interpret the evidence
 
-    response = pubmed_pheno_agent.step(
+    With a token_budget the context is retrieved directly and packed to fit
+    it, instead of being summarized by the tool-calling agents. With a
+    shard_size, longer gene lists are ranked in shards of that many genes
+    and the best `shard_top` genes of every shard are reranked together.
+    `hints` are phenotype-similarity scores of the genes (see prefilter.py)
+    shown to the model alongside the context.
+    """
+    return rank_genes(genes, phenotypes, model_type, token_budget, shard_size, shard_concurrency, shard_top,
+                      hints).text
+
+def rank_genes(genes: str, phenotypes: str, model_type="deepseek/deepseek-chat-v3-0324:free",
+               token_budget: int = None, shard_size: int = None, shard_concurrency: int = 4,
+               shard_top: int = 5, hints: Dict[str, float] = None) -> Interpretation:
+    """Like generate_interpretation, but also return the structured ranking behind the report"""
+    with get_agent_pool(model_type).acquire() as agents, span("interpret", model=model_type):
+        gene_list = list(dict.fromkeys(gene.strip() for gene in genes.split(',') if gene.strip()))
+        if shard_size and len(gene_list) > shard_size:
+            return _interpret_sharded(agents, model_type, gene_list, phenotypes, token_budget,
+                                      shard_size, shard_concurrency, shard_top, hints)
+        return _interpret(agents, genes, phenotypes, token_budget, hints)
+
+def _context(agents: AgentSet, genes: str, phenotypes: str, token_budget: int = None,
+             phenotype_context=None):
+    """Gene articles, phenotype articles and phenotype background for the ranking prompt
+
+    A precomputed (phenotype articles, background) pair skips the phenotype
+    retrieval; with a token budget the genes are packed into what it leaves.
+    """
+    if token_budget:
+        if phenotype_context is not None:
+            packed = build_packed_genes(genes, phenotypes, token_budget, phenotype_context)
+            return (packed.sections["genes"], *phenotype_context)
+        packed = build_packed_context(genes, phenotypes, token_budget)
+        return packed.sections["genes"], packed.sections["phenotype_articles"], packed.sections["phenotype_background"]
+
+    # The three retrieval agents are independent; only the ranking step waits on them
+    genes_future = _step_executor.submit(
+        _step, agents.genes_agent, "genes",
+        f"""Retrieve articles related to the following genes: {genes}, selecting those relevant to the phenotypes: {phenotypes}.
+Generate a context for the model for each gene based on the articles or your knowledge.""")
+    if phenotype_context is None:
+        phenotype_context = _phenotype_context(agents, phenotypes)
+    return (genes_future.result().msgs[0].content, *phenotype_context)
+
+def _phenotype_context(agents: AgentSet, phenotypes: str, token_budget: int = None):
+    """Phenotype articles and background, packed into token_budget when it is given"""
+    if token_budget:
+        packed = build_packed_phenotypes(phenotypes, token_budget)
+        return packed.sections["phenotype_articles"], packed.sections["phenotype_background"]
+    pheno_future = _step_executor.submit(
+        _step, agents.pubmed_pheno_agent, "pubmed_pheno",
         f"""Retrieve articles about the following phenotypes: {phenotypes}.
 Generate a context for the model for each phenotype based on articles or your knowledge.""")
-    pheno_articles = response.msgs[0].content
-    response = aberowl_pheno_agent.step(
+    background_future = _step_executor.submit(
+        _step, agents.aberowl_pheno_agent, "aberowl_pheno",
         f"""Retrieve background knowledge about the following phenotypes: {phenotypes}.
 Generate a context for the model for each phenotype based on AberOWL or your knowledge.""")
-    background_knowledge = response.msgs[0].content
-    response = genes_agent.step(
-        f"""Retrieve articles related to the following genes: {genes}.
-Generate a context for the model for each gene based on the articles or your knowledge.""")
-    articles = response.msgs[0].content
+    return pheno_future.result().msgs[0].content, background_future.result().msgs[0].content
 
+def _rank(agent: "ChatAgent", genes: str, phenotypes: str, articles: str, pheno_articles: str,
+          background_knowledge: str, hints: Dict[str, float] = None):
+    """Run the ranking step; returns the structured rankings (None if the schema was ignored) and the raw answer"""
     # Uncomment for the models that do not support tools
     # background_knowledge = ""
     # for pheno in phenotypes.split(','):
@@ -53,17 +218,99 @@ Generate a context for the model for each gene based on the articles or your kno
     # pheno_articles = phenotypes_articles(phenotypes)
     # articles = genes_articles(genes)
 
-    response = gl_agent.step(
+    hints_context = ""
+    if hints:
+        from prefilter import format_hints
+
+        hints_context = ("Phenotype similarity of the genes (Resnik best-match average over HPO gene annotations, "
+                         f"higher is more similar):\n{format_hints(hints)} \n\n")
+    response = _step(
+        agent, "rank",
         f"""Genes context:\n {articles} \n\n
 Phenotype articles context:\n{pheno_articles} \n\n
 Phenotypes context:\n{background_knowledge} \n\n
-Rank the following genes {genes} that are directly or indirectly associated with phenotypes: {phenotypes}. 
-Generate interpretation for each gene in the following format:
-Rank: <rank>
-Gene: <gene_name>
-Interpretation: <interpretation>""")
-    interpretation = response.msgs[0].content
-    return interpretation
+{hints_context}Rank the following genes {genes} that are directly or indirectly associated with phenotypes: {phenotypes}. 
+For each gene give its rank (1 is the most likely causative gene), the gene symbol, 
+a score from 0 to 1 for how well it explains the phenotypes and its interpretation.""",
+        response_format=GeneRankings)
+    message = response.msgs[0]
+    return parse_rankings(message), message.content
+
+def _interpret(agents: AgentSet, genes: str, phenotypes: str, token_budget: int = None,
+               hints: Dict[str, float] = None) -> Interpretation:
+    rankings, answer = _rank(agents.gl_agent, genes, phenotypes, *_context(agents, genes, phenotypes, token_budget),
+                             hints)
+    if rankings is None:
+        # The model ignored the schema; keep its answer for the regex fallback of amelie_results
+        print("Warning: ranking step did not return structured output, keeping the raw answer")
+        return Interpretation(answer)
+    return Interpretation(render_markdown(rankings), rankings)
+
+def _rank_shard(model_type: str, shard: List[str], phenotypes: str, token_budget: int,
+                phenotype_context, hints: Dict[str, float] = None) -> List[GeneRanking]:
+    """Rank one shard of genes with its own gene context and a borrowed agent set"""
+    genes = ', '.join(shard)
+    with get_agent_pool(model_type, purpose="shards").acquire() as agents:
+        shard_hints = {gene: hints[gene] for gene in shard if gene in hints} if hints else None
+        rankings, _ = _rank(agents.gl_agent, genes, phenotypes,
+                            *_context(agents, genes, phenotypes, token_budget, phenotype_context), shard_hints)
+    if rankings is None:
+        print(f"Warning: shard starting at {shard[0]} did not return structured output; its genes are ranked last")
+        return []
+    return _complete(rankings, shard)
+
+def _complete(rankings: List[GeneRanking], genes: List[str]) -> List[GeneRanking]:
+    """Keep the first ranking of each requested gene, append genes the model left out, and renumber
+
+    Rankings are matched to genes like rank_of does (case, whitespace and
+    markdown emphasis ignored) and carry the requested spelling.
+    """
+    wanted = {gene_key(gene): gene for gene in genes}
+    seen = set()
+    kept = []
+    for ranking in rankings:
+        key = gene_key(ranking.gene)
+        if key in wanted and key not in seen:
+            seen.add(key)
+            kept.append(ranking.model_copy(update={"gene": wanted[key]}))
+    kept += [GeneRanking(rank=0, gene=gene, score=0.0, interpretation="Not ranked by the model.")
+             for key, gene in wanted.items() if key not in seen]
+    return [ranking.model_copy(update={"rank": rank}) for rank, ranking in enumerate(kept, start=1)]
+
+def _interpret_sharded(agents: AgentSet, model_type: str, gene_list: List[str], phenotypes: str,
+                       token_budget: int, shard_size: int, concurrency: int, shard_top: int,
+                       hints: Dict[str, float] = None) -> Interpretation:
+    """Map-reduce ranking: rank fixed-size shards concurrently, then rerank the best genes of every shard
+
+    Every call sees at most max(shard_size, shard_top * shards) genes, so
+    prompt size and latency stay bounded however many genes the VCF yields.
+    """
+    shards = [gene_list[start:start + shard_size] for start in range(0, len(gene_list), shard_size)]
+    # Phenotype context is retrieved once and shared by the shards and the merge step
+    phenotype_context = _phenotype_context(agents, phenotypes, token_budget)
+    get_agent_pool(model_type, size=concurrency, purpose="shards")
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        shard_rankings = list(executor.map(
+            lambda shard: _rank_shard(model_type, shard, phenotypes, token_budget, phenotype_context, hints), shards))
+
+    finalists = [ranking for rankings in shard_rankings for ranking in rankings[:shard_top]]
+    finalists.sort(key=lambda ranking: -ranking.score)
+    rest = [ranking for rankings in shard_rankings for ranking in rankings[shard_top:]]
+    rest.sort(key=lambda ranking: -ranking.score)
+
+    # Merge step: the shard interpretations are the gene context of the finalists
+    finalist_genes = [ranking.gene for ranking in finalists]
+    summaries = "\n\n".join(f"Gene: {ranking.gene}\nShard score: {ranking.score:.2f}\n"
+                             f"Interpretation: {ranking.interpretation}" for ranking in finalists)
+    finalist_hints = {gene: hints[gene] for gene in finalist_genes if gene in hints} if hints else None
+    merged, _ = _rank(agents.gl_agent, ', '.join(finalist_genes), phenotypes, summaries, *phenotype_context,
+                      finalist_hints)
+    if merged is None:
+        print("Warning: merge step did not return structured output, using the shard scores")
+        merged = finalists
+    rankings = _complete(merged, finalist_genes)
+    rankings = _complete(rankings + rest, gene_list)
+    return Interpretation(render_markdown(rankings), rankings)
 
 def test_gl_agent():
     test_genes = "IL16, LRIG1, HSPA4, CALU, TAAR3P, HRES1, PPFIBP2, CALML6, PTN, CYP2D6, NDC80, TRBV7-6, MYO5C, GALNT12, PREP, UBC, LINC00471, HMBS, CDH20, PCDHA6, PPP1R2B, RTTN, CYP2U1, OR5B3, RCN3, LCP1, ZNF274, IL37, GSTA2, ADGRF4, CYB561, TRBV7-9, TRPM5, CBX8, TEX11, MRPL2"
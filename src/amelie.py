@@ -2,7 +2,8 @@
 
 import json
 import requests
-import pandas as pd
+from cohort_data import CohortReader
+from evaluation import gene_ranks
 import time
 
 url = 'https://amelie.stanford.edu/api/gene_list_api/'
@@ -10,7 +11,7 @@ url = 'https://amelie.stanford.edu/api/gene_list_api/'
 
 def main():
 
-    df = pd.read_pickle('data/processed_amelie.pkl')
+    df = CohortReader().patients(columns=['Patient Name', 'Causative gene'])
     with open('data/amelie_report.json') as f:
         results = json.loads(f.read())
     for i, row in df.iterrows():
@@ -18,10 +19,9 @@ def main():
             #print(f"Obtaining results for row {i+1} - {row['Patient Name']}")
             response = results[i]
             cause_gene = row['Causative gene']
-            for rank, item in enumerate(response):
-                if cause_gene == item[0]:
-                    print(f"{row['Patient Name']}\t{cause_gene}\t{rank + 1}")
-                    break
+            rank = gene_ranks(response).get(cause_gene)
+            if rank is not None:
+                print(f"{row['Patient Name']}\t{cause_gene}\t{rank}")
         except Exception as e:
             print(f"Error generating interpretation for row {i}: {e}")
     
@@ -1,68 +1,85 @@
 import pandas as pd
-import random
-import json
-import os
-import pickle
+import numpy as np
+from retrieval.store import GENE, default_store
+from cohort_data import COHORT_DIR, write_cohort
 
+SEED = 42
 
 
-def process_data():
+def sample_candidates(available_genes, causative_genes, num_candidates, seed=SEED):
+    """
+    Draw the candidate genes of every patient from the genes with stored articles.
+
+    Args:
+        available_genes: Array of genes that have data, sampled from uniformly
+        causative_genes: Causative gene of each patient, always included
+        num_candidates: Number of candidate genes of each patient, including the causative one
+        seed: Seed of the generator, so the same cohort is produced on every run
+
+    Returns:
+        List with the shuffled candidate genes of each patient.
+    """
+    rng = np.random.default_rng(seed)
+    position = {gene: i for i, gene in enumerate(available_genes)}
+    candidates = []
+    for causative_gene, count in zip(causative_genes, num_candidates):
+        wanted = max(int(count) - 1, 0)
+        excluded = position.get(causative_gene)
+        pool_size = len(available_genes) - (excluded is not None)
+        # Draw one extra index so the causative gene can be dropped without a second draw
+        picks = rng.choice(len(available_genes), size=min(wanted + 1, len(available_genes)), replace=False)
+        picks = picks[picks != excluded][:min(wanted, pool_size)]
+        selected = np.append(available_genes[picks], causative_gene)
+        rng.shuffle(selected)
+        candidates.append(selected.tolist())
+    return candidates
+
+def load_gene_articles(gene_data, store=None):
+    """
+    Resolve the gene/PMID references of a `gene_data` cell into articles from the store.
+
+    Returns:
+        List of {'gene', 'articles'} dictionaries in the same order.
+    """
+    store = store or default_store()
+    articles = store.get_articles(pmid for item in gene_data for pmid in item['pmids'])
+    return [{'gene': item['gene'], 'articles': [articles[pmid] for pmid in item['pmids'] if pmid in articles]}
+            for item in gene_data]
+
+def process_data(seed=SEED, output=COHORT_DIR):
     # Load data files
     ddd_df = pd.read_csv('data/amelie_ddd.csv')
     with open('data/genes.txt') as f:
-        all_genes = [line.strip() for line in f.readlines()]
-    
+        all_genes = np.array([line.strip() for line in f.readlines()])
+
+    # Index of the genes with stored articles, built once for the whole cohort
+    store = default_store()
+    genes_with_data = store.query_names(GENE)
+    available_genes = all_genes[np.fromiter((g in genes_with_data for g in all_genes), dtype=bool, count=len(all_genes))]
+
+    candidates = sample_candidates(available_genes, ddd_df['Causative gene'].tolist(),
+                                   ddd_df['Number of candidate causative genes'].tolist(), seed)
+    pmids = store.get_query_pmids(GENE, (gene for genes in candidates for gene in genes))
+
+    # Store gene/PMID references; load_gene_articles resolves them when the abstracts are needed
     gene_data = []
-    
-    for _, row in ddd_df.iterrows():
-        # Get required number of candidate genes
-        num_candidates = row['Number of candidate causative genes']
-        causative_gene = row['Causative gene']
-        
-        # Filter genes with available data
-        valid_genes = [
-            g for g in all_genes
-            if g != causative_gene
-            and os.path.exists(f"data/genes/{g}.json")
-        ]
-        
-        # Ensure minimum candidate count
-        try:
-            selected = random.sample(valid_genes, min(num_candidates-1, len(valid_genes)))
-        except ValueError:
-            selected = []
-            
-        # Always include causative gene and remove duplicates
-        candidates = list(set(selected + [causative_gene]))
-        random.shuffle(candidates)
-        
-        # Load articles and track missing genes
-        data = []
-        missing_genes = []
-        for gene in candidates:
-            json_path = f"data/genes/{gene}.json"
-            try:
-                with open(json_path) as f:
-                    data.append({
-                        'gene': gene,
-                        'articles': json.load(f),
-                    })
-            except FileNotFoundError:
-                print(f"File not found: {json_path}")
-                missing_genes.append(gene)
-        
-        # Log missing genes
+    missing = []
+    for patient_name, genes in zip(ddd_df['Patient Name'], candidates):
+        gene_data.append([{'gene': gene, 'pmids': pmids[gene]} for gene in genes if gene in pmids])
+        missing_genes = [gene for gene in genes if gene not in pmids]
         if missing_genes:
-            with open('missing_genes.log', 'a') as log:
-                log.write(f"{row['Patient Name']}: {', '.join(missing_genes)}\n")
-        
-        # Store results
-        gene_data.append(data)
-    
+            print(f"Articles not found in store: {', '.join(missing_genes)}")
+            missing.append(f"{patient_name}: {', '.join(missing_genes)}\n")
+
+    # Log missing genes
+    if missing:
+        with open('missing_genes.log', 'a') as log:
+            log.write("".join(missing))
+
     ddd_df['gene_data'] = gene_data
-    # Save to pickle
-    ddd_df.to_pickle('data/processed_amelie.pkl')
+    # Save as a Parquet cohort; see cohort_data.py
+    write_cohort(ddd_df, output)
     print(ddd_df)
-    
+
 if __name__ == '__main__':
-    process_data()
\ No newline at end of file
+    process_data()
@@ -1,44 +1,99 @@
-from collections import defaultdict
-from retrieval.retriever import ArticleRetriever
 from generation.generator import OpenRouterGenerator
 import argparse
+import hashlib
+import json
 import os
 import click as ck
-import pandas as pd
-from agents import generate_interpretation
+from agents import rank_genes, get_agent_pool
+from cohort import CheckpointStore, CohortRunner, atomic_write
+from cohort_data import CohortReader
+from llm_cache import MODES, OFF, configure_cache
+import tracing
+
+def interpret_patient(item):
+    """Generate the interpretation of one cohort patient"""
+    interpretation = rank_genes(
+        item['genes'],
+        item['phenotypes'],
+        model_type=item['model'],
+        shard_size=item.get('shard_size'),
+        shard_concurrency=item.get('shard_concurrency', 4),
+        shard_top=item.get('shard_top', 5),
+    )
+    return {**item, 'interpretation': interpretation.text, 'rankings': interpretation.records()}
 
 @ck.command()
 @ck.option('--openrouter_model', default='deepseek/deepseek-chat-v3-0324:free', help='OpenRouter model to use')
 @ck.option('--output', default='data/report.txt', help='Report output file')
-def main(openrouter_model, output):
+@ck.option('--workers', default=4, help='Number of patients processed concurrently')
+@ck.option('--checkpoint_dir', default=None, help='Per-patient checkpoint directory (default: <output>.checkpoints)')
+@ck.option('--llm_cache', type=ck.Choice(MODES), default=OFF, help='LLM response cache mode: record, replay or off')
+@ck.option('--llm_cache_path', default='data/llm_cache.db', help='LLM response cache database')
+@ck.option('--shard_size', type=int, default=None, help='Rank longer gene lists in shards of this many genes')
+@ck.option('--shard_concurrency', default=4, help='Number of shards ranked concurrently')
+@ck.option('--shard_top', default=5, help='Genes of each shard that go to the final rerank')
+@ck.option('--profile', is_flag=False, flag_value='data/trace.jsonl', default=None,
+           help='Trace every stage into this JSON lines file (default: data/trace.jsonl) and print a summary')
+@ck.option('--chrome_trace', default=None, help='With --profile, also write a chrome://tracing / Perfetto trace')
+def main(openrouter_model, output, workers, checkpoint_dir, llm_cache, llm_cache_path,
+         shard_size, shard_concurrency, shard_top, profile, chrome_trace):
+    configure_cache(llm_cache, llm_cache_path)
+    if profile:
+        tracing.enable(profile)
     # Initialize appropriate generator
     generator = OpenRouterGenerator(openrouter_model)
     index = [3, 12, 18, 21, 57, 62, 74, 102, 113, 121, 142, 147, 178, 179, 183, 184, 201]
-    df = pd.read_pickle('data/processed_amelie.pkl').iloc[index]
-    interpretations = []
-    report = open(output, 'w')
-    for i, row in df.iterrows():
-        try:
-            phenotypes = row['Phenotype names']
-            gene_data = row['gene_data']
-            genes = []
-            for item in gene_data:
-                genes.append(item['gene'])
-            combined_genes = ', '.join(genes)
-            interpretation = generate_interpretation(
-                combined_genes,
-                phenotypes,
-            )
-            report.write(f"## Patient {i+1} - {row['Patient Name']}\n")
-            report.write(f"### Causative Gene: {row['Causative gene']}\n")
-            report.write(f"### Phenotypes: {phenotypes}\n")
-            report.write(f"### Genes: {combined_genes}\n")
-            report.write(f"### Clinical Interpretation\n{interpretation}\n\n")
-        except Exception as e:
-            print(f"Error generating interpretation for row {i}: {e}")
-            interpretations.append("Error generating interpretation")
-    report.close()
+    # Only the selected patients and the columns used here are read from the cohort
+    patients = CohortReader().iter_patients(index, columns=['Patient Name', 'Causative gene', 'Phenotype names'])
+    items = []
+    for patient in patients:
+        i = patient['row']
+        item = {
+            'row': i,
+            'patient_name': patient['Patient Name'],
+            'causative_gene': patient['Causative gene'],
+            'phenotypes': patient['Phenotype names'],
+            'genes': ', '.join(patient['genes']),
+            'model': openrouter_model,
+            'shard_size': shard_size,
+            'shard_concurrency': shard_concurrency,
+            'shard_top': shard_top,
+        }
+        # Checkpoints of another model or other settings are not reused
+        digest = hashlib.sha256(json.dumps(item, sort_keys=True).encode()).hexdigest()[:12]
+        items.append((f"patient-{i}-{digest}", item))
+
+    get_agent_pool(openrouter_model, size=workers)
+    checkpoints = CheckpointStore(checkpoint_dir or f"{output}.checkpoints")
+    results, errors = CohortRunner(interpret_patient, checkpoints, workers).run(items)
+
+    # Assemble the report in cohort order from the checkpointed results
+    sections = []
+    sidecar = []
+    for key, _ in items:
+        if key not in results:
+            continue
+        record = results[key]
+        sidecar.append(json.dumps({
+            'row': record['row'],
+            'patient_name': record['patient_name'],
+            'causative_gene': record['causative_gene'],
+            'model': record['model'],
+            'rankings': record.get('rankings'),
+            'interpretation': None if record.get('rankings') else record['interpretation'],
+        }) + "\n")
+        sections.append(f"## Patient {record['row']+1} - {record['patient_name']}\n"
+                        f"### Causative Gene: {record['causative_gene']}\n"
+                        f"### Phenotypes: {record['phenotypes']}\n"
+                        f"### Genes: {record['genes']}\n"
+                        f"### Clinical Interpretation\n{record['interpretation']}\n\n")
+    atomic_write(output, "".join(sections))
+    # Machine-readable rankings for amelie_results; see ranking.py
+    atomic_write(f"{output}.jsonl", "".join(sidecar))
+    if errors:
+        print(f"{len(errors)} patients failed and will be retried on the next run: {', '.join(errors)}")
     print(f"Report saved to {output}")
+    tracing.finish(chrome_trace)
     
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,4 +1,51 @@
+from ranking import rank_of
+import statistics
+import json
 import re
+import os
+
+def sidecar_path(report_path):
+    """Path of the JSONL rankings written by amelie_generate next to a report"""
+    return report_path if report_path.endswith('.jsonl') else f"{report_path}.jsonl"
+
+def parse_ranks(report_path):
+    """
+    Extract the rank of the causative gene for each patient, from the report's
+    JSONL sidecar when it exists and from the markdown report otherwise.
+    """
+    if os.path.exists(sidecar_path(report_path)):
+        return parse_ranks_from_sidecar(sidecar_path(report_path))
+    return parse_ranks_from_report(report_path)
+
+def parse_ranks_from_sidecar(sidecar_path):
+    """
+    Read the structured rankings of a report in one pass.
+    
+    Args:
+        sidecar_path: Path to the JSONL file, one patient per line
+    
+    Returns:
+        Dictionary with patient names as keys and a tuple of (causative_gene, rank) as values.
+        Patients without structured rankings fall back to the regex patterns on their answer.
+    """
+    results = {}
+    with open(sidecar_path, 'r') as file:
+        for line in file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            patient_name = record['patient_name']
+            causative_gene = record['causative_gene']
+            if record['rankings'] is not None:
+                rank = rank_of(record['rankings'], causative_gene)
+                if rank is None:
+                    print(f"Warning: {causative_gene} is not in the structured ranking of patient {patient_name}.")
+            else:
+                rank = find_rank(record['interpretation'] or "", causative_gene)
+                if rank is None:
+                    print(f"Warning: Rank for {causative_gene} not found in patient {patient_name} (unstructured answer).")
+            results[patient_name] = (causative_gene, rank)
+    return results
 
 def parse_ranks_from_report(report_path):
     """
@@ -43,44 +90,7 @@ def parse_ranks_from_report(report_path):
         # Find Clinical Interpretation section
         interpretation_section = section.split('### Clinical Interpretation')[-1] if '### Clinical Interpretation' in section else ""
         
-        # Search for ranks in the interpretation section
-        rank = None
-        
-        # Look for typical rank patterns in the interpretation text
-        rank_patterns = [
-            # Pattern for "Rank: X\nGene: CAUSATIVE_GENE"
-            rf"Rank:\s*(\d+)[^\n]*\n[^\n]*Gene:\s*{re.escape(causative_gene)}",
-            
-            # Pattern for "Rank: X\nGene: **CAUSATIVE_GENE**"
-            rf"Rank:\s*(\d+)\s*\nGene:\s*\*\*{re.escape(causative_gene)}\*\*",
-
-            # Pattern for "**Rank: X**\nGene: **CAUSATIVE_GENE**"
-            rf"\*\*Rank:\s*(\d+)\*\*\s*\nGene:\s*\*\*{re.escape(causative_gene)}\*\*",
-
-            # Pattern for "**Rank: X**\nGene: **CAUSATIVE_GENE**"
-            rf"\*\*Rank:\s*(\d+)\*\*\s*\nGene:\s*\*\*{re.escape(causative_gene)}\s*\(([^)]+)\)\*\*",
-
-            # Pattern for "Gene: CAUSATIVE_GENE\nRank: X" 
-            rf"Gene:\s*{re.escape(causative_gene)}[^\n]*\n[^\n]*Rank:\s*(\d+)",
-            
-            # Pattern for "#X: CAUSATIVE_GENE"
-            rf"#(\d+)[^\n]*:\s*{re.escape(causative_gene)}",
-            
-            # Pattern for numbered lists like "1. CAUSATIVE_GENE"
-            rf"(\d+)\.\s*\*\*{re.escape(causative_gene)}\*\*",
-            
-            # Pattern for "Rank (\d+): CAUSATIVE_GENE"
-            rf"Rank\s*(\d+):\s*{re.escape(causative_gene)}",
-            
-            # Pattern for "CAUSATIVE_GENE is ranked #(\d+)"
-            rf"{re.escape(causative_gene)}[^\n]*ranked\s*#?(\d+)"
-        ]
-        
-        for pattern in rank_patterns:
-            match = re.search(pattern, interpretation_section, re.IGNORECASE)
-            if match:
-                rank = int(match.group(1))
-                break
+        rank = find_rank(interpretation_section, causative_gene)
     
         if rank is None:
             print(f"Warning: Rank for {causative_gene} not found in patient {patient_name}.")
@@ -89,6 +99,50 @@ def parse_ranks_from_report(report_path):
     
     return results
 
+def find_rank(interpretation, causative_gene):
+    """
+    Find the rank of a gene in free-text interpretation with a cascade of patterns.
+    Used for legacy reports and answers without structured output.
+    
+    Returns:
+        The rank, or None if no pattern matches.
+    """
+    # Look for typical rank patterns in the interpretation text
+    rank_patterns = [
+        # Pattern for "Rank: X\nGene: CAUSATIVE_GENE"
+        rf"Rank:\s*(\d+)[^\n]*\n[^\n]*Gene:\s*{re.escape(causative_gene)}",
+        
+        # Pattern for "Rank: X\nGene: **CAUSATIVE_GENE**"
+        rf"Rank:\s*(\d+)\s*\nGene:\s*\*\*{re.escape(causative_gene)}\*\*",
+
+        # Pattern for "**Rank: X**\nGene: **CAUSATIVE_GENE**"
+        rf"\*\*Rank:\s*(\d+)\*\*\s*\nGene:\s*\*\*{re.escape(causative_gene)}\*\*",
+
+        # Pattern for "**Rank: X**\nGene: **CAUSATIVE_GENE**"
+        rf"\*\*Rank:\s*(\d+)\*\*\s*\nGene:\s*\*\*{re.escape(causative_gene)}\s*\(([^)]+)\)\*\*",
+
+        # Pattern for "Gene: CAUSATIVE_GENE\nRank: X" 
+        rf"Gene:\s*{re.escape(causative_gene)}[^\n]*\n[^\n]*Rank:\s*(\d+)",
+        
+        # Pattern for "#X: CAUSATIVE_GENE"
+        rf"#(\d+)[^\n]*:\s*{re.escape(causative_gene)}",
+        
+        # Pattern for numbered lists like "1. CAUSATIVE_GENE"
+        rf"(\d+)\.\s*\*\*{re.escape(causative_gene)}\*\*",
+        
+        # Pattern for "Rank (\d+): CAUSATIVE_GENE"
+        rf"Rank\s*(\d+):\s*{re.escape(causative_gene)}",
+        
+        # Pattern for "CAUSATIVE_GENE is ranked #(\d+)"
+        rf"{re.escape(causative_gene)}[^\n]*ranked\s*#?(\d+)"
+    ]
+    
+    for pattern in rank_patterns:
+        match = re.search(pattern, interpretation, re.IGNORECASE)
+        if match:
+            return int(match.group(1))
+    return None
+
 def analyze_ranks(ranks_dict):
     """
     Analyze the ranks and provide summary statistics.
@@ -108,7 +162,7 @@ def analyze_ranks(ranks_dict):
         "patients_with_ranks": len(found_ranks),
         "patients_missing_ranks": missing_ranks,
         "average_rank": sum(found_ranks) / len(found_ranks) if found_ranks else None,
-        "median_rank": sorted(found_ranks)[len(found_ranks)//2] if found_ranks else None,
+        "median_rank": statistics.median(found_ranks) if found_ranks else None,
         "rank_distribution": {}
     }
     
@@ -120,7 +174,7 @@ def analyze_ranks(ranks_dict):
 
 if __name__ == "__main__":
     report_path = "data/report_gemini_2.5_pro.txt"
-    ranks = parse_ranks_from_report(report_path)
+    ranks = parse_ranks(report_path)
     
     # Print results
     print("Patient Causative Gene Rankings:")
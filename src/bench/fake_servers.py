@@ -0,0 +1,230 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from typing import Dict, List, Optional
+from xml.sax.saxutils import escape
+import threading
+import hashlib
+import random
+import json
+import time
+import re
+
+from retrieval.concurrency import TokenBucket
+
+
+class FakeServerConfig:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 rate_limit: Optional[float] = None, seed: int = 0):
+        """Behaviour of a stand-in server
+
+        Args:
+            latency: Seconds added to every response.
+            jitter: Extra uniformly distributed latency, in seconds.
+            error_rate: Fraction of requests answered with 503.
+            rate_limit: Requests per second above which 429 (Retry-After: 1) is returned.
+            seed: Seed of the error and jitter draws.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.seed = seed
+
+
+class RequestStats:
+    def __init__(self):
+        """Request counts, status codes and service latencies per endpoint"""
+        self.counts: Dict[str, int] = {}
+        self.statuses: Dict[int, int] = {}
+        self.latencies: Dict[str, List[float]] = {}
+        self.lock = threading.Lock()
+
+    def record(self, endpoint: str, status: int, latency: float) -> None:
+        with self.lock:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.latencies.setdefault(endpoint, []).append(latency)
+
+
+def _pmids(query: str, count: int) -> List[str]:
+    """Deterministic PMIDs for a query, overlapping between related queries like real searches"""
+    digest = int(hashlib.sha256(query.encode()).hexdigest(), 16)
+    return [str(10000000 + (digest >> (i * 8)) % 90000000 // 7 * 7 + i) for i in range(count)]
+
+def _article_xml(pmid: str) -> str:
+    words = " ".join(f"term{(int(pmid) * (i + 3)) % 997}" for i in range(180))
+    return (f"<PubmedArticle><MedlineCitation><PMID Version=\"1\">{pmid}</PMID><Article>"
+            f"<ArticleTitle>Synthetic article {pmid}</ArticleTitle>"
+            f"<Abstract><AbstractText>{escape(words)}</AbstractText></Abstract>"
+            f"<AuthorList><Author><LastName>Doe</LastName><ForeName>J</ForeName></Author></AuthorList>"
+            f"</Article></MedlineCitation></PubmedArticle>")
+
+
+class FakeServer:
+    def __init__(self, config: FakeServerConfig, host: str = "127.0.0.1", port: int = 0):
+        """One local HTTP server speaking the E-utilities, AberOWL dlquery and OpenRouter protocols"""
+        self.config = config
+        self.stats = RequestStats()
+        self.random = random.Random(config.seed)
+        self.random_lock = threading.Lock()
+        self.limiter = TokenBucket(config.rate_limit) if config.rate_limit else None
+        self.history: Dict[str, List[str]] = {}
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.handle(self, parse_qs(urlsplit(self.path).query))
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    params = json.loads(body or b"{}")
+                else:
+                    params = parse_qs(body.decode())
+                    params.update(parse_qs(urlsplit(self.path).query))
+                server.handle(self, params)
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeServer":
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _admit(self) -> Optional[int]:
+        """Status to reject the request with, or None to serve it"""
+        if self.limiter is not None and not self.limiter.try_acquire():
+            return 429
+        with self.random_lock:
+            failed = self.random.random() < self.config.error_rate
+            delay = self.config.latency + self.random.random() * self.config.jitter
+        time.sleep(delay)
+        return 503 if failed else None
+
+    def handle(self, request: BaseHTTPRequestHandler, params: Dict) -> None:
+        started = time.monotonic()
+        path = urlsplit(request.path).path
+        endpoint = path.rstrip("/").rsplit("/", 1)[-1]
+        status = self._admit()
+        if status is not None:
+            self._send(request, status, b"", "text/plain", {"Retry-After": "1"} if status == 429 else {})
+        else:
+            status = self._dispatch(request, endpoint, params)
+        self.stats.record(endpoint, status, time.monotonic() - started)
+
+    def _send(self, request, status: int, body: bytes, content_type: str, headers: Optional[Dict] = None) -> None:
+        request.send_response(status)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            request.send_header(name, value)
+        request.end_headers()
+        request.wfile.write(body)
+
+    def _param(self, params: Dict, name: str, default=None):
+        value = params.get(name, default)
+        return value[0] if isinstance(value, list) else value
+
+    def _dispatch(self, request, endpoint: str, params: Dict) -> int:
+        if endpoint == "esearch.fcgi":
+            term = self._param(params, "term", "")
+            ids = _pmids(term, int(self._param(params, "retmax", 20)))
+            self._send(request, 200, json.dumps({"esearchresult": {"idlist": ids}}).encode(), "application/json")
+        elif endpoint == "epost.fcgi":
+            ids = self._param(params, "id", "").split(",")
+            webenv = hashlib.sha1(",".join(ids).encode()).hexdigest()
+            self.history[webenv] = ids
+            body = f"<ePostResult><QueryKey>1</QueryKey><WebEnv>{webenv}</WebEnv></ePostResult>"
+            self._send(request, 200, body.encode(), "text/xml")
+        elif endpoint == "efetch.fcgi":
+            if "WebEnv" in params:
+                start = int(self._param(params, "retstart", 0))
+                ids = self.history.get(self._param(params, "WebEnv"), [])
+                ids = ids[start:start + int(self._param(params, "retmax", 20))]
+            else:
+                ids = self._param(params, "id", "").split(",")
+            body = "<?xml version=\"1.0\"?><PubmedArticleSet>" + "".join(_article_xml(i) for i in ids if i) + "</PubmedArticleSet>"
+            self._send(request, 200, body.encode(), "text/xml")
+        elif endpoint == "dlquery":
+            label = self._param(params, "query", "").strip("'")
+            result = {"status": "ok", "result": [{
+                "class": f"http://purl.obolibrary.org/obo/HP_{int(hashlib.sha1(label.encode()).hexdigest(), 16) % 10**7:07d}",
+                "label": label,
+                "definition": [f"Synthetic definition of {label}."],
+                "synonyms": [label.title()],
+                "SubClassOf": ["<a href=\"http://purl.obolibrary.org/obo/HP_0000118\">Phenotypic abnormality</a>"],
+            }]}
+            self._send(request, 200, json.dumps(result).encode(), "application/json")
+        elif endpoint == "completions":
+            return self._chat_completion(request, params)
+        elif endpoint == "generation":
+            body = {"data": {"total_cost": 0.0, "tokens_prompt": 0, "tokens_completion": 0, "latency": 0}}
+            self._send(request, 200, json.dumps(body).encode(), "application/json")
+        else:
+            self._send(request, 404, b"", "text/plain")
+            return 404
+        return 200
+
+    def _chat_completion(self, request, body: Dict) -> int:
+        messages = body.get("messages", [])
+        prompt = messages[-1].get("content") if messages else ""
+        prompt = prompt if isinstance(prompt, str) else json.dumps(prompt)
+        message = {"role": "assistant", "content": None}
+        tools = body.get("tools")
+        if tools and not any(m.get("role") == "tool" for m in messages):
+            # Call the agent's tool once with the list it was asked about, like a tool-using model
+            function = tools[0]["function"]
+            listed = re.search(r"following (?:genes|phenotypes): (.*?)(?:, selecting|\.\n|\.$)", prompt, re.S)
+            values = listed.group(1) if listed else ""
+            arguments = {name: values.split(",")[0] if name == "phenotype" else values
+                         for name in function.get("parameters", {}).get("required", [])}
+            message["tool_calls"] = [{"id": "call-1", "type": "function",
+                                      "function": {"name": function["name"], "arguments": json.dumps(arguments)}}]
+            finish_reason = "tool_calls"
+        else:
+            ranked = re.search(r"Rank the following genes (.*?) that are", prompt, re.S)
+            genes = [g.strip() for g in ranked.group(1).split(",")] if ranked else []
+            if genes and body.get("response_format"):
+                rankings = [{"rank": i + 1, "gene": gene, "score": round(1 - i / len(genes), 2),
+                             "interpretation": f"Synthetic evidence for {gene}."} for i, gene in enumerate(genes)]
+                message["content"] = json.dumps({"rankings": rankings})
+            elif genes:
+                message["content"] = "\n\n".join(f"Rank: {i + 1}\nGene: {gene}\nInterpretation: Synthetic evidence for {gene}."
+                                                 for i, gene in enumerate(genes))
+            else:
+                message["content"] = f"Synthetic context — {len(prompt)} characters of input."
+            finish_reason = "stop"
+        completion_tokens = len(message["content"] or "") // 4 + 1
+        usage = {"prompt_tokens": sum(len(str(m.get("content"))) for m in messages) // 4,
+                 "completion_tokens": completion_tokens}
+        usage["total_tokens"] = usage["prompt_tokens"] + completion_tokens
+        response = {"id": f"gen-{time.monotonic_ns()}", "object": "chat.completion", "created": int(time.time()),
+                    "model": body.get("model", "fake"), "usage": usage,
+                    "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}]}
+        if not body.get("stream"):
+            self._send(request, 200, json.dumps(response).encode(), "application/json")
+            return 200
+
+        # Server-sent events: the content in a few chunks, then [DONE]
+        content = message["content"] or ""
+        pieces = [content[i:i + 64] for i in range(0, len(content), 64)] or [""]
+        events = [{"id": response["id"], "choices": [{"index": 0, "delta": {"content": piece}}]} for piece in pieces]
+        # Raw UTF-8 without a charset in the Content-Type, as OpenRouter sends it
+        body = "".join(f"data: {json.dumps(event, ensure_ascii=False)}\n\n" for event in events) + "data: [DONE]\n\n"
+        self._send(request, 200, body.encode(), "text/event-stream")
+        return 200
@@ -0,0 +1,239 @@
+"""End-to-end load and latency benchmark against local stand-in servers.
+
+Starts fake NCBI E-utilities, AberOWL and OpenRouter servers, points the
+pipeline at them through NCBI_EUTILS_URL, ABEROWL_URL and
+OPENROUTER_API_BASE_URL, then drives main.py and the amelie_generate cohort
+path in a scratch directory. Run from src/:
+
+    python -m bench.harness --genes 40 --latency 0.05 --error_rate 0.02
+
+The first run of each path starts with an empty article store in the
+scratch directory; later runs reuse them, so cold and warm paths are compared.
+"""
+from typing import Dict, List
+import threading
+import argparse
+import tempfile
+import random
+import time
+import sys
+import os
+
+from bench.fake_servers import FakeServer, FakeServerConfig
+
+# amelie_generate interprets these 17 rows of the cohort
+COHORT_PATIENTS = 17
+PHENOTYPES = ["Microcephaly", "Delayed speech and language development", "Abnormality of toe",
+              "Prominent nasal bridge", "2-3 toe syndactyly", "Pectus excavatum", "Seizure",
+              "Intellectual disability", "Hypotonia", "Short stature"]
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))]
+
+
+class StageTimer:
+    def __init__(self):
+        """Wall-clock durations of pipeline stages, collected by wrapping their functions"""
+        self.durations: Dict[str, List[float]] = {}
+        self.lock = threading.Lock()
+        self.patched = []
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self.lock:
+            self.durations.setdefault(stage, []).append(seconds)
+
+    def wrap(self, owner, name: str, stage) -> None:
+        """Time every call of owner.name; stage is a name or a function of the call arguments"""
+        original = getattr(owner, name)
+        timer = self
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                timer.add(stage(*args, **kwargs) if callable(stage) else stage, time.perf_counter() - started)
+        setattr(owner, name, timed)
+        self.patched.append((owner, name, original))
+
+    def restore(self) -> None:
+        for owner, name, original in reversed(self.patched):
+            setattr(owner, name, original)
+        self.patched = []
+
+
+def http_stage(client, method, url, **kwargs) -> str:
+    path = url.split("?")[0].rstrip("/")
+    return {
+        "esearch.fcgi": "pubmed_search",
+        "efetch.fcgi": "pubmed_fetch",
+        "epost.fcgi": "pubmed_post",
+        "dlquery": "aberowl",
+        "completions": "llm_completion",
+        "generation": "llm_cost",
+    }.get(path.rsplit("/", 1)[-1], "http_other")
+
+
+def write_vcf(path: str, genes: List[str], rng: random.Random) -> None:
+    """Synthetic VEP-annotated VCF with one high-impact variant per gene plus benign noise"""
+    lines = ["##fileformat=VCFv4.2",
+             '##INFO=<ID=CSQ,Number=.,Type=String,Description="Consequence annotations from Ensembl VEP. '
+             'Format: Allele|Consequence|IMPACT|SYMBOL|Gene">',
+             "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO"]
+    pos = 1000
+    for gene in genes:
+        for consequence in ("stop_gained", "synonymous_variant", "intron_variant"):
+            pos += rng.randint(100, 5000)
+            impact = "HIGH" if consequence == "stop_gained" else "LOW"
+            lines.append(f"1\t{pos}\t.\tC\tT\t50\tPASS\tDP=30;CSQ=T|{consequence}|{impact}|{gene}|ENSG{pos}")
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def write_synthetic_cohort(path: str, genes_per_patient: int, rng: random.Random) -> None:
+    """Synthetic Parquet cohort covering the rows amelie_generate selects"""
+    import pandas as pd
+    from cohort_data import write_cohort
+
+    rows = []
+    for i in range(202):
+        genes = [f"GENE{rng.randint(1, 5000)}" for _ in range(genes_per_patient)]
+        rows.append({
+            "Patient Name": f"Patient{i}",
+            "Causative gene": genes[0],
+            "Phenotype names": ", ".join(rng.sample(PHENOTYPES, 3)),
+            "Number of candidate causative genes": genes_per_patient,
+            "gene_data": [{"gene": gene} for gene in genes],
+        })
+    write_cohort(pd.DataFrame(rows), path)
+
+
+def run_main(args, workdir: str, rng: random.Random) -> float:
+    import main
+
+    genes = [f"GENE{rng.randint(1, 5000)}" for _ in range(args.genes)]
+    vcf_path = os.path.join(workdir, "patient.vcf")
+    write_vcf(vcf_path, genes, rng)
+    argv = sys.argv
+    sys.argv = ["main.py", vcf_path, "--phenotypes", ",".join(PHENOTYPES[:4]),
+                "-o", os.path.join(workdir, "variant_report.md")]
+    if args.token_budget:
+        sys.argv += ["--token_budget", str(args.token_budget)]
+    started = time.perf_counter()
+    try:
+        main.main()
+    finally:
+        sys.argv = argv
+    return time.perf_counter() - started
+
+
+def run_cohort(args, workdir: str) -> float:
+    import amelie_generate
+
+    output = os.path.join(workdir, f"report-{time.monotonic_ns()}.txt")
+    started = time.perf_counter()
+    amelie_generate.main.main(args=["--output", output, "--workers", str(args.workers)], standalone_mode=False)
+    return time.perf_counter() - started
+
+
+def print_report(timer: StageTimer, servers: Dict[str, FakeServer], runs: List[Dict]) -> None:
+    print("\nRuns")
+    print(f"{'run':<14}{'path':<8}{'wall s':>10}{'patients/min':>14}")
+    for run in runs:
+        print(f"{run['name']:<14}{run['path']:<8}{run['seconds']:>10.2f}{run['patients'] / run['seconds'] * 60:>14.1f}")
+
+    print("\nClient-side stage latency (seconds)")
+    print(f"{'stage':<20}{'count':>7}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}{'total':>10}")
+    for stage, values in sorted(timer.durations.items()):
+        print(f"{stage:<20}{len(values):>7}{percentile(values, 50):>9.3f}{percentile(values, 90):>9.3f}"
+              f"{percentile(values, 99):>9.3f}{max(values):>9.3f}{sum(values):>10.2f}")
+
+    print("\nServer-side requests")
+    print(f"{'server':<12}{'endpoint':<16}{'requests':>9}{'p50':>9}{'p99':>9}")
+    for name, server in servers.items():
+        for endpoint, count in sorted(server.stats.counts.items()):
+            latencies = server.stats.latencies[endpoint]
+            print(f"{name:<12}{endpoint:<16}{count:>9}{percentile(latencies, 50):>9.3f}{percentile(latencies, 99):>9.3f}")
+        statuses = ", ".join(f"{status}: {count}" for status, count in sorted(server.stats.statuses.items()))
+        print(f"{'':<12}{'statuses':<16}{statuses}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline against local stand-in servers")
+    parser.add_argument("--paths", default="main,cohort", help="Comma-separated paths to drive: main, cohort")
+    parser.add_argument("--runs", type=int, default=2, help="Runs per path; the first starts with cold caches")
+    parser.add_argument("--genes", type=int, default=30, help="Candidate genes per patient")
+    parser.add_argument("--workers", type=int, default=4, help="Cohort worker count")
+    parser.add_argument("--token_budget", type=int, help="Pass --token_budget to main.py")
+    parser.add_argument("--latency", type=float, default=0.02, help="Added latency of the NCBI and AberOWL servers")
+    parser.add_argument("--llm_latency", type=float, default=0.2, help="Added latency of the OpenRouter server")
+    parser.add_argument("--jitter", type=float, default=0.01, help="Extra random latency of every server")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--ncbi_rate_limit", type=float, default=10, help="Requests/s the NCBI server accepts")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data and server behaviour")
+    args = parser.parse_args()
+
+    servers = {
+        "ncbi": FakeServer(FakeServerConfig(args.latency, args.jitter, args.error_rate, args.ncbi_rate_limit, args.seed)),
+        "aberowl": FakeServer(FakeServerConfig(args.latency, args.jitter, args.error_rate, None, args.seed + 1)),
+        "openrouter": FakeServer(FakeServerConfig(args.llm_latency, args.jitter, args.error_rate, None, args.seed + 2)),
+    }
+    for server in servers.values():
+        server.start()
+    # These are read when the pipeline modules are imported, so set them first
+    os.environ["NCBI_EUTILS_URL"] = f"{servers['ncbi'].url}/entrez/eutils"
+    os.environ["NCBI_API_KEY"] = "benchmark"
+    os.environ["ABEROWL_URL"] = servers["aberowl"].url
+    os.environ["OPENROUTER_API_BASE_URL"] = f"{servers['openrouter'].url}/api/v1"
+    os.environ["OPENROUTER_API_KEY"] = "benchmark"
+
+    workdir = tempfile.mkdtemp(prefix="genome-linter-bench-")
+    os.makedirs(os.path.join(workdir, "data"))
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    rng = random.Random(args.seed)
+
+    from http_client import HttpClient
+    from camel.agents import ChatAgent
+    import vcf
+    import agents
+
+    timer = StageTimer()
+    timer.wrap(HttpClient, "request", lambda client, method, url, **kwargs: http_stage(client, method, url))
+    timer.wrap(vcf, "process_vcf", "vcf_parse")
+    timer.wrap(ChatAgent, "step", "agent_step")
+    timer.wrap(agents, "_interpret", "interpretation")
+
+    runs = []
+    try:
+        paths = [path.strip() for path in args.paths.split(",") if path.strip()]
+        if "cohort" in paths:
+            write_synthetic_cohort(os.path.join(workdir, "data", "cohort"), args.genes, rng)
+        for path in paths:
+            for i in range(args.runs):
+                name = f"{path}-{'cold' if i == 0 else 'warm'}{i if i > 1 else ''}"
+                if path == "main":
+                    # main.py binds process_vcf at import; route it through the timed module attribute
+                    import main
+                    main.process_vcf = vcf.process_vcf
+                    seconds = run_main(args, workdir, rng)
+                    runs.append({"name": name, "path": path, "seconds": seconds, "patients": 1})
+                elif path == "cohort":
+                    seconds = run_cohort(args, workdir)
+                    runs.append({"name": name, "path": path, "seconds": seconds, "patients": COHORT_PATIENTS})
+    finally:
+        timer.restore()
+        os.chdir(cwd)
+        for server in servers.values():
+            server.stop()
+    print_report(timer, servers, runs)
+    print(f"\nScratch directory: {workdir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Cold-start import benchmark of the entry points, checked against a budget.
+
+Every module in importtime_budget.json is imported in a fresh interpreter
+with -X importtime. Its cumulative import time (best of --repeat runs) must
+stay under max_ms, and none of its forbidden packages may be imported. Run
+from src/; the exit status is 1 when any budget is exceeded:
+
+    python -m bench.importtime
+    python -m bench.importtime --top 15 main
+
+Budgets are deliberately loose absolute times; the forbidden lists are what
+catch a heavy import creeping back into a fast path.
+"""
+from typing import Dict, List, Tuple
+import subprocess
+import argparse
+import json
+import sys
+import os
+
+BUDGET_PATH = os.path.join(os.path.dirname(__file__), "importtime_budget.json")
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int, int]]:
+    """(module, self us, cumulative us, depth) of every line written by -X importtime"""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return imports
+
+def measure(module: str) -> List[Tuple[str, int, int, int]]:
+    """Import `module` in a fresh interpreter and return its import tree, excluding interpreter startup"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    imports = parse_importtime(result.stderr)
+    # Modules imported by site before the -c code runs are not the entry point's cost
+    start = max((i + 1 for i, (name, _, _, depth) in enumerate(imports) if name == "site" and depth == 0), default=0)
+    return imports[start:]
+
+def check(module: str, budget: Dict, repeat: int = 3, top: int = 0) -> bool:
+    """Print the measurement of one module and return whether it is within its budget"""
+    runs = [measure(module) for _ in range(repeat)]
+    totals = [sum(cumulative for _, _, cumulative, depth in imports if depth == 0) for imports in runs]
+    best = min(range(repeat), key=lambda i: totals[i])
+    imports = runs[best]
+    elapsed_ms = totals[best] / 1000
+    loaded = {name.split(".")[0] for name, _, _, _ in imports}
+    forbidden = sorted(loaded & set(budget.get("forbidden", [])))
+    ok = elapsed_ms <= budget["max_ms"] and not forbidden
+    print(f"{'ok  ' if ok else 'FAIL'} {module:<24}{elapsed_ms:>9.1f} ms (budget {budget['max_ms']} ms)"
+          + (f", imports forbidden {', '.join(forbidden)}" if forbidden else ""))
+    if top:
+        for name, _, cumulative, depth in sorted(imports, key=lambda item: -item[2])[:top]:
+            print(f"     {cumulative / 1000:>9.1f} ms  {'  ' * depth}{name}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the cold-start import time of the entry points")
+    parser.add_argument("modules", nargs="*", help="Modules to check (default: every module in the budget file)")
+    parser.add_argument("--budget", default=BUDGET_PATH, help="Budget file")
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh interpreters per module; the best run counts")
+    parser.add_argument("--top", type=int, default=0, help="Also list the slowest imports of each module")
+    args = parser.parse_args()
+
+    with open(args.budget) as f:
+        budgets = json.load(f)
+    modules = args.modules or list(budgets)
+    unknown = [module for module in modules if module not in budgets]
+    if unknown:
+        parser.error(f"No budget for {', '.join(unknown)} in {args.budget}")
+    results = [check(module, budgets[module], args.repeat, args.top) for module in modules]
+    if not all(results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, Tuple
+import threading
+import json
+import time
+import os
+
+
+def atomic_write(path: str, text: str) -> None:
+    """Write a file so readers see either the old or the complete new content"""
+    tmp_path = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+class CheckpointStore:
+    def __init__(self, directory: str):
+        """One JSON file per completed item, so an interrupted run can resume"""
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def load(self, key: str) -> Optional[Dict]:
+        try:
+            with open(self.path(key)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def save(self, key: str, record: Dict) -> None:
+        atomic_write(self.path(key), json.dumps(record))
+
+
+class Progress:
+    def __init__(self, total: int, label: str = "patients"):
+        """Print completed/total with throughput and an ETA"""
+        self.total = total
+        self.label = label
+        self.done = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def update(self, ok: bool = True) -> None:
+        with self.lock:
+            self.done += 1
+            self.failed += not ok
+            elapsed = time.monotonic() - self.started
+            rate = self.done / elapsed if elapsed else 0
+            eta = (self.total - self.done) / rate if rate else 0
+            print(f"[{self.done}/{self.total} {self.label}] {elapsed:.0f}s elapsed, "
+                  f"{elapsed / self.done:.1f}s each, ETA {eta:.0f}s, {self.failed} failed")
+
+
+class CohortRunner:
+    def __init__(self, fn: Callable[[Dict], Dict], checkpoints: CheckpointStore, workers: int = 4):
+        """Run fn over cohort items with a bounded worker pool, checkpointing each result
+
+        Args:
+            fn: Computes the result record of one item.
+            checkpoints: Where completed results are stored; items found there are skipped.
+            workers: Maximum number of items processed at the same time.
+        """
+        self.fn = fn
+        self.checkpoints = checkpoints
+        self.workers = workers
+
+    def run(self, items: List[Tuple[str, Dict]]) -> Tuple[Dict[str, Dict], Dict[str, str]]:
+        """Process (key, item) pairs; returns completed records and errors keyed by item key"""
+        results = {}
+        pending = []
+        for key, item in items:
+            record = self.checkpoints.load(key)
+            if record is not None:
+                results[key] = record
+            else:
+                pending.append((key, item))
+        if results:
+            print(f"Resuming: {len(results)} completed, {len(pending)} remaining")
+
+        errors = {}
+        progress = Progress(len(pending))
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.fn, item): key for key, item in pending}
+            for future in as_completed(futures):
+                key = futures[future]
+                try:
+                    record = future.result()
+                except Exception as e:
+                    print(f"Error generating interpretation for {key}: {e}")
+                    errors[key] = str(e)
+                    progress.update(ok=False)
+                    continue
+                # Results are checkpointed as they finish, in any order
+                self.checkpoints.save(key, record)
+                results[key] = record
+                progress.update()
+        return results, errors
@@ -0,0 +1,136 @@
+"""Columnar on-disk cohort format replacing data/processed_amelie.pkl.
+
+A cohort is a directory of three Parquet tables:
+
+    patients.parquet      one row per patient, keyed by `row` (the original row index)
+    candidates.parquet    (row, position, gene): the candidate genes of each patient, in order
+    gene_articles.parquet (gene, position, pmid): PubMed references of each candidate gene
+
+Articles themselves stay in the article store. Reads are memory-mapped and
+push row and column selections down to Parquet, so a script touching 17
+patients reads only the row groups that hold them.
+"""
+from typing import Dict, Iterable, Iterator, List, Optional
+import argparse
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+COHORT_DIR = "data/cohort"
+PATIENTS = "patients.parquet"
+CANDIDATES = "candidates.parquet"
+GENE_ARTICLES = "gene_articles.parquet"
+# Small row groups keep row-selection pushdown selective for cohorts of a few hundred patients
+ROW_GROUP_SIZE = 64
+
+
+def _gene_pmids(item: Dict) -> List[str]:
+    """PMID references of a gene_data entry, also accepting legacy entries with embedded articles"""
+    if 'pmids' in item:
+        return [str(pmid) for pmid in item['pmids']]
+    return [str(article['pubmed_id']) for article in item.get('articles', [])]
+
+def write_cohort(df: pd.DataFrame, directory: str = COHORT_DIR) -> None:
+    """Write a cohort DataFrame with a `gene_data` column as patient, candidate and article tables"""
+    os.makedirs(directory, exist_ok=True)
+    patients = df.drop(columns=['gene_data']).reset_index(names='row')
+    patients['row'] = patients['row'].astype('int64')
+
+    candidate_rows, positions, genes = [], [], []
+    pmids_of = {}
+    for row, gene_data in zip(patients['row'], df['gene_data']):
+        for position, item in enumerate(gene_data):
+            candidate_rows.append(row)
+            positions.append(position)
+            genes.append(item['gene'])
+            pmids_of.setdefault(item['gene'], _gene_pmids(item))
+    candidates = pa.table({
+        'row': pa.array(candidate_rows, pa.int64()),
+        'position': pa.array(positions, pa.int32()),
+        'gene': pa.array(genes, pa.string()),
+    })
+    article_genes = sorted(pmids_of)
+    gene_articles = pa.table({
+        'gene': pa.array([gene for gene in article_genes for _ in pmids_of[gene]], pa.string()),
+        'position': pa.array([i for gene in article_genes for i in range(len(pmids_of[gene]))], pa.int32()),
+        'pmid': pa.array([pmid for gene in article_genes for pmid in pmids_of[gene]], pa.string()),
+    })
+
+    pq.write_table(pa.Table.from_pandas(patients.sort_values('row'), preserve_index=False),
+                   os.path.join(directory, PATIENTS), row_group_size=ROW_GROUP_SIZE)
+    pq.write_table(candidates, os.path.join(directory, CANDIDATES), row_group_size=ROW_GROUP_SIZE * 256)
+    pq.write_table(gene_articles, os.path.join(directory, GENE_ARTICLES), row_group_size=ROW_GROUP_SIZE * 256)
+
+def convert_pickle(pickle_path: str = "data/processed_amelie.pkl", directory: str = COHORT_DIR) -> int:
+    """Convert a processed_amelie.pkl cohort to the Parquet format; returns the number of patients"""
+    df = pd.read_pickle(pickle_path)
+    write_cohort(df, directory)
+    return len(df)
+
+
+class CohortReader:
+    def __init__(self, directory: str = COHORT_DIR):
+        """Lazy, memory-mapped reader of a cohort directory"""
+        self.directory = directory
+
+    def _read(self, name: str, columns: Optional[List[str]] = None, filters=None) -> pa.Table:
+        return pq.read_table(os.path.join(self.directory, name), columns=columns, filters=filters,
+                             memory_map=True)
+
+    def patients(self, rows: Optional[Iterable[int]] = None, columns: Optional[List[str]] = None,
+                 filters=None) -> pd.DataFrame:
+        """Patient table indexed by row, reading only the selected rows and columns
+
+        Args:
+            rows: Original row indices to read; all patients when None.
+            columns: Patient columns to read; all when None.
+            filters: Additional pyarrow filters, e.g. [('Causative gene', '=', 'ANKRD11')].
+        """
+        filters = list(filters or [])
+        if rows is not None:
+            filters.append(('row', 'in', [int(row) for row in rows]))
+        if columns is not None and 'row' not in columns:
+            columns = ['row', *columns]
+        table = self._read(PATIENTS, columns, filters or None)
+        return table.to_pandas().set_index('row')
+
+    def candidates(self, rows: Optional[Iterable[int]] = None) -> Dict[int, List[str]]:
+        """Candidate genes of each selected patient, in their stored order"""
+        filters = [('row', 'in', [int(row) for row in rows])] if rows is not None else None
+        table = self._read(CANDIDATES, filters=filters).sort_by([('row', 'ascending'), ('position', 'ascending')])
+        genes = {}
+        for row, gene in zip(table.column('row').to_pylist(), table.column('gene').to_pylist()):
+            genes.setdefault(row, []).append(gene)
+        return genes
+
+    def gene_pmids(self, genes: Iterable[str]) -> Dict[str, List[str]]:
+        """PubMed references of the given candidate genes, in their stored order"""
+        table = self._read(GENE_ARTICLES, filters=[('gene', 'in', list(set(genes)))])
+        table = table.sort_by([('gene', 'ascending'), ('position', 'ascending')])
+        pmids = {}
+        for gene, pmid in zip(table.column('gene').to_pylist(), table.column('pmid').to_pylist()):
+            pmids.setdefault(gene, []).append(pmid)
+        return pmids
+
+    def iter_patients(self, rows: Optional[Iterable[int]] = None,
+                      columns: Optional[List[str]] = None) -> Iterator[Dict]:
+        """Yield each selected patient as a dict with its `row` and candidate `genes`"""
+        rows = list(rows) if rows is not None else None
+        patients = self.patients(rows, columns)
+        candidates = self.candidates(rows)
+        for row, patient in zip(patients.index, patients.to_dict('records')):
+            yield {'row': int(row), **patient, 'genes': candidates.get(row, [])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a processed_amelie.pkl cohort to the Parquet cohort format")
+    parser.add_argument("pickle", nargs='?', default="data/processed_amelie.pkl", help="Pickled cohort DataFrame")
+    parser.add_argument("-o", "--output", default=COHORT_DIR, help="Cohort directory to write")
+    args = parser.parse_args()
+    count = convert_pickle(args.pickle, args.output)
+    print(f"Converted {count} patients from {args.pickle} to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+from typing import List, Dict, Optional, Tuple
+
+# Rough token estimate for English biomedical text; avoids a tokenizer dependency
+CHARS_PER_TOKEN = 4
+
+
+def count_tokens(text: str) -> int:
+    """Estimate the number of tokens in a text"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def truncate(text: str, tokens: int) -> str:
+    """Cut a text to about `tokens` tokens at a word boundary"""
+    limit = tokens * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    cut = text.rfind(' ', 0, limit)
+    return text[:cut if cut > 0 else limit] + " ..."
+
+def fair_shares(demands: List[int], budget: int) -> List[int]:
+    """Split a budget so no one gets more than it asks for and the rest is shared equally (water-filling)"""
+    shares = [0] * len(demands)
+    pending = sorted(range(len(demands)), key=lambda i: demands[i])
+    while pending:
+        share = budget // len(pending)
+        i = pending[0]
+        if demands[i] > share:
+            for j in pending:
+                shares[j] = share
+            break
+        shares[i] = demands[i]
+        budget -= demands[i]
+        pending.pop(0)
+    return shares
+
+
+class PackedContext:
+    def __init__(self, sections: Dict[str, str], section_tokens: Dict[str, int], group_tokens: Dict[str, Dict[str, int]]):
+        """Prompt sections that fit a token budget, with the tokens each one used"""
+        self.sections = sections
+        self.section_tokens = section_tokens
+        self.group_tokens = group_tokens
+
+    def report(self) -> str:
+        lines = [f"{name}: {tokens} tokens" for name, tokens in self.section_tokens.items()]
+        lines.append(f"total: {sum(self.section_tokens.values())} tokens")
+        return "\n".join(lines)
+
+
+class ContextPacker:
+    def __init__(self, budget: int, background_share: float = 0.15, phenotype_share: float = 0.25,
+                 min_abstract_tokens: int = 48):
+        """Assemble the interpretation context within a token budget for the target model
+
+        Args:
+            budget: Tokens available for the context (model window minus prompt and answer).
+            background_share: Fraction reserved for phenotype background knowledge.
+            phenotype_share: Fraction reserved for phenotype articles; genes get the rest.
+            min_abstract_tokens: Abstracts that cannot keep this many tokens are dropped.
+        """
+        self.budget = budget
+        self.background_share = background_share
+        self.phenotype_share = phenotype_share
+        self.min_abstract_tokens = min_abstract_tokens
+
+    def _article_header(self, article: Dict) -> str:
+        return f"Title: {article['title']}\nAuthors: {', '.join(article['authors'])}\n"
+
+    def _pack_groups(self, groups: Dict[str, List[Dict]], budget: int, seen: set) -> Tuple[List[str], Dict[str, int]]:
+        """Lay out article groups (per gene or phenotype), sharing the budget fairly between groups"""
+        # Deduplicate by PMID: an article is printed under the first group that retrieved it
+        unique = {}
+        references = {}
+        for name, articles in groups.items():
+            unique[name] = []
+            references[name] = []
+            for article in articles:
+                if not article.get('text'):
+                    continue
+                pmid = str(article.get('pubmed_id', ''))
+                if pmid and pmid in seen:
+                    references[name].append(pmid)
+                    continue
+                seen.add(pmid)
+                unique[name].append(article)
+
+        names = list(groups)
+        headings = {name: f"## {name}\n" for name in names}
+        refs = {name: f"Also relevant: PMID {', '.join(references[name])}\n" if references[name] else ""
+                for name in names}
+        overhead = {name: count_tokens(headings[name] + refs[name]) for name in names}
+        demands = [overhead[name] + sum(count_tokens(self._article_header(a) + f"PMID: {a.get('pubmed_id', '')}\nAbstract: {a['text']}\n\n")
+                                        for a in unique[name]) for name in names]
+        shares = fair_shares(demands, budget)
+
+        parts = []
+        used = {}
+        for name, share in zip(names, shares):
+            group_parts = [headings[name], refs[name]]
+            remaining = share - overhead[name]
+            articles = unique[name]
+            headers = [self._article_header(a) + f"PMID: {a.get('pubmed_id', '')}\nAbstract: " for a in articles]
+            # Drop the lowest-ranked articles until every remaining abstract gets a useful slice
+            while articles and remaining - sum(count_tokens(h) for h in headers) < self.min_abstract_tokens * len(articles):
+                articles, headers = articles[:-1], headers[:-1]
+            abstract_budget = remaining - sum(count_tokens(h) for h in headers)
+            abstract_shares = fair_shares([count_tokens(a['text']) for a in articles], max(abstract_budget, 0))
+            for header, article, tokens in zip(headers, articles, abstract_shares):
+                group_parts.append(header)
+                group_parts.append(truncate(article['text'], tokens))
+                group_parts.append("\n\n")
+            used[name] = count_tokens("".join(group_parts))
+            parts.extend(group_parts)
+        return parts, used
+
+    def _pack_background(self, background: Dict[str, str]) -> List[str]:
+        background_budget = int(self.budget * self.background_share) if background else 0
+        shares = fair_shares([count_tokens(text) for text in background.values()], background_budget)
+        return [truncate(text, tokens) + "\n" for text, tokens in zip(background.values(), shares)]
+
+    def pack_phenotypes(self, phenotype_articles: Dict[str, List[Dict]],
+                        background: Optional[Dict[str, str]] = None) -> PackedContext:
+        """Pack only the phenotype sections within their reserved shares
+
+        The result can be shared by several gene packs (see pack_genes); the
+        phenotype articles do not take the leftover, which belongs to the genes.
+        """
+        background_parts = self._pack_background(background or {})
+        pheno_parts, pheno_used = self._pack_groups(phenotype_articles, int(self.budget * self.phenotype_share), set())
+        sections = {
+            "phenotype_articles": "".join(pheno_parts).strip(),
+            "phenotype_background": "".join(background_parts).strip(),
+        }
+        section_tokens = {name: count_tokens(text) for name, text in sections.items()}
+        return PackedContext(sections, section_tokens, {"phenotype_articles": pheno_used})
+
+    def pack_genes(self, gene_articles: Dict[str, List[Dict]], phenotype_sections: Tuple[str, ...] = ()) -> PackedContext:
+        """Pack gene articles into the budget left over by already packed phenotype sections"""
+        remaining = self.budget - sum(count_tokens(text) for text in phenotype_sections)
+        gene_parts, gene_used = self._pack_groups(gene_articles, max(remaining, 0), set())
+        sections = {"genes": "".join(gene_parts).strip()}
+        return PackedContext(sections, {"genes": count_tokens(sections["genes"])}, {"genes": gene_used})
+
+    def pack(self, gene_articles: Dict[str, List[Dict]], phenotype_articles: Dict[str, List[Dict]],
+             background: Optional[Dict[str, str]] = None) -> PackedContext:
+        """Pack gene articles, phenotype articles and phenotype background knowledge"""
+        background_parts = self._pack_background(background or {})
+        background_used = count_tokens("".join(background_parts))
+
+        remaining = self.budget - background_used
+        phenotype_budget = int(self.budget * self.phenotype_share) if phenotype_articles else 0
+        seen = set()
+        # Genes are packed first so shared articles are shown under the gene they support
+        gene_parts, gene_used = self._pack_groups(gene_articles, remaining - phenotype_budget, seen)
+        leftover = remaining - phenotype_budget - sum(gene_used.values())
+        pheno_parts, pheno_used = self._pack_groups(phenotype_articles, phenotype_budget + max(leftover, 0), seen)
+
+        sections = {
+            "genes": "".join(gene_parts).strip(),
+            "phenotype_articles": "".join(pheno_parts).strip(),
+            "phenotype_background": "".join(background_parts).strip(),
+        }
+        section_tokens = {name: count_tokens(text) for name, text in sections.items()}
+        return PackedContext(sections, section_tokens, {"genes": gene_used, "phenotype_articles": pheno_used})
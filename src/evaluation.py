@@ -0,0 +1,131 @@
+"""Compare the causative-gene rankings of several model reports and the AMELIE baseline.
+
+    python evaluation.py data/report_gemini_2.5_pro.txt data/report_deepseek.txt \
+        --amelie data/amelie_report.json --bootstrap 2000
+
+Reports are parsed in parallel (from their JSONL sidecars when present), the
+ranks of every system are collected in one systems x patients array, and
+top-k accuracy, MRR and bootstrap confidence intervals are computed with
+NumPy over all patients at once.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import argparse
+import json
+import os
+
+import numpy as np
+
+from amelie_results import parse_ranks
+from cohort_data import COHORT_DIR, CohortReader
+
+TOP_K = (1, 5, 10)
+AMELIE = "AMELIE"
+
+
+def gene_ranks(ranked_genes: List) -> Dict[str, int]:
+    """Gene -> rank lookup of a ranked result list, keeping the first occurrence of each gene"""
+    ranks = {}
+    for rank, item in enumerate(ranked_genes, start=1):
+        gene = item[0] if isinstance(item, (list, tuple)) else item
+        ranks.setdefault(gene, rank)
+    return ranks
+
+def amelie_ranks(amelie_path: str, cohort_dir: str = COHORT_DIR) -> Dict[str, Tuple[str, Optional[int]]]:
+    """Rank of each patient's causative gene in the AMELIE results, which are listed in cohort row order"""
+    with open(amelie_path) as f:
+        results = json.load(f)
+    patients = CohortReader(cohort_dir).patients(columns=['Patient Name', 'Causative gene'])
+    ranks = {}
+    for row, name, gene in zip(patients.index, patients['Patient Name'], patients['Causative gene']):
+        if row < len(results):
+            ranks[name] = (gene, gene_ranks(results[row]).get(gene))
+    return ranks
+
+def report_name(report_path: str) -> str:
+    """System name of a report file, e.g. data/report_gemini_2.5_pro.txt -> gemini_2.5_pro"""
+    name = os.path.basename(report_path)
+    for suffix in ('.jsonl', '.txt', '.md'):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return name[len('report_'):] if name.startswith('report_') else name
+
+def rank_matrix(systems: Dict[str, Dict[str, Tuple[str, Optional[int]]]],
+                patients: List[str]) -> np.ndarray:
+    """systems x patients array of causative-gene ranks, inf where the gene was not ranked"""
+    matrix = np.full((len(systems), len(patients)), np.inf)
+    for i, ranks in enumerate(systems.values()):
+        for j, patient in enumerate(patients):
+            rank = ranks.get(patient, (None, None))[1]
+            if rank is not None:
+                matrix[i, j] = rank
+    return matrix
+
+def rank_metrics(ranks: np.ndarray, top_k=TOP_K) -> Dict[str, np.ndarray]:
+    """Top-k accuracy and mean reciprocal rank over the last axis of a rank array"""
+    metrics = {f"top{k}": (ranks <= k).mean(axis=-1) for k in top_k}
+    metrics["mrr"] = (1.0 / ranks).mean(axis=-1)
+    return metrics
+
+def bootstrap_intervals(ranks: np.ndarray, samples: int = 1000, confidence: float = 0.95,
+                        seed: int = 0, top_k=TOP_K) -> Dict[str, np.ndarray]:
+    """Percentile bootstrap intervals of rank_metrics, resampling patients for all systems together
+
+    Returns:
+        Metric name -> array of shape (systems, 2) with the lower and upper bounds.
+    """
+    rng = np.random.default_rng(seed)
+    resampled = ranks[:, rng.integers(0, ranks.shape[1], size=(samples, ranks.shape[1]))]
+    alpha = (1 - confidence) / 2 * 100
+    return {name: np.percentile(values, [alpha, 100 - alpha], axis=-1).T
+            for name, values in rank_metrics(resampled, top_k).items()}
+
+def format_table(names: List[str], ranks: np.ndarray, metrics: Dict[str, np.ndarray],
+                 intervals: Dict[str, np.ndarray]) -> str:
+    header = f"{'system':<28}{'patients':>9}{'found':>7}{'median':>8}" + "".join(f"{name:>22}" for name in metrics)
+    lines = [header, "-" * len(header)]
+    for i, name in enumerate(names):
+        found = np.isfinite(ranks[i])
+        median = f"{np.median(ranks[i][found]):.1f}" if found.any() else "-"
+        cells = "".join(f"{f'{values[i]:.3f} [{intervals[metric][i, 0]:.2f}, {intervals[metric][i, 1]:.2f}]':>22}"
+                        for metric, values in metrics.items())
+        lines.append(f"{name:<28}{ranks.shape[1]:>9}{int(found.sum()):>7}{median:>8}{cells}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare causative-gene ranks of model reports and AMELIE")
+    parser.add_argument("reports", nargs="+", help="Report files, one per model")
+    parser.add_argument("--amelie", help="AMELIE results JSON to include as a baseline")
+    parser.add_argument("--cohort", default=COHORT_DIR, help="Cohort directory, used to align the AMELIE results")
+    parser.add_argument("--bootstrap", type=int, default=1000, help="Bootstrap samples for confidence intervals")
+    parser.add_argument("--confidence", type=float, default=0.95, help="Confidence level of the intervals")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the bootstrap resampling")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Processes used to parse reports")
+    parser.add_argument("--all_patients", action="store_true",
+                        help="Evaluate on the union of patients instead of those present in every report")
+    args = parser.parse_args()
+
+    names = [report_name(path) for path in args.reports]
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        parsed = executor.map(parse_ranks, args.reports)
+        baseline = executor.submit(amelie_ranks, args.amelie, args.cohort) if args.amelie else None
+        systems = dict(zip(names, parsed))
+        if baseline is not None:
+            systems[AMELIE] = baseline.result()
+
+    # Compare systems on the same patients; AMELIE covers the whole cohort, reports usually a subset
+    patient_sets = [set(ranks) for name, ranks in systems.items() if name != AMELIE]
+    patients = set.union(*patient_sets) if args.all_patients else set.intersection(*patient_sets)
+    patients = sorted(patients)
+    if not patients:
+        parser.error("The reports have no patients in common; use --all_patients")
+
+    ranks = rank_matrix(systems, patients)
+    metrics = rank_metrics(ranks)
+    intervals = bootstrap_intervals(ranks, args.bootstrap, args.confidence, args.seed)
+    print(f"{len(patients)} patients, {args.confidence:.0%} bootstrap intervals from {args.bootstrap} samples\n")
+    print(format_table(list(systems), ranks, metrics, intervals))
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,27 @@
-from typing import List, Dict, Optional
-import requests
+from typing import List, Dict, Iterator, Optional
+from http_client import HttpClient, get_client
+from llm_cache import get_cache
+from generation.usage import UsageRecorder, get_usage_recorder
+from tracing import span
 import os
 import json
+import time
+
+# Same variable camel reads for its OpenRouter backend
+OPENROUTER_URL = os.getenv("OPENROUTER_API_BASE_URL", "https://openrouter.ai/api/v1")
+# (connect, read) timeout of completions; long answers take minutes to generate
+COMPLETION_TIMEOUT = (10, 600)
 
 class OpenRouterGenerator:
-    def __init__(self, model: str = "deepseek/deepseek-chat-v3-0324:free", api_key: Optional[str] = None):
+    def __init__(self, model: str = "deepseek/deepseek-chat-v3-0324:free", api_key: Optional[str] = None,
+                 http: Optional[HttpClient] = None, usage: Optional[UsageRecorder] = None):
         """Initialize with OpenRouter model"""
         self.model = model
         self.api_key = api_key or os.getenv("OPENROUTER_API_KEY")
         if not self.api_key:
             raise ValueError("OpenRouter API key not provided and OPENROUTER_API_KEY environment variable not set")
+        self.http = http or get_client()
+        self.usage = usage or get_usage_recorder()
         
     def format_context(self, articles: List[Dict]) -> str:
         """Format retrieved articles as context for the generator"""
@@ -20,8 +32,7 @@ class OpenRouterGenerator:
             context += f"Abstract: {article['text']}\n\n"
         return context.strip()
     
-    def generate_answer(self, genes: str, phenotypes: str, context: str) -> str:
-        """Generate answer using OpenRouter API"""
+    def build_messages(self, genes: str, phenotypes: str, context: str) -> List[Dict]:
         prompt = f"""You are a clinical geneticist analyzing research about genetic variants and rare diseases.
 Based on these scientific articles:
 
@@ -30,9 +41,11 @@ Based on these scientific articles:
 Question: Which of the following genes with high impact variants are directly or indirectly relevant for {phenotypes}, rank them and interpret the evidence. Just answer the question.:
 {genes}
 Answer:"""
-        
-        response = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions",
+        return [{"role": "user", "content": prompt}]
+
+    def _post_completion(self, messages: List[Dict], stream: bool):
+        response = self.http.post(
+            f"{OPENROUTER_URL}/chat/completions",
             headers={
                 "Authorization": f"Bearer {self.api_key}",
                 "Content-Type": "application/json",
@@ -42,22 +55,86 @@ Answer:"""
             },
             json={
                 "model": self.model,
-                "messages": [{"role": "user", "content": prompt}],
+                "messages": messages,
                 "temperature": 0.3,
-                "max_tokens": 100000
-            }
+                "max_tokens": 100000,
+                "stream": stream
+            },
+            stream=stream,
+            timeout=COMPLETION_TIMEOUT
         )
         response.raise_for_status()
-        response_data = response.json()
-        gen_id = response_data.get("id", None)
-        url = f"https://openrouter.ai/api/v1/generation?id={gen_id}"
-        headers = {"Authorization": f"Bearer {self.api_key}"}
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        stats = response.json()
-        cost = stats["data"].get("total_cost", 0)
-        print(f"OpenRouter request cost: ${cost:.4f}")
-        return response_data["choices"][0]["message"]["content"]
+        return response
+
+    def generate_answer(self, genes: str, phenotypes: str, context: str) -> str:
+        """Generate answer using OpenRouter API"""
+        messages = self.build_messages(genes, phenotypes, context)
+        cache = get_cache()
+        cache_key = cache.key(self.model, 0.3, messages)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+        with span("generation", model=self.model) as trace:
+            response_data = self._post_completion(messages, stream=False).json()
+            usage = response_data.get("usage") or {}
+            trace.set(prompt_tokens=usage.get("prompt_tokens"), completion_tokens=usage.get("completion_tokens"))
+        # Cost is looked up in the background instead of delaying the answer
+        self.usage.record(response_data.get("id", None), self.model)
+        answer = response_data["choices"][0]["message"]["content"]
+        cache.put(cache_key, answer)
+        return answer
+
+    def stream_answer(self, genes: str, phenotypes: str, context: str) -> Iterator[str]:
+        """Generate answer using OpenRouter API, yielding text as it arrives (server-sent events)"""
+        messages = self.build_messages(genes, phenotypes, context)
+        cache = get_cache()
+        cache_key = cache.key(self.model, 0.3, messages)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+        # The span covers the whole stream; first_token is the time to the first text
+        with span("generation", model=self.model, stream=True) as trace:
+            started = time.perf_counter()
+            response = self._post_completion(messages, stream=True)
+            gen_id = None
+            parts = []
+            received = 0
+            done = False
+            try:
+                for raw in response.iter_lines():
+                    received += len(raw) + 1
+                    # Event streams are UTF-8; without a charset requests would decode them as ISO-8859-1
+                    line = raw.decode("utf-8")
+                    # Lines starting with ':' are keep-alive comments
+                    if not line or not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        done = True
+                        break
+                    chunk = json.loads(data)
+                    if "error" in chunk:
+                        raise RuntimeError(f"OpenRouter stream error: {chunk['error']}")
+                    gen_id = gen_id or chunk.get("id")
+                    if chunk.get("usage"):
+                        trace.set(prompt_tokens=chunk["usage"].get("prompt_tokens"),
+                                  completion_tokens=chunk["usage"].get("completion_tokens"))
+                    for choice in chunk.get("choices", []):
+                        text = choice.get("delta", {}).get("content")
+                        if text:
+                            if not parts:
+                                trace.set(first_token=time.perf_counter() - started)
+                            parts.append(text)
+                            yield text
+                # A dropped connection ends the lines early; the partial answer must not be cached
+                if not done:
+                    raise RuntimeError(f"OpenRouter stream ended before [DONE] after {received} bytes")
+            finally:
+                response.close()
+                trace.set(bytes=received)
+        self.usage.record(gen_id, self.model)
+        cache.put(cache_key, "".join(parts))
 
 
 def test_generation():
@@ -0,0 +1,102 @@
+from typing import Dict, List, Optional
+import threading
+import atexit
+import queue
+import json
+import time
+import os
+
+from http_client import HttpClient, get_client
+from tracing import span
+
+GENERATION_URL = f'{os.getenv("OPENROUTER_API_BASE_URL", "https://openrouter.ai/api/v1")}/generation'
+
+
+class UsageRecorder:
+    def __init__(self, api_key: Optional[str] = None, log_path: str = "data/usage.jsonl",
+                 delay: float = 2.0, batch_size: int = 20, http: Optional[HttpClient] = None):
+        """Look up OpenRouter generation cost in a background thread, off the answer's critical path
+
+        Generation IDs are queued by the generator and resolved in batches once
+        they are at least `delay` seconds old (OpenRouter publishes the stats
+        shortly after a completion). Each record is appended to `log_path` as JSON.
+        """
+        self.api_key = api_key or os.getenv("OPENROUTER_API_KEY")
+        self.log_path = log_path
+        self.delay = delay
+        self.batch_size = batch_size
+        self.http = http or get_client()
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._worker, name="usage-recorder", daemon=True)
+        self.thread.start()
+
+    def record(self, generation_id: Optional[str], model: str) -> None:
+        """Queue a completed generation for cost lookup"""
+        if generation_id:
+            self.queue.put((generation_id, model, time.time()))
+
+    def flush(self) -> None:
+        """Block until every queued generation has been looked up and logged"""
+        self.queue.join()
+
+    def _worker(self) -> None:
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get(timeout=0.1))
+                except queue.Empty:
+                    break
+            wait = batch[-1][2] + self.delay - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                self._log([self._lookup(generation_id, model) for generation_id, model, _ in batch])
+            except Exception as e:
+                # The thread must keep draining the queue, or flush() blocks forever
+                print(f"Could not log OpenRouter usage to {self.log_path}: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _lookup(self, generation_id: str, model: str) -> Dict:
+        record = {"id": generation_id, "model": model}
+        with span("openrouter.cost", model=model) as trace:
+            self._fetch_stats(record)
+            trace.set(cost=record.get("total_cost", 0))
+        return record
+
+    def _fetch_stats(self, record: Dict) -> None:
+        try:
+            response = self.http.get(GENERATION_URL, params={"id": record["id"]},
+                                     headers={"Authorization": f"Bearer {self.api_key}"})
+            response.raise_for_status()
+            stats = response.json()["data"]
+            record.update({
+                "total_cost": stats.get("total_cost", 0),
+                "tokens_prompt": stats.get("tokens_prompt"),
+                "tokens_completion": stats.get("tokens_completion"),
+                "latency": stats.get("latency"),
+            })
+            print(f"OpenRouter request cost: ${record['total_cost']:.4f}")
+        except Exception as e:
+            record["error"] = str(e)
+
+    def _log(self, records: List[Dict]) -> None:
+        if os.path.dirname(self.log_path):
+            os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+        with open(self.log_path, "a") as f:
+            f.write("".join(json.dumps(record) + "\n" for record in records))
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+def get_usage_recorder() -> UsageRecorder:
+    """Return the process-wide usage recorder; pending lookups are flushed at exit"""
+    global _recorder
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = UsageRecorder()
+            atexit.register(_recorder.flush)
+        return _recorder
@@ -0,0 +1,186 @@
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple, Union
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+import threading
+import requests
+import random
+import time
+
+from tracing import span
+
+# Responses worth retrying: rate limiting and transient server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Methods that may be sent again after a read timeout; the server may already have acted on others
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised without contacting a host whose circuit breaker is open"""
+
+
+class CountingReader:
+    def __init__(self, stream):
+        """File-like wrapper of a streamed body counting the bytes read through it"""
+        self.stream = stream
+        self.bytes = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        self.bytes += len(data)
+        return data
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """Stop calling a host after consecutive failures until reset_timeout has passed"""
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Closed circuits allow every call; after reset_timeout one trial call is let through"""
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Half-open: the next failure re-opens the circuit for another reset_timeout
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class HttpClient:
+    def __init__(self, timeout: Union[float, Tuple[float, float]] = (10, 120), max_retries: int = 5,
+                 backoff: float = 0.5, max_backoff: float = 60.0, pool_size: int = 16,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """HTTP client with one keep-alive connection pool and circuit breaker per host
+
+        Args:
+            timeout: Default (connect, read) timeout in seconds.
+            max_retries: Retries after a connection error, retryable status or, for
+                idempotent methods, a read timeout.
+            backoff: Base delay of the exponential backoff in seconds.
+            max_backoff: Upper bound of a single backoff delay, including Retry-After.
+            pool_size: Maximum number of pooled connections per host.
+            failure_threshold: Consecutive failed calls that open a host's circuit.
+            reset_timeout: Seconds an open circuit waits before allowing a trial call.
+        """
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pool_size = pool_size
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.sessions: Dict[str, requests.Session] = {}
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.lock = threading.Lock()
+
+    def _host(self, url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def session(self, url: str) -> Tuple[requests.Session, CircuitBreaker]:
+        """Return the pooled session and circuit breaker of the URL's host"""
+        host = self._host(url)
+        with self.lock:
+            if host not in self.sessions:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                session.mount(host, adapter)
+                self.sessions[host] = session
+                self.breakers[host] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return self.sessions[host], self.breakers[host]
+
+    def _delay(self, attempt: int, response: Optional[requests.Response]) -> float:
+        """Exponential backoff with full jitter, or the server's Retry-After when given"""
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                try:
+                    return min(max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0), self.max_backoff)
+                except (TypeError, ValueError):
+                    pass
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def request(self, method: str, url: str, idempotent: Optional[bool] = None, **kwargs) -> requests.Response:
+        """Send a request, retrying transient failures; the final response is returned as is
+
+        Requests that may have reached the server (timeouts, 5xx) are resent
+        only for idempotent methods; pass idempotent=True for a POST that is
+        safe to repeat. Connection errors and 429s are always retried.
+        """
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        with span("http.request", method=method, url=url.split("?")[0]) as trace:
+            response = self._request(method, url, idempotent, **kwargs)
+            if kwargs.get("stream"):
+                # The body is read after the span ends; callers count it in their own spans (see CountingReader)
+                length = response.headers.get("Content-Length")
+                trace.set(status=response.status_code, bytes=int(length) if length else None)
+            else:
+                trace.set(status=response.status_code, bytes=len(response.content))
+            return response
+
+    def _request(self, method: str, url: str, idempotent: bool, **kwargs) -> requests.Response:
+        session, breaker = self.session(url)
+        kwargs.setdefault("timeout", self.timeout)
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                raise CircuitOpenError(f"Circuit open for {self._host(url)}, not calling {url}")
+            response = None
+            try:
+                response = session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                breaker.record_failure()
+                # Connect timeouts are connection errors: nothing reached the server
+                resend = isinstance(e, requests.ConnectionError) or idempotent
+                if attempt >= self.max_retries or not resend:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    breaker.record_success()
+                    return response
+                # Rate limiting is the server working as intended, not a host failure
+                if response.status_code != 429:
+                    breaker.record_failure()
+                if attempt >= self.max_retries or (response.status_code != 429 and not idempotent):
+                    return response
+                response.close()
+            time.sleep(self._delay(attempt, response))
+            attempt += 1
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client() -> HttpClient:
+    """Return the HTTP client shared by the retrieval and generation modules"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient()
+        return _client
@@ -0,0 +1,212 @@
+"""Pedigree-aware inheritance filtering of candidate variants.
+
+Genotypes of the high-impact variants are decoded into int8 matrices
+(variants x samples: -1 missing, 0 hom ref, 1 het, 2 hom alt; haploid calls
+count as 0 or 2), and every inheritance model is evaluated for all variants
+at once with NumPy. The pedigree comes from a PED file:
+
+    family  individual  father  mother  sex (1 male, 2 female)  phenotype (2 affected, 1 unaffected)
+
+Missing genotypes of affected individuals exclude a variant. Missing genotypes
+of unaffected relatives do not, and neither do those of parents under the
+recessive models; a de novo call needs both parents genotyped as reference.
+"""
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+
+MISSING, HOM_REF, HET, HOM_ALT = -1, 0, 1, 2
+MALE, FEMALE = "1", "2"
+
+DE_NOVO = "de_novo"
+AUTOSOMAL_RECESSIVE = "autosomal_recessive"
+COMPOUND_HET = "compound_het"
+X_LINKED = "x_linked"
+MODELS = (DE_NOVO, AUTOSOMAL_RECESSIVE, COMPOUND_HET, X_LINKED)
+
+# Parental origin of a compound heterozygous candidate
+UNKNOWN, PATERNAL, MATERNAL = 0, 1, 2
+
+
+class Individual:
+    def __init__(self, family: str, id: str, father: Optional[str], mother: Optional[str], sex: str,
+                 phenotype: str):
+        self.family = family
+        self.id = id
+        self.father = father
+        self.mother = mother
+        self.sex = sex
+        self.affected = phenotype == "2"
+        self.unaffected = phenotype == "1"
+
+
+def parse_ped(path: str) -> Dict[str, Individual]:
+    """Individual ID -> Individual of a PED file; parents given as 0 are unknown"""
+    individuals = {}
+    with open(path) as f:
+        for number, line in enumerate(f, start=1):
+            if not line.strip() or line.startswith("#"):
+                continue
+            fields = line.split()
+            if len(fields) < 6:
+                raise ValueError(f"{path}:{number}: expected 6 PED columns, got {len(fields)}")
+            family, id, father, mother, sex, phenotype = fields[:6]
+            individuals[id] = Individual(family, id, None if father == "0" else father,
+                                         None if mother == "0" else mother, sex, phenotype)
+    return individuals
+
+
+def genotype_code(gt: str) -> int:
+    """Code of one GT value: number of non-reference alleles, or MISSING"""
+    alleles = gt.replace("|", "/").split("/")
+    if not gt or "." in alleles:
+        return MISSING
+    alt = sum(allele != "0" for allele in alleles)
+    if len(alleles) == 1:
+        # Haploid call, e.g. a male on chrX outside the pseudoautosomal regions
+        return HOM_ALT if alt else HOM_REF
+    return min(alt, HOM_ALT)
+
+def decode_genotypes(gts: List[List[str]]) -> np.ndarray:
+    """int8 matrix (variants x samples) of GT strings; each distinct string is parsed once"""
+    if not gts:
+        return np.zeros((0, 0), dtype=np.int8)
+    distinct, inverse = np.unique(np.array([gt for row in gts for gt in row]), return_inverse=True)
+    codes = np.fromiter((genotype_code(gt) for gt in distinct), dtype=np.int8, count=len(distinct))
+    return codes[inverse].reshape(len(gts), -1)
+
+def is_x(chrom: str) -> bool:
+    return chrom.upper().removeprefix("CHR") == "X"
+
+def is_autosome(chrom: str) -> bool:
+    return chrom.upper().removeprefix("CHR") not in ("X", "Y", "M", "MT")
+
+
+class InheritanceFilter:
+    def __init__(self, pedigree: Dict[str, Individual], samples: List[str], models: Sequence[str] = MODELS):
+        """Keep the variants consistent with at least one of `models` in the pedigree
+
+        Args:
+            pedigree: Individuals of the PED file; those not in the VCF are ignored.
+            samples: Sample columns of the VCF.
+            models: Inheritance models to test, a subset of MODELS.
+        """
+        unknown = [model for model in models if model not in MODELS]
+        if unknown:
+            raise ValueError(f"Unknown inheritance models {', '.join(unknown)}, expected {', '.join(MODELS)}")
+        self.models = list(models)
+        column = {sample: i for i, sample in enumerate(samples)}
+        present = [individual for individual in pedigree.values() if individual.id in column]
+        self.affected = np.array([column[i.id] for i in present if i.affected], dtype=np.int64)
+        self.unaffected = np.array([column[i.id] for i in present if i.unaffected], dtype=np.int64)
+        if not len(self.affected):
+            raise ValueError("No affected individual of the PED file is a sample of the VCF")
+        self.affected_males = np.array([column[i.id] for i in present if i.affected and i.sex == MALE], dtype=np.int64)
+        self.affected_others = np.array([column[i.id] for i in present if i.affected and i.sex != MALE], dtype=np.int64)
+        self.unaffected_males = np.array([column[i.id] for i in present if i.unaffected and i.sex == MALE], dtype=np.int64)
+        self.unaffected_females = np.array([column[i.id] for i in present if i.unaffected and i.sex == FEMALE],
+                                           dtype=np.int64)
+        # Affected children with both parents sequenced: (child, father, mother) columns
+        self.trios = np.array([(column[i.id], column[i.father], column[i.mother]) for i in present
+                               if i.affected and i.father in column and i.mother in column],
+                              dtype=np.int64).reshape(-1, 3)
+        if DE_NOVO in self.models and not len(self.trios):
+            print("Inheritance: de novo model needs an affected child with both parents in the VCF; skipped")
+            self.models.remove(DE_NOVO)
+
+    def variant_masks(self, genotypes: np.ndarray, chroms: List[str]) -> Dict[str, np.ndarray]:
+        """Boolean mask over the variants (rows of `genotypes`) for each model
+
+        The compound heterozygous mask marks candidates only; pairs are checked per gene in apply().
+        """
+        autosomal = np.fromiter((is_autosome(chrom) for chrom in chroms), dtype=bool, count=len(chroms))
+        x_linked = np.fromiter((is_x(chrom) for chrom in chroms), dtype=bool, count=len(chroms))
+        g = genotypes
+        masks = {}
+        if DE_NOVO in self.models:
+            child, father, mother = (g[:, self.trios[:, i]] for i in range(3))
+            masks[DE_NOVO] = (((child >= HET) & (father == HOM_REF) & (mother == HOM_REF)).all(axis=1)
+                              & _all(g, self.unaffected, HOM_REF))
+        if AUTOSOMAL_RECESSIVE in self.models:
+            parents = g[:, self.trios[:, 1:].ravel()]
+            masks[AUTOSOMAL_RECESSIVE] = (autosomal & (g[:, self.affected] == HOM_ALT).all(axis=1)
+                                          & _none(g, self.unaffected, HOM_ALT)
+                                          & ((parents >= HET) | (parents == MISSING)).all(axis=1))
+        if COMPOUND_HET in self.models:
+            masks[COMPOUND_HET] = (autosomal & (g[:, self.affected] == HET).all(axis=1)
+                                   & _none(g, self.unaffected, HOM_ALT))
+        if X_LINKED in self.models:
+            # Recessive: hemizygous affected males, homozygous affected females, no hemizygous unaffected males
+            masks[X_LINKED] = (x_linked & (g[:, self.affected_males] >= HET).all(axis=1)
+                               & (g[:, self.affected_others] == HOM_ALT).all(axis=1)
+                               & _all(g, self.unaffected_males, HOM_REF)
+                               & _none(g, self.unaffected_females, HOM_ALT))
+        return masks
+
+    def origins(self, genotypes: np.ndarray) -> np.ndarray:
+        """Parental origin of each variant from the first trio: PATERNAL, MATERNAL or UNKNOWN"""
+        origin = np.full(len(genotypes), UNKNOWN, dtype=np.int8)
+        if len(self.trios):
+            father = genotypes[:, self.trios[0, 1]]
+            mother = genotypes[:, self.trios[0, 2]]
+            origin[(father >= HET) & (mother == HOM_REF)] = PATERNAL
+            origin[(mother >= HET) & (father == HOM_REF)] = MATERNAL
+        return origin
+
+    def compound_pairs(self, genotypes: np.ndarray, origins: np.ndarray, keys: np.ndarray) -> np.ndarray:
+        """Candidates of one gene that form a compound heterozygous pair with another candidate
+
+        A pair needs two distinct variants, not both from the same parent, and
+        no unaffected individual carrying both.
+        """
+        different = keys[:, None] != keys[None, :]
+        phased = (origins[:, None] != origins[None, :]) | (origins[:, None] == UNKNOWN) | (origins[None, :] == UNKNOWN)
+        carriers = (genotypes[:, self.unaffected] >= HET).astype(np.int32)
+        both_carried = (carriers @ carriers.T) > 0
+        return (different & phased & ~both_carried).any(axis=1)
+
+    def apply(self, genes: Dict[str, List[Dict]]) -> Dict[str, List[Dict]]:
+        """Filter scan results whose variants carry a 'genotypes' row
+
+        Kept variants get an 'inheritance' list of the models they fit;
+        genes without any kept variant are dropped.
+        """
+        records = [(gene, variant) for gene, variants in genes.items() for variant in variants]
+        if not records:
+            return {}
+        genotypes = np.stack([variant['genotypes'] for _, variant in records])
+        masks = self.variant_masks(genotypes, [variant['chrom'] for _, variant in records])
+
+        if COMPOUND_HET in masks:
+            candidates = masks[COMPOUND_HET]
+            origins = self.origins(genotypes)
+            _, keys = np.unique([f"{v['chrom']}:{v['pos']}:{v['ref']}:{v['alt']}" for _, v in records],
+                                return_inverse=True)
+            _, gene_ids = np.unique([gene for gene, _ in records], return_inverse=True)
+            # Candidate rows grouped by gene; a gene needs at least two to form a pair
+            rows = np.flatnonzero(candidates)
+            rows = rows[np.argsort(gene_ids[rows], kind="stable")]
+            starts = np.flatnonzero(np.diff(gene_ids[rows], prepend=-1))
+            paired = np.zeros(len(records), dtype=bool)
+            for group in np.split(rows, starts[1:]):
+                if len(group) > 1:
+                    paired[group] = self.compound_pairs(genotypes[group], origins[group], keys[group])
+            masks[COMPOUND_HET] = paired
+
+        kept = {}
+        for row, (gene, variant) in enumerate(records):
+            models = [model for model, mask in masks.items() if mask[row]]
+            if models:
+                variant = {key: value for key, value in variant.items() if key != 'genotypes'}
+                variant['inheritance'] = models
+                kept.setdefault(gene, []).append(variant)
+        return kept
+
+
+def _all(genotypes: np.ndarray, columns: np.ndarray, code: int) -> np.ndarray:
+    """Every individual in `columns` has `code` or a missing genotype"""
+    sub = genotypes[:, columns]
+    return ((sub == code) | (sub == MISSING)).all(axis=1)
+
+def _none(genotypes: np.ndarray, columns: np.ndarray, code: int) -> np.ndarray:
+    """No individual in `columns` has `code`"""
+    return (genotypes[:, columns] != code).all(axis=1)
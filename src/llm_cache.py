@@ -0,0 +1,154 @@
+from typing import Any, Dict, List, Optional
+import threading
+import hashlib
+import sqlite3
+import json
+import time
+import os
+
+from tracing import span
+
+OFF = "off"
+RECORD = "record"
+REPLAY = "replay"
+MODES = (OFF, RECORD, REPLAY)
+
+
+class CacheMissError(RuntimeError):
+    """Raised in replay mode when a request has no cached response"""
+
+
+class ResponseCache:
+    def __init__(self, path: str = "data/llm_cache.db", mode: str = RECORD, max_bytes: int = 1 << 30):
+        """Persistent LLM response cache keyed by a hash of the request
+
+        Args:
+            path: SQLite database file.
+            mode: "record" serves hits and stores misses, "replay" serves hits and
+                raises CacheMissError on a miss, "off" bypasses the cache.
+            max_bytes: Least recently used responses are evicted above this total size.
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown cache mode {mode}, expected one of {', '.join(MODES)}")
+        self.path = path
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.local = threading.local()
+        if mode != OFF:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._connect().execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT, size INTEGER, accessed_at REAL)")
+            self._connect().execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self.local.conn = conn
+        return conn
+
+    @staticmethod
+    def key(model: str, temperature: Optional[float], messages: List[Dict], tools: Optional[List[Dict]] = None,
+            response_format: Optional[Dict] = None) -> str:
+        """Content address of a request: SHA-256 of its canonical JSON form"""
+        payload = json.dumps({
+            "model": model,
+            "temperature": temperature,
+            "messages": messages,
+            "tools": tools,
+            "response_format": response_format,
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        if self.mode == OFF:
+            return None
+        conn = self._connect()
+        row = conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            if self.mode == REPLAY:
+                raise CacheMissError(f"No cached LLM response for request {key} (replay mode)")
+            return None
+        conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        if self.mode != RECORD:
+            return
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT OR REPLACE INTO responses (key, value, size, accessed_at) VALUES (?, ?, ?, ?)",
+                         (key, value, len(value.encode()), time.time()))
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                # Evict least recently used responses until the cache fits again
+                excess = total - self.max_bytes
+                stale = []
+                for stale_key, size in conn.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+                    if excess <= 0:
+                        break
+                    stale.append((stale_key,))
+                    excess -= size
+                conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def configure_cache(mode: str = RECORD, path: str = "data/llm_cache.db", max_bytes: int = 1 << 30) -> ResponseCache:
+    """Set the process-wide response cache used by the agents and the generator"""
+    global _cache
+    with _cache_lock:
+        _cache = ResponseCache(path, mode, max_bytes)
+        return _cache
+
+def wrap_model(model) -> Any:
+    """Serve a camel model backend's run() through the process-wide cache
+
+    The cache is looked up on every call, so configure_cache() also applies
+    to models created earlier. Streamed responses are not cached.
+    """
+    run = model.run
+    def traced_run(messages, response_format=None, tools=None):
+        with span("llm.completion", model=str(model.model_type)) as trace:
+            response = run(messages, response_format, tools)
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                trace.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+            return response
+    def cached_run(messages, response_format=None, tools=None):
+        cache = get_cache()
+        if cache.mode == OFF:
+            return traced_run(messages, response_format, tools)
+        from openai.types.chat import ChatCompletion
+
+        schema = response_format.model_json_schema() if response_format is not None else None
+        key = cache.key(str(model.model_type), model.model_config_dict.get("temperature"),
+                        messages, tools, schema)
+        with span("llm_cache.get") as trace:
+            value = cache.get(key)
+            trace.set(hit=value is not None)
+        if value is not None:
+            return ChatCompletion.model_validate_json(value)
+        response = traced_run(messages, response_format, tools)
+        if isinstance(response, ChatCompletion):
+            cache.put(key, response.model_dump_json())
+        return response
+    model.run = cached_run
+    return model
+
+def get_cache() -> ResponseCache:
+    """Return the process-wide response cache, configured from LLM_CACHE_MODE/LLM_CACHE_PATH by default"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(os.getenv("LLM_CACHE_PATH", "data/llm_cache.db"),
+                                   os.getenv("LLM_CACHE_MODE", OFF))
+        return _cache
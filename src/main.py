@@ -1,8 +1,16 @@
-from collections import defaultdict
-from agents import generate_interpretation
+from vcf import process_vcf
+from llm_cache import MODES, OFF, configure_cache
+import tracing
 import argparse
 import os
 
+# The agents (camel), the generator and the prefilter (numpy) are imported where
+# they are used, so --help and argument errors return without loading them;
+# bench/importtime.py guards this.
+
+# Context tokens for --stream when --token_budget is not given
+DEFAULT_STREAM_BUDGET = 60000
+
 def main():
     # Set up command line interface
     parser = argparse.ArgumentParser(description="VCF Analysis and Interpretation System for Genetic Variants")
@@ -14,20 +22,72 @@ def main():
     parser.add_argument("--top_k", type=int, default=5, help="Total number of articles to retrieve (default: 3)")
     parser.add_argument("--openrouter_model", type=str, default="deepseek/deepseek-r1:free",
                        help="OpenRouter model to use (default: deepseek/r1:free)")
+    parser.add_argument("--region", action="append",
+                        help="Only parse variants in this region (chrom[:start-end]); needs a .tbi/.csi index. Repeatable")
+    parser.add_argument("--token_budget", type=int,
+                        help="Pack retrieved articles directly into this many context tokens instead of using the tool agents")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream the answer into the report as it is generated (uses packed context)")
+    parser.add_argument("--llm_cache", choices=MODES, default=OFF,
+                        help="LLM response cache: record new responses, replay cached ones only, or off (default: off)")
+    parser.add_argument("--llm_cache_path", default="data/llm_cache.db", help="LLM response cache database")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes used to parse the VCF (default: 1)")
+    parser.add_argument("--filter",
+                        help="Variant filter over VEP CSQ fields, e.g. \"IMPACT in (HIGH, MODERATE) and gnomAD_AF < 0.001\" "
+                             "(default: high-impact consequences; see variant_filter.py)")
+    parser.add_argument("--ped", help="PED file of the VCF samples; keeps only variants fitting an inheritance model")
+    parser.add_argument("--inheritance",
+                        help="Comma-separated models tested with --ped: de_novo, autosomal_recessive, compound_het, "
+                             "x_linked (default: all)")
+    parser.add_argument("--shard_size", type=int,
+                        help="Rank longer gene lists in shards of this many genes, then rerank the best of each shard")
+    parser.add_argument("--shard_concurrency", type=int, default=4, help="Number of shards ranked concurrently (default: 4)")
+    parser.add_argument("--shard_top", type=int, default=5,
+                        help="Genes of each shard that go to the final rerank (default: 5)")
+    parser.add_argument("--prefilter_top_k", type=int,
+                        help="Only send the genes most similar to the phenotypes (HPO annotations) to the LLM")
+    parser.add_argument("--prefilter_threshold", type=float,
+                        help="Only send genes whose phenotype similarity is at least this score to the LLM")
+    parser.add_argument("--profile", nargs="?", const="data/trace.jsonl",
+                        help="Trace every stage, write the spans to this JSON lines file (default: data/trace.jsonl) "
+                             "and print a per-stage summary")
+    parser.add_argument("--chrome_trace", help="With --profile, also write a chrome://tracing / Perfetto trace here")
     args = parser.parse_args()
     
     # Parse VCF and find high-impact variants
-    if not args.vcf and not args.ranked_genes:
-        parser.error("Either VCF file or --ranked_genes must be provided")
+    if not args.vcf and not args.genes:
+        parser.error("Either a VCF file or --genes must be provided")
     
     if not args.phenotypes:
         parser.error("Phenotypes must be provided")
+    if args.inheritance:
+        if not args.ped:
+            parser.error("--inheritance needs a --ped file")
+        # Imported here because inheritance loads numpy
+        from inheritance import MODELS
+
+        args.inheritance = [model.strip() for model in args.inheritance.split(",") if model.strip()]
+        unknown = [model for model in args.inheritance if model not in MODELS]
+        if unknown or not args.inheritance:
+            parser.error(f"--inheritance: unknown models {', '.join(unknown) or '(none given)'}; "
+                         f"expected {', '.join(MODELS)}")
+    configure_cache(args.llm_cache, args.llm_cache_path)
+    if args.profile:
+        tracing.enable(args.profile)
+    try:
+        run(args)
+    finally:
+        tracing.finish(args.chrome_trace)
+
+def run(args):
     phenotypes = args.phenotypes.split(",")
     high_impact_genes = {}
     
     # Process VCF if provided
     if args.vcf:
-        vcf_genes = process_vcf(args.vcf)
+        vcf_genes = process_vcf(args.vcf, regions=args.region, workers=args.workers, ped_path=args.ped,
+                                models=args.inheritance,
+                                filter_expression=args.filter)
         if vcf_genes:
             high_impact_genes.update(vcf_genes)
         else:
@@ -43,58 +103,54 @@ def main():
             high_impact_genes[gene] = []
     print(high_impact_genes)
     # Get all genes for combined query
-    genes = high_impact_genes.keys()
+    genes = list(high_impact_genes.keys())
+    hints = None
+    if genes and (args.prefilter_top_k is not None or args.prefilter_threshold is not None):
+        from prefilter import prefilter_genes
+
+        hints = prefilter_genes(genes, phenotypes, args.prefilter_top_k, args.prefilter_threshold)
+        print(f"Prefilter kept {len(hints)} of {len(genes)} genes")
+        genes = list(hints)
     if genes:
         print(f"Found {len(genes)} high-impact genes: {', '.join(genes)}")
+        if args.stream:
+            stream_report(', '.join(genes), ', '.join(phenotypes), args)
+            print(f"\nReport generated successfully: {args.output}")
+            return
+        from agents import generate_interpretation
+
         interpretation = generate_interpretation(
             genes=', '.join(genes),
             phenotypes=', '.join(phenotypes),
-            model_type=args.openrouter_model
+            model_type=args.openrouter_model,
+            token_budget=args.token_budget,
+            shard_size=args.shard_size,
+            shard_concurrency=args.shard_concurrency,
+            shard_top=args.shard_top,
+            hints=hints,
         )
         print("Generating interpretation...")
         with open(args.output, 'w') as report_file:
             report_file.write(interpretation)
     print(f"\nReport generated successfully: {args.output}")
 
-def process_vcf(vcf_path: str) -> dict:
-    """Parse VCF file and return genes with high-impact variants"""
-    high_impact_consequences = {
-        'transcript_ablation',
-        'splice_acceptor_variant',
-        'splice_donor_variant',
-        'stop_gained',
-        'frameshift_variant',
-        'stop_lost'
-    }
-    
-    genes = defaultdict(list)
-    
-    with open(vcf_path, 'r') as vcf:
-        for line in vcf:
-            if line.startswith('#'):
-                continue
-                
-            fields = line.strip().split('\t')
-            info = {k.split('=')[0]: k.split('=')[1] for k in fields[7].split(';') if '=' in k}
-            
-            if 'CSQ' not in info:
-                continue
-                
-            for annotation in info['CSQ'].split(','):
-                csq = annotation.split('|')
-                consequence = csq[1]
-                gene = csq[3]
-                
-                if consequence in high_impact_consequences:
-                    genes[gene].append({
-                        'chrom': fields[0],
-                        'pos': fields[1],
-                        'ref': fields[3],
-                        'alt': fields[4],
-                        'consequence': consequence
-                    })
-    
-    return genes
+def stream_report(genes: str, phenotypes: str, args):
+    """Write the report while the answer streams in, using directly packed context"""
+    from agents import build_packed_context
+    from generation.generator import OpenRouterGenerator
+
+    generator = OpenRouterGenerator(args.openrouter_model)
+    packed = build_packed_context(genes, phenotypes, args.token_budget or DEFAULT_STREAM_BUDGET)
+    context = "\n\n".join(section for section in packed.sections.values() if section)
+    print("Generating interpretation...")
+    with open(args.output, 'w') as report_file:
+        for text in generator.stream_answer(genes, phenotypes, context):
+            report_file.write(text)
+            report_file.flush()
+            print(text, end='', flush=True)
+    if tracing.enabled():
+        # Wait for the background cost lookup so it is part of the profile
+        generator.usage.flush()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
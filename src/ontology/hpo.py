@@ -0,0 +1,244 @@
+from typing import List, Dict, Optional, Tuple
+import numpy as np
+import threading
+import argparse
+import json
+import mmap
+import os
+
+HPO_PREFIX = "http://purl.obolibrary.org/obo/HP_"
+MAGIC = b"HPOB\x01\x00\x00\x00"
+# Arrays persisted after the header, in this order
+ARRAYS = ("parents_indptr", "parents", "ancestors_indptr", "ancestors")
+
+
+def parse_obo(path: str) -> List[Dict]:
+    """Parse the [Term] stanzas of hp.obo"""
+    terms = []
+    term = None
+    with open(path) as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line.startswith("["):
+                term = {"synonyms": [], "is_a": [], "definition": []} if line == "[Term]" else None
+                if term is not None:
+                    terms.append(term)
+                continue
+            if term is None or ": " not in line:
+                continue
+            key, value = line.split(": ", 1)
+            if key == "id":
+                term["id"] = value
+            elif key == "name":
+                term["label"] = value
+            elif key == "def":
+                term["definition"] = [value[1:value.rfind('"')] if value.startswith('"') else value]
+            elif key == "synonym":
+                term["synonyms"].append(value[1:value.find('"', 1)])
+            elif key == "is_a":
+                term["is_a"].append(value.split(" ! ")[0].strip())
+            elif key == "is_obsolete" and value == "true":
+                term["obsolete"] = True
+    return [t for t in terms if "id" in t and not t.get("obsolete")]
+
+def parse_json(path: str) -> List[Dict]:
+    """Parse the obographs hp.json release"""
+    with open(path) as f:
+        graph = json.load(f)["graphs"][0]
+    terms = {}
+    for node in graph.get("nodes", []):
+        meta = node.get("meta", {})
+        if node.get("type", "CLASS") != "CLASS" or meta.get("deprecated") or not node["id"].startswith(HPO_PREFIX):
+            continue
+        term_id = node["id"].replace(HPO_PREFIX, "HP:")
+        terms[term_id] = {
+            "id": term_id,
+            "label": node.get("lbl", ""),
+            "definition": [meta["definition"]["val"]] if "definition" in meta else [],
+            "synonyms": [s["val"] for s in meta.get("synonyms", [])],
+            "is_a": [],
+        }
+    for edge in graph.get("edges", []):
+        if edge["pred"] != "is_a":
+            continue
+        sub = edge["sub"].replace(HPO_PREFIX, "HP:")
+        obj = edge["obj"].replace(HPO_PREFIX, "HP:")
+        if sub in terms:
+            terms[sub]["is_a"].append(obj)
+    return list(terms.values())
+
+
+class HpoOntology:
+    def __init__(self, ids: List[str], labels: List[str], definitions: List[List[str]],
+                 synonyms: List[List[str]], arrays: Dict[str, np.ndarray]):
+        """Array-backed HPO graph with a precomputed ancestor closure
+
+        Terms are addressed by position; parents and ancestors are CSR arrays
+        (indptr, indices) of int32 term positions.
+        """
+        self.ids = ids
+        self.labels = labels
+        self.definitions = definitions
+        self.synonyms = synonyms
+        self.parents_indptr = arrays["parents_indptr"]
+        self.parents_indices = arrays["parents"]
+        self.ancestors_indptr = arrays["ancestors_indptr"]
+        self.ancestors_indices = arrays["ancestors"]
+        self.index = {term_id: i for i, term_id in enumerate(ids)}
+        self.label_index = {label.lower(): i for i, label in enumerate(labels)}
+        self.synonym_index = {}
+        for i, names in enumerate(synonyms):
+            for name in names:
+                self.synonym_index.setdefault(name.lower(), i)
+
+    @classmethod
+    def from_terms(cls, terms: List[Dict]) -> "HpoOntology":
+        ids = [t["id"] for t in terms]
+        index = {term_id: i for i, term_id in enumerate(ids)}
+        parents = [[index[p] for p in t["is_a"] if p in index] for t in terms]
+
+        # Ancestor closure (excluding the term itself), memoized over the DAG
+        closure: List[Optional[Tuple[int, ...]]] = [None] * len(ids)
+        for start in range(len(ids)):
+            stack = [start]
+            while stack:
+                node = stack[-1]
+                if closure[node] is not None:
+                    stack.pop()
+                    continue
+                pending = [p for p in parents[node] if closure[p] is None]
+                if pending:
+                    stack.extend(pending)
+                    continue
+                ancestors = set(parents[node])
+                for p in parents[node]:
+                    ancestors.update(closure[p])
+                closure[node] = tuple(sorted(ancestors))
+                stack.pop()
+
+        def csr(lists):
+            indptr = np.zeros(len(lists) + 1, dtype=np.int32)
+            indptr[1:] = np.cumsum([len(l) for l in lists])
+            indices = np.fromiter((i for l in lists for i in l), dtype=np.int32, count=int(indptr[-1]))
+            return indptr, indices
+
+        arrays = {}
+        arrays["parents_indptr"], arrays["parents"] = csr(parents)
+        arrays["ancestors_indptr"], arrays["ancestors"] = csr(closure)
+        return cls(ids, [t.get("label", "") for t in terms], [t["definition"] for t in terms],
+                   [t["synonyms"] for t in terms], arrays)
+
+    @classmethod
+    def from_source(cls, path: str) -> "HpoOntology":
+        """Build the ontology from hp.obo or hp.json"""
+        return cls.from_terms(parse_json(path) if path.endswith(".json") else parse_obo(path))
+
+    def save(self, path: str) -> None:
+        """Write the binary form: magic, JSON header length, JSON header, then 8-byte aligned arrays"""
+        arrays = [np.ascontiguousarray(getattr(self, name if name.endswith("indptr") else f"{name}_indices"))
+                  for name in ARRAYS]
+        header = json.dumps({
+            "ids": self.ids,
+            "labels": self.labels,
+            "definitions": self.definitions,
+            "synonyms": self.synonyms,
+            "lengths": [len(a) for a in arrays],
+        }).encode()
+        header += b" " * (-(len(MAGIC) + 8 + len(header)) % 8)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC)
+            f.write(len(header).to_bytes(8, "little"))
+            f.write(header)
+            for array in arrays:
+                f.write(array.astype("<i4").tobytes())
+                f.write(b"\0" * (-array.nbytes % 8))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "HpoOntology":
+        """Memory-map a file written by save(); the arrays are read lazily by the OS"""
+        with open(path, "rb") as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if buf[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"Not an HPO binary file: {path}")
+        header_len = int.from_bytes(buf[len(MAGIC):len(MAGIC) + 8], "little")
+        offset = len(MAGIC) + 8
+        header = json.loads(buf[offset:offset + header_len])
+        offset += header_len
+        arrays = {}
+        for name, length in zip(ARRAYS, header["lengths"]):
+            arrays[name] = np.frombuffer(buf, dtype="<i4", count=length, offset=offset)
+            offset += length * 4 + (-length * 4 % 8)
+        return cls(header["ids"], header["labels"], header["definitions"], header["synonyms"], arrays)
+
+    def lookup(self, phenotype: str) -> Optional[int]:
+        """Position of a term given its ID, label or synonym"""
+        phenotype = phenotype.strip()
+        if phenotype in self.index:
+            return self.index[phenotype]
+        phenotype = phenotype.lower()
+        if phenotype in self.label_index:
+            return self.label_index[phenotype]
+        return self.synonym_index.get(phenotype)
+
+    def parents(self, term: int) -> np.ndarray:
+        return self.parents_indices[self.parents_indptr[term]:self.parents_indptr[term + 1]]
+
+    def ancestors(self, term: int) -> np.ndarray:
+        return self.ancestors_indices[self.ancestors_indptr[term]:self.ancestors_indptr[term + 1]]
+
+    def background_knowledge(self, phenotype: str) -> Optional[str]:
+        """Describe a phenotype in the same format as tools.aberowl_hpo, or None when unknown"""
+        term = self.lookup(phenotype)
+        if term is None:
+            return None
+        definitions = self.definitions[term]
+        synonyms = self.synonyms[term]
+        superclasses = [self.labels[p] for p in self.parents(term)]
+        return f"""phenotype: {self.labels[term]} ({self.ids[term]})\n
+Definition: {', '.join(definitions) if definitions else 'No definition available'}\n
+Synonyms: {', '.join(synonyms) if synonyms else 'No synonyms available'}\n
+Subclass of: {', '.join(superclasses) if superclasses else 'No superclasses available'}\n"""
+
+
+def load_ontology(binary_path: str = "data/hp.bin", sources=("data/hp.obo", "data/hp.json")) -> Optional[HpoOntology]:
+    """Load the binary ontology, rebuilding it when a newer hp.obo/hp.json is present
+
+    Returns None when neither the binary file nor a source release exists.
+    """
+    source = next((s for s in sources if os.path.exists(s)), None)
+    if os.path.exists(binary_path) and (source is None or os.path.getmtime(binary_path) >= os.path.getmtime(source)):
+        return HpoOntology.load(binary_path)
+    if source is None:
+        return None
+    ontology = HpoOntology.from_source(source)
+    ontology.save(binary_path)
+    return HpoOntology.load(binary_path)
+
+
+_ontology = None
+_ontology_loaded = False
+_ontology_lock = threading.Lock()
+
+def get_ontology() -> Optional[HpoOntology]:
+    """Return the process-wide HPO ontology, loading it on first use"""
+    global _ontology, _ontology_loaded
+    with _ontology_lock:
+        if not _ontology_loaded:
+            _ontology = load_ontology()
+            _ontology_loaded = True
+        return _ontology
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the memory-mapped HPO ontology file")
+    parser.add_argument("source", help="hp.obo or hp.json release")
+    parser.add_argument("-o", "--output", default="data/hp.bin", help="Binary output file")
+    args = parser.parse_args()
+    ontology = HpoOntology.from_source(args.source)
+    ontology.save(args.output)
+    print(f"Saved {len(ontology.ids)} HPO terms to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""Local phenotype-similarity prefilter for candidate genes.
+
+Genes are scored against the patient's HPO terms with Resnik similarity and
+best-match average (BMA) over the HPO gene-phenotype annotations in
+genes_to_phenotype.txt. Only the best genes go to the LLM, with their scores
+as hints.
+"""
+from typing import Dict, List, Optional
+import threading
+import os
+
+import numpy as np
+
+from ontology.hpo import HpoOntology, get_ontology
+
+ANNOTATIONS_PATH = "data/genes_to_phenotype.txt"
+
+
+def parse_annotations(path: str) -> Dict[str, List[str]]:
+    """Gene symbol -> HPO term IDs of genes_to_phenotype.txt
+
+    Accepts the current release (header line starting with ncbi_gene_id) and
+    the legacy one (#-comment header, symbol in the second column as well).
+    """
+    annotations = {}
+    with open(path) as f:
+        for line in f:
+            if line.startswith("#") or line.startswith("ncbi_gene_id"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) >= 3 and fields[2].startswith("HP:"):
+                annotations.setdefault(fields[1], []).append(fields[2])
+    return annotations
+
+
+class GenePhenotypeScorer:
+    def __init__(self, ontology: HpoOntology, annotations: Dict[str, List[str]]):
+        """Resnik/BMA similarity between gene annotation profiles and patient phenotypes
+
+        Gene profiles are stored as a CSR matrix of term positions and the
+        information content of every term is precomputed from the annotations,
+        so scoring all genes is a handful of NumPy reductions.
+        """
+        self.ontology = ontology
+        n_terms = len(ontology.ids)
+        self.genes = []
+        profiles = []
+        for gene, term_ids in annotations.items():
+            terms = sorted({ontology.index[t] for t in term_ids if t in ontology.index})
+            if terms:
+                self.genes.append(gene)
+                profiles.append(terms)
+        self.gene_index = {gene: i for i, gene in enumerate(self.genes)}
+        self.indptr = np.zeros(len(profiles) + 1, dtype=np.int64)
+        self.indptr[1:] = np.cumsum([len(terms) for terms in profiles])
+        self.terms = np.fromiter((t for terms in profiles for t in terms), dtype=np.int32, count=int(self.indptr[-1]))
+
+        # Ancestor closure including each term itself, as CSR arrays
+        anc_indptr = ontology.ancestors_indptr.astype(np.int64)
+        sizes = np.diff(anc_indptr) + 1
+        self.closure_indptr = np.zeros(n_terms + 1, dtype=np.int64)
+        self.closure_indptr[1:] = np.cumsum(sizes)
+        self.closure = np.empty(int(self.closure_indptr[-1]), dtype=np.int32)
+        self.closure[self.closure_indptr[:-1]] = np.arange(n_terms, dtype=np.int32)
+        offsets = np.repeat(self.closure_indptr[:-1] + 1 - anc_indptr[:-1], np.diff(anc_indptr))
+        self.closure[np.arange(len(ontology.ancestors_indices)) + offsets] = ontology.ancestors_indices
+
+        # Transpose of the closure: the descendants of each term, including itself
+        owners = np.repeat(np.arange(n_terms, dtype=np.int32), sizes)
+        order = np.argsort(self.closure, kind="stable")
+        self.descendants = owners[order]
+        self.descendants_indptr = np.zeros(n_terms + 1, dtype=np.int64)
+        self.descendants_indptr[1:] = np.cumsum(np.bincount(self.closure, minlength=n_terms))
+
+        # Information content: -log of the fraction of genes annotated with a term or its descendants
+        counts = np.zeros(n_terms, dtype=np.int64)
+        for start in range(0, len(self.genes), 1024):
+            counts += self._annotated_counts(start, min(start + 1024, len(self.genes)), sizes)
+        with np.errstate(divide="ignore"):
+            self.ic = np.where(counts > 0, -np.log(counts / max(len(self.genes), 1)), 0.0).astype(np.float32)
+
+    @classmethod
+    def from_annotations(cls, ontology: HpoOntology, path: str = ANNOTATIONS_PATH) -> "GenePhenotypeScorer":
+        return cls(ontology, parse_annotations(path))
+
+    def _annotated_counts(self, start: int, stop: int, sizes: np.ndarray) -> np.ndarray:
+        """Number of genes in [start, stop) annotated with each term or one of its descendants"""
+        n_terms = len(sizes)
+        terms = self.terms[self.indptr[start]:self.indptr[stop]]
+        gene_of_term = np.repeat(np.arange(start, stop, dtype=np.int64), np.diff(self.indptr[start:stop + 1]))
+        term_sizes = sizes[terms]
+        offsets = np.arange(int(term_sizes.sum())) - np.repeat(np.cumsum(term_sizes) - term_sizes, term_sizes)
+        ancestors = self.closure[np.repeat(self.closure_indptr[terms], term_sizes) + offsets]
+        pairs = np.unique(np.repeat(gene_of_term, term_sizes) * n_terms + ancestors)
+        return np.bincount(pairs % n_terms, minlength=n_terms)
+
+    def _closure(self, term: int) -> np.ndarray:
+        return self.closure[self.closure_indptr[term]:self.closure_indptr[term + 1]]
+
+    def patient_terms(self, phenotypes: List[str]) -> List[int]:
+        """Term positions of phenotype IDs, labels or synonyms; unknown phenotypes are skipped"""
+        terms = []
+        for phenotype in phenotypes:
+            term = self.ontology.lookup(phenotype)
+            if term is None:
+                print(f"Prefilter: phenotype not in HPO, ignored: {phenotype}")
+            elif term not in terms:
+                terms.append(term)
+        return terms
+
+    def term_similarity(self, patient_terms: List[int]) -> np.ndarray:
+        """Resnik similarity of each patient term to every HPO term, shape (patient terms, terms)
+
+        sim(p, t) is the IC of the most informative common ancestor of p and t.
+        Each ancestor of p hands its IC to all of its descendants, from the least
+        to the most informative, so the last write is the maximum.
+        """
+        similarity = np.zeros((len(patient_terms), len(self.ic)), dtype=np.float32)
+        for row, term in enumerate(patient_terms):
+            closure = self._closure(term)
+            for ancestor in closure[np.argsort(self.ic[closure], kind="stable")]:
+                descendants = self.descendants[self.descendants_indptr[ancestor]:self.descendants_indptr[ancestor + 1]]
+                similarity[row, descendants] = self.ic[ancestor]
+        return similarity
+
+    def score(self, genes: List[str], phenotypes: List[str]) -> Dict[str, float]:
+        """BMA similarity of each gene to the phenotypes; genes without annotations score 0"""
+        scores = dict.fromkeys(genes, 0.0)
+        patient_terms = self.patient_terms(phenotypes)
+        if not patient_terms or not self.genes:
+            return scores
+        similarity = self.term_similarity(patient_terms)
+        # Patient -> gene: best match of every patient term among all annotated terms of each gene
+        by_gene = np.maximum.reduceat(similarity[:, self.terms], self.indptr[:-1], axis=1).mean(axis=0)
+        # Gene -> patient: best match of every annotated term among the patient terms, averaged per gene
+        best_patient = similarity.max(axis=0)[self.terms]
+        by_term = np.add.reduceat(best_patient, self.indptr[:-1]) / np.diff(self.indptr)
+        bma = 0.5 * (by_gene + by_term)
+        for gene in genes:
+            i = self.gene_index.get(gene)
+            if i is not None:
+                scores[gene] = float(bma[i])
+        return scores
+
+
+def prefilter_genes(genes: List[str], phenotypes: List[str], top_k: Optional[int] = None,
+                    threshold: Optional[float] = None, scorer: Optional[GenePhenotypeScorer] = None) -> Dict[str, float]:
+    """Keep the genes most similar to the phenotypes
+
+    Returns:
+        Kept gene -> score, best first. All genes, unscored, when no
+        annotations or ontology are available.
+    """
+    scorer = scorer or get_scorer()
+    if scorer is None:
+        print(f"Prefilter: {ANNOTATIONS_PATH} or the HPO ontology is missing, keeping all genes")
+        return dict.fromkeys(genes, None)
+    scores = scorer.score(genes, phenotypes)
+    ranked = sorted(genes, key=lambda gene: -scores[gene])
+    if threshold is not None:
+        ranked = [gene for gene in ranked if scores[gene] >= threshold]
+    if top_k is not None:
+        ranked = ranked[:top_k]
+    return {gene: scores[gene] for gene in ranked}
+
+def format_hints(scores: Dict[str, Optional[float]]) -> str:
+    """Score lines for the ranking prompt"""
+    return "\n".join(f"{gene}: {score:.2f}" for gene, score in scores.items() if score is not None)
+
+
+_scorer = None
+_scorer_loaded = False
+_scorer_lock = threading.Lock()
+
+def get_scorer(path: str = ANNOTATIONS_PATH) -> Optional[GenePhenotypeScorer]:
+    """Return the process-wide scorer, or None when the annotations or the ontology are missing"""
+    global _scorer, _scorer_loaded
+    with _scorer_lock:
+        if not _scorer_loaded:
+            ontology = get_ontology()
+            if ontology is not None and os.path.exists(path):
+                _scorer = GenePhenotypeScorer.from_annotations(ontology, path)
+            _scorer_loaded = True
+        return _scorer
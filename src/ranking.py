@@ -0,0 +1,70 @@
+from typing import Dict, List, Optional
+from pydantic import BaseModel, Field, ValidationError
+import json
+import re
+
+
+class GeneRanking(BaseModel):
+    rank: int = Field(description="Position of the gene, 1 for the most likely causative gene")
+    gene: str = Field(description="Gene symbol exactly as given in the candidate list")
+    score: float = Field(description="Confidence from 0 to 1 that the gene explains the phenotypes")
+    interpretation: str = Field(description="Evidence linking the gene to the phenotypes")
+
+
+class GeneRankings(BaseModel):
+    """Structured output schema of the ranking step"""
+    rankings: List[GeneRanking]
+
+
+class Interpretation:
+    def __init__(self, text: str, rankings: Optional[List[GeneRanking]] = None):
+        """Markdown interpretation of a patient, with the structured ranking it was rendered from
+
+        `rankings` is None when the model did not return valid structured
+        output; `text` is then its raw answer.
+        """
+        self.text = text
+        self.rankings = rankings
+
+    def records(self) -> Optional[List[Dict]]:
+        """The rankings as JSON-serializable dicts, for checkpoints and sidecars"""
+        if self.rankings is None:
+            return None
+        return [ranking.model_dump() for ranking in self.rankings]
+
+
+def parse_rankings(message) -> Optional[List[GeneRanking]]:
+    """Structured rankings of a ranking step's message, or None if it is not valid structured output
+
+    camel sets `parsed` on the message; responses replayed from the LLM cache
+    only carry the JSON content, so that is validated as well.
+    """
+    parsed = getattr(message, "parsed", None)
+    if isinstance(parsed, GeneRankings):
+        return sorted(parsed.rankings, key=lambda ranking: ranking.rank)
+    content = (message.content or "").strip()
+    # Some models wrap JSON output in a markdown code fence
+    fenced = re.match(r"^```(?:json)?\s*(.*?)\s*```$", content, re.S)
+    if fenced:
+        content = fenced.group(1)
+    try:
+        return sorted(GeneRankings.model_validate_json(content).rankings, key=lambda ranking: ranking.rank)
+    except (ValidationError, json.JSONDecodeError, ValueError):
+        return None
+
+def render_markdown(rankings: List[GeneRanking]) -> str:
+    """Render rankings in the Rank/Gene/Interpretation report format"""
+    return "\n\n".join(f"Rank: {ranking.rank}\nGene: {ranking.gene}\nScore: {ranking.score:.2f}\n"
+                       f"Interpretation: {ranking.interpretation}" for ranking in rankings)
+
+def gene_key(gene: str) -> str:
+    """Gene symbol compared case-insensitively, without whitespace or markdown emphasis"""
+    return gene.strip("*_` \t\n").upper()
+
+def rank_of(rankings: List[Dict], gene: str) -> Optional[int]:
+    """Rank of a gene in sidecar ranking records, ignoring case and markdown emphasis"""
+    gene = gene_key(gene)
+    for ranking in rankings:
+        if gene_key(ranking["gene"]) == gene:
+            return ranking["rank"]
+    return None
@@ -0,0 +1,83 @@
+from concurrent.futures import Future
+from typing import Callable, Dict, Hashable, Optional
+import threading
+import time
+import os
+
+# NCBI E-utilities allow 3 requests/second without an API key and 10 with one
+NCBI_RATE = 3
+NCBI_RATE_WITH_KEY = 10
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """Token bucket refilled at `rate` tokens per second, holding at most `capacity` tokens"""
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """Consume `tokens` if they are available right now"""
+        with self.lock:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens: float = 1) -> None:
+        """Block until `tokens` are available and consume them"""
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class RequestCoalescer:
+    def __init__(self):
+        """Share the result of identical requests that are in flight at the same time"""
+        self.inflight: Dict[Hashable, Future] = {}
+        self.lock = threading.Lock()
+
+    def run(self, key: Hashable, fn: Callable, *args, **kwargs):
+        """Run fn(*args, **kwargs) unless a request with the same key is already running"""
+        with self.lock:
+            future = self.inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.inflight[key] = future
+        if not owner:
+            return future.result()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self.lock:
+                del self.inflight[key]
+        return future.result()
+
+
+_ncbi_limiter = None
+_ncbi_limiter_lock = threading.Lock()
+
+def ncbi_limiter() -> TokenBucket:
+    """Return the process-wide limiter shared by every NCBI E-utilities request"""
+    global _ncbi_limiter
+    with _ncbi_limiter_lock:
+        if _ncbi_limiter is None:
+            rate = NCBI_RATE_WITH_KEY if os.getenv("NCBI_API_KEY") else NCBI_RATE
+            _ncbi_limiter = TokenBucket(rate)
+        return _ncbi_limiter
@@ -0,0 +1,176 @@
+from typing import List, Dict, Optional
+import numpy as np
+import threading
+import argparse
+import atexit
+import os
+
+DEFAULT_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+# Failures of the embedding stack that fall back to PubMed order: missing packages, or a model that
+# cannot be downloaded or loaded (offline, broken Hugging Face cache)
+UNAVAILABLE = (ImportError, OSError, RuntimeError)
+
+
+class AbstractIndex:
+    def __init__(self, path: str = "data/abstracts.faiss", model_name: str = DEFAULT_MODEL,
+                 batch_size: int = 64, save_every: int = 1000):
+        """Flat store of abstract embeddings keyed by PMID, persisted to disk and grown incrementally
+
+        Reranking only scores a gene's ~20 candidates, read back by PMID, so no
+        approximate search structure is built. sentence-transformers and faiss
+        are imported on first use, so importing this module stays cheap. New
+        vectors are written to disk once `save_every` of them have accumulated,
+        and by save().
+        """
+        self.path = path
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.save_every = save_every
+        self.model = None
+        self.index = None
+        self.indexed = set()
+        self.unsaved = 0
+        self.lock = threading.Lock()
+
+    def _load(self) -> None:
+        import faiss
+        from sentence_transformers import SentenceTransformer
+
+        if self.model is None:
+            self.model = SentenceTransformer(self.model_name, device="cpu")
+        if self.index is None:
+            index = faiss.IndexIDMap2(faiss.IndexFlatIP(self.model.get_sentence_embedding_dimension()))
+            if os.path.exists(self.path):
+                stored = faiss.read_index(self.path)
+                ids = faiss.vector_to_array(stored.id_map)
+                if isinstance(faiss.downcast_index(stored.index), faiss.IndexFlat):
+                    index = stored
+                elif len(ids):
+                    # Files written with an HNSW graph keep their vectors, moved to a flat index
+                    index.add_with_ids(stored.index.reconstruct_n(0, stored.ntotal), ids)
+                    self.unsaved = len(ids)
+            self.index = index
+            self.indexed = set(faiss.vector_to_array(self.index.id_map).tolist())
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Embed texts in CPU batches as unit vectors, so inner product is cosine similarity"""
+        self._load()
+        return self.model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True,
+                                 normalize_embeddings=True, show_progress_bar=False).astype(np.float32)
+
+    def add_articles(self, articles: List[Dict]) -> int:
+        """Embed and index the articles that are not indexed yet"""
+        with self.lock:
+            self._load()
+            new = {}
+            for article in articles:
+                pmid = int(article["pubmed_id"])
+                if pmid not in self.indexed and pmid not in new and article.get("text"):
+                    new[pmid] = f"{article.get('title') or ''}\n{article['text']}"
+            if not new:
+                return 0
+            ids = np.fromiter(new.keys(), dtype=np.int64, count=len(new))
+            self.index.add_with_ids(self.embed(list(new.values())), ids)
+            self.indexed.update(new)
+            self.unsaved += len(new)
+            if self.unsaved >= self.save_every:
+                self._save()
+            return len(new)
+
+    def save(self) -> None:
+        """Write vectors added since the last save to the index file"""
+        with self.lock:
+            self._save()
+
+    def _save(self) -> None:
+        import faiss
+
+        if not self.unsaved:
+            return
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        faiss.write_index(self.index, tmp_path)
+        os.replace(tmp_path, self.path)
+        self.unsaved = 0
+
+    def query(self, phenotypes: List[str]) -> np.ndarray:
+        """Unit vector of a patient's phenotype set: the normalized mean of its term embeddings"""
+        query = self.embed(phenotypes).mean(axis=0)
+        return query / np.linalg.norm(query)
+
+    def rank(self, articles: List[Dict], query: np.ndarray, top_n: int) -> List[Dict]:
+        """Return the top_n articles most similar to a phenotype query vector (see query())"""
+        articles = [a for a in articles if a.get("text")]
+        if len(articles) <= top_n:
+            return articles
+        self.add_articles(articles)
+        # Exact inner products of the candidates' stored vectors
+        with self.lock:
+            vectors = np.vstack([self.index.reconstruct(int(a["pubmed_id"])) for a in articles])
+        order = np.argsort(-(vectors @ query), kind="stable")[:top_n]
+        return [articles[i] for i in order.tolist()]
+
+    def sync(self, store) -> int:
+        """Index every article in the store that is not indexed yet"""
+        conn = store._connect()
+        added = 0
+        batch = []
+        for pmid, title, text in conn.execute("SELECT pmid, title, text FROM articles"):
+            batch.append({"pubmed_id": pmid, "title": title, "text": text})
+            if len(batch) >= 10 * self.batch_size:
+                added += self.add_articles(batch)
+                batch = []
+        added += self.add_articles(batch)
+        self.save()
+        return added
+
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_index() -> AbstractIndex:
+    """Return the process-wide abstract index"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = AbstractIndex()
+            atexit.register(_index.save)
+        return _index
+
+def phenotype_query(phenotypes: List[str]) -> Optional[np.ndarray]:
+    """Query vector of a patient's phenotypes, embedded once for all of its genes
+
+    Returns None when the embedding stack is unavailable; rerank_articles then keeps PubMed order.
+    """
+    if not phenotypes:
+        return None
+    try:
+        return get_index().query(phenotypes)
+    except UNAVAILABLE as e:
+        print(f"Dense reranking unavailable ({e}), using PubMed relevance order")
+        return None
+
+def rerank_articles(articles: List[Dict], query: Optional[np.ndarray], top_n: int) -> List[Dict]:
+    """Rank articles by similarity to a phenotype query, keeping PubMed order without one or on failure"""
+    if query is not None:
+        try:
+            return get_index().rank(articles, query, top_n)
+        except UNAVAILABLE as e:
+            print(f"Dense reranking failed ({e}), using PubMed relevance order")
+    return [a for a in articles if a.get("text")][:top_n]
+
+
+def main():
+    from retrieval.store import ArticleStore
+
+    parser = argparse.ArgumentParser(description="Embed cached abstracts into the dense index")
+    parser.add_argument("--db", default="data/articles.db", help="Article store database")
+    parser.add_argument("--index", default="data/abstracts.faiss", help="FAISS index file")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="sentence-transformers model")
+    args = parser.parse_args()
+    added = AbstractIndex(args.index, args.model).sync(ArticleStore(args.db))
+    print(f"Indexed {added} new abstracts into {args.index}")
+
+if __name__ == "__main__":
+    main()
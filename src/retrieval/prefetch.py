@@ -0,0 +1,183 @@
+"""Warm the article store for whole gene and phenotype catalogs.
+
+    python -m retrieval.prefetch --genes data/genes.txt
+    python -m retrieval.prefetch --hpo_terms data/hpo_terms.txt --cohort data/cohort
+
+Only queries missing from the store, or stored with fewer results than
+requested, are searched, and only articles missing from it are fetched. Every batch is committed to the store as it completes,
+so an interrupted run resumes where it stopped; failed queries are recorded
+in a checkpoint file and skipped on resume unless --retry_failed is given.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+import argparse
+import json
+import time
+import os
+
+from cohort import atomic_write
+from retrieval.retriever import ArticleRetriever, phenotype_query
+from retrieval.store import ArticleStore, GENE, PHENOTYPE, phenotype_key
+
+
+def read_list(path: str) -> List[str]:
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+def hpo_labels(terms: List[str]) -> List[str]:
+    """Phenotype labels of HPO IDs, labels or synonyms; phenotypes are searched by label"""
+    from ontology.hpo import get_ontology
+
+    ontology = get_ontology()
+    labels = []
+    for term in terms:
+        position = ontology.lookup(term) if ontology is not None else None
+        if position is not None:
+            labels.append(ontology.labels[position])
+        elif term.startswith("HP:"):
+            print(f"Unknown HPO term, skipped: {term}")
+        else:
+            labels.append(term)
+    return labels
+
+def cohort_queries(path: str) -> Tuple[List[str], List[str]]:
+    """Union of candidate genes and of phenotypes across a Parquet cohort or a legacy pickle"""
+    if path.endswith(".pkl"):
+        import pandas as pd
+
+        df = pd.read_pickle(path)
+        genes = [item['gene'] for gene_data in df['gene_data'] for item in gene_data]
+        phenotype_lists = df['Phenotype names']
+    else:
+        from cohort_data import CohortReader
+
+        reader = CohortReader(path)
+        genes = [gene for candidates in reader.candidates().values() for gene in candidates]
+        phenotype_lists = reader.patients(columns=['Phenotype names'])['Phenotype names']
+    phenotypes = [pheno.strip() for names in phenotype_lists for pheno in names.split(",") if pheno.strip()]
+    return list(dict.fromkeys(genes)), list(dict.fromkeys(phenotypes))
+
+
+class Prefetcher:
+    def __init__(self, retriever: ArticleRetriever, store: ArticleStore, checkpoint_path: str,
+                 batch_size: int = 200, workers: int = 10):
+        """Fetch missing queries in batches: concurrent searches, then one efetch for the new articles
+
+        Args:
+            retriever: Issues the E-utilities requests through the shared rate limiter.
+            store: Article store to warm; completed batches are committed to it.
+            checkpoint_path: JSON file recording failed queries and totals.
+            batch_size: Queries per batch, and so per store commit.
+            workers: Concurrent searches; the NCBI rate limiter is the real bound.
+        """
+        self.retriever = retriever
+        self.store = store
+        self.checkpoint_path = checkpoint_path
+        self.batch_size = batch_size
+        self.workers = workers
+        self.checkpoint = {"failed": {GENE: {}, PHENOTYPE: {}}, "queries": 0, "articles": 0}
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as f:
+                self.checkpoint = json.load(f)
+
+    def missing(self, kind: str, queries: Dict[str, str], k: int, retry_failed: bool = False) -> Dict[str, str]:
+        """The {store_key: query} entries without a fresh store entry fetched with at least k results"""
+        cached = self.store.get_query_pmids(kind, queries, k)
+        failed = {} if retry_failed else self.checkpoint["failed"][kind]
+        return {key: query for key, query in queries.items() if key not in cached and key not in failed}
+
+    def _search(self, query: str, k: int):
+        try:
+            return self.retriever.search_pubmed(query, k), None
+        except Exception as e:
+            return None, str(e)
+
+    def run(self, kind: str, queries: Dict[str, str], k: int) -> None:
+        """Search and store every query of a kind, reporting throughput after each batch"""
+        keys = list(queries)
+        started = time.monotonic()
+        done = articles = 0
+        for start in range(0, len(keys), self.batch_size):
+            batch = keys[start:start + self.batch_size]
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                searched = dict(zip(batch, executor.map(lambda key: self._search(queries[key], k), batch)))
+            failed = {key: error for key, (ids, error) in searched.items() if error is not None}
+            id_lists = {key: ids for key, (ids, error) in searched.items() if error is None}
+
+            # Articles already stored for other queries are not fetched again
+            wanted = list(dict.fromkeys(pmid for ids in id_lists.values() for pmid in ids))
+            known = self.store.get_articles(wanted)
+            try:
+                fetched = self.retriever.fetch_articles([pmid for pmid in wanted if pmid not in known])
+            except Exception as e:
+                # Nothing of this batch is stored, so it is fetched again on resume
+                failed.update({key: str(e) for key in id_lists})
+                id_lists = {}
+                fetched = {}
+            known.update(fetched)
+            self.store.put_queries(kind, {key: [known[pmid] for pmid in ids if pmid in known]
+                                          for key, ids in id_lists.items()}, k)
+
+            self.checkpoint["failed"][kind].update(failed)
+            for key in id_lists:
+                self.checkpoint["failed"][kind].pop(key, None)
+            self.checkpoint["queries"] += len(id_lists)
+            self.checkpoint["articles"] += len(fetched)
+            atomic_write(self.checkpoint_path, json.dumps(self.checkpoint))
+
+            done += len(batch)
+            articles += len(fetched)
+            elapsed = time.monotonic() - started
+            eta = (len(keys) - done) * elapsed / done
+            print(f"[{done}/{len(keys)} {kind} queries] {elapsed:.0f}s elapsed, {done / elapsed:.1f} queries/s, "
+                  f"{articles / elapsed:.1f} articles/s, ETA {eta:.0f}s, {len(failed)} failed in batch")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prefetch PubMed articles for gene and phenotype catalogs into the article store")
+    parser.add_argument("--genes", help="Gene list, one symbol per line (e.g. data/genes.txt)")
+    parser.add_argument("--hpo_terms", help="HPO term list, one ID or label per line")
+    parser.add_argument("--cohort", help="Cohort directory or legacy processed_amelie.pkl; prefetches all candidates and phenotypes")
+    parser.add_argument("--db", default="data/articles.db", help="Article store database")
+    parser.add_argument("--gene_k", type=int, default=20,
+                        help="Articles per gene; the phenotype reranking draws from 20 (default: 20)")
+    parser.add_argument("--phenotype_k", type=int, default=5, help="Articles per phenotype (default: 5)")
+    parser.add_argument("--batch_size", type=int, default=200, help="Queries per batch and store commit (default: 200)")
+    parser.add_argument("--workers", type=int, default=10, help="Concurrent searches (default: 10)")
+    parser.add_argument("--checkpoint", default="data/prefetch.checkpoint.json", help="Checkpoint file")
+    parser.add_argument("--retry_failed", action="store_true", help="Retry queries that failed in earlier runs")
+    args = parser.parse_args()
+    if not (args.genes or args.hpo_terms or args.cohort):
+        parser.error("Give at least one of --genes, --hpo_terms or --cohort")
+
+    genes, phenotypes = [], []
+    if args.genes:
+        genes += read_list(args.genes)
+    if args.hpo_terms:
+        phenotypes += hpo_labels(read_list(args.hpo_terms))
+    if args.cohort:
+        cohort_genes, cohort_phenotypes = cohort_queries(args.cohort)
+        genes += cohort_genes
+        phenotypes += cohort_phenotypes
+
+    store = ArticleStore(args.db)
+    prefetcher = Prefetcher(ArticleRetriever(max_workers=args.workers, store=store), store, args.checkpoint,
+                            args.batch_size, args.workers)
+    started = time.monotonic()
+    total = 0
+    for kind, queries, k in (
+            (GENE, {gene: gene for gene in dict.fromkeys(genes)}, args.gene_k),
+            (PHENOTYPE, {phenotype_key(pheno): phenotype_query(pheno) for pheno in dict.fromkeys(phenotypes)},
+             args.phenotype_k)):
+        missing = prefetcher.missing(kind, queries, k, args.retry_failed)
+        print(f"{kind}: {len(queries)} requested, {len(queries) - len(missing)} already stored or failed, "
+              f"{len(missing)} to fetch")
+        prefetcher.run(kind, missing, k)
+        total += len(missing)
+    elapsed = time.monotonic() - started
+    failed = sum(len(names) for names in prefetcher.checkpoint["failed"].values())
+    print(f"Prefetched {total} queries in {elapsed:.0f}s ({total / elapsed if elapsed else 0:.1f} queries/s); "
+          f"{failed} failed queries recorded in {args.checkpoint}")
+
+if __name__ == "__main__":
+    main()
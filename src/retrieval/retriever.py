@@ -1,18 +1,40 @@
-from typing import List, Dict
-import numpy as np
-import requests
+from typing import List, Dict, Iterator, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from retrieval.concurrency import RequestCoalescer, TokenBucket, ncbi_limiter
+from retrieval.store import ArticleStore, GENE, PHENOTYPE, default_store, phenotype_key
+from http_client import CountingReader, HttpClient, get_client
+from tracing import span
 import xml.etree.ElementTree as ET
-import time
-import json
 import os
+
+EUTILS_URL = os.getenv("NCBI_EUTILS_URL", "https://eutils.ncbi.nlm.nih.gov/entrez/eutils")
+
+# Identical searches issued concurrently by different retrievers share one request
+_coalescer = RequestCoalescer()
+
 class ArticleRetriever:
-    def __init__(self):
+    def __init__(self, api_key: Optional[str] = None, limiter: Optional[TokenBucket] = None, max_workers: int = 8,
+                 store: Optional[ArticleStore] = None, http: Optional[HttpClient] = None):
         """Initialize the retriever with PubMed API integration"""
-        self.base_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
+        self.base_url = f"{EUTILS_URL}/esearch.fcgi"
+        self.api_key = api_key or os.getenv("NCBI_API_KEY")
+        self.limiter = limiter or ncbi_limiter()
+        self.max_workers = max_workers
+        self.store = store or default_store()
+        self.http = http or get_client()
+
+    def _eutils_params(self, params: Dict) -> Dict:
+        """Wait for a rate limit token and add the API key to E-utilities parameters"""
+        self.limiter.acquire()
+        if self.api_key:
+            params = {**params, "api_key": self.api_key}
+        return params
         
     def search_pubmed(self, query: str, max_results: int = 100) -> List[str]:
         """Search PubMed and return article IDs matching the query"""
-        base_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
+        return _coalescer.run(("esearch", query, max_results), self._search_pubmed, query, max_results)
+
+    def _search_pubmed(self, query: str, max_results: int) -> List[str]:
         params = {
             "db": "pubmed",
             "term": query,
@@ -21,99 +43,149 @@ class ArticleRetriever:
             "sort": "relevance",
         }
         
-        response = requests.get(base_url, params=params)
+        with span("pubmed.search", query=query) as trace:
+            response = self.http.get(self.base_url, params=self._eutils_params(params))
+            response.raise_for_status()
+            ids = response.json().get("esearchresult", {}).get("idlist", [])
+            trace.set(results=len(ids))
+        return ids
+
+    def post_pubmed_ids(self, pubmed_ids: List[str]) -> Tuple[str, str]:
+        """Upload PubMed IDs to the NCBI history server and return (WebEnv, query_key)"""
+        # E-utilities POSTs only read (epost creates a fresh history entry), so they are safe to resend
+        response = self.http.post(f"{EUTILS_URL}/epost.fcgi", idempotent=True,
+                                  data=self._eutils_params({"db": "pubmed", "id": ",".join(pubmed_ids)}))
         response.raise_for_status()
-        data = response.json()
-        
-        return data.get("esearchresult", {}).get("idlist", [])
+        root = ET.fromstring(response.content)
+        return root.findtext("WebEnv"), root.findtext("QueryKey")
+
+    def fetch_articles(self, pubmed_ids: List[str], batch_size: int = 200) -> Dict[str, Dict]:
+        """Fetch details for many PubMed articles with as few efetch requests as possible
+
+        Up to `batch_size` IDs are sent in a single POST request. Larger sets are
+        uploaded once to the history server and paged through with WebEnv/query_key.
+        Responses are parsed incrementally so memory does not grow with the batch.
+        """
+        pubmed_ids = list(dict.fromkeys(str(pid) for pid in pubmed_ids))
+        articles = {}
+        if not pubmed_ids:
+            return articles
+        with span("pubmed.fetch", ids=len(pubmed_ids)) as trace:
+            received = self._fetch_pages(pubmed_ids, batch_size, articles)
+            trace.set(articles=len(articles), bytes=received)
+        return articles
+
+    def _fetch_pages(self, pubmed_ids: List[str], batch_size: int, articles: Dict[str, Dict]) -> int:
+        """Parse every page into `articles` and return the number of (decompressed) bytes read"""
+        if len(pubmed_ids) <= batch_size:
+            pages = [{"id": ",".join(pubmed_ids)}]
+        else:
+            webenv, query_key = self.post_pubmed_ids(pubmed_ids)
+            pages = [{"WebEnv": webenv, "query_key": query_key, "retstart": start, "retmax": batch_size}
+                     for start in range(0, len(pubmed_ids), batch_size)]
+        received = 0
+        for page in pages:
+            response = self.http.post(f"{EUTILS_URL}/efetch.fcgi", idempotent=True,
+                                      data=self._eutils_params({"db": "pubmed", "retmode": "xml", **page}),
+                                      stream=True)
+            response.raise_for_status()
+            response.raw.decode_content = True
+            body = CountingReader(response.raw)
+            try:
+                for article in iter_pubmed_articles(body):
+                    articles[article["pubmed_id"]] = article
+            finally:
+                response.close()
+                received += body.bytes
+        return received
 
     def fetch_article_details(self, pubmed_id: str) -> Dict:
         """Fetch detailed information for a single PubMed article"""
-        base_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
-        params = {
-            "db": "pubmed",
-            "id": pubmed_id,
-            "retmode": "xml"
-        }
-        
-        response = requests.get(base_url, params=params)
-        response.raise_for_status()
-        
-        root = ET.fromstring(response.content)
-        article = root.find(".//PubmedArticle")
-        
-        if article is None:
-            return None
-            
-        title = article.find(".//ArticleTitle").text if article.find(".//ArticleTitle") is not None else ""
-        abstract = article.find(".//AbstractText").text if article.find(".//AbstractText") is not None else ""
-        authors = [author.find(".//LastName").text + " " + author.find(".//ForeName").text 
-                for author in article.findall(".//Author") 
-                if author.find(".//LastName") is not None and author.find(".//ForeName") is not None]
-        
-        return {
-            "pubmed_id": pubmed_id,
-            "title": title,
-            "text": abstract,
-            "authors": authors
-        }
+        return self.fetch_articles([pubmed_id]).get(str(pubmed_id))
 
     def retrieve_gene(self, gene: str, k: int = 5, cache: bool = True) -> List[Dict]:
         """Retrieve top k most relevant articles from PubMed"""
-        # Check if the gene articles have already been retrieved
-        if os.path.exists(f"data/genes/{gene}.json"):
-            print(f"Skipping {gene} (already retrieved)")
-            with open(f"data/genes/{gene}.json", "r") as f:
-                return json.load(f)
-        # Search PubMed and fetch articles
-        article_ids = self.search_pubmed(gene, k)
-        # Introduce a delay to avoid hitting the API too quickly
-        time.sleep(0.1)                
-        articles = []
-        for pubmed_id in article_ids:
-            try:
-                article = self.fetch_article_details(pubmed_id)
-                # Introduce a delay to avoid hitting the API too quickly
-                time.sleep(0.1)                
-                if article:
-                    articles.append(article)
-            except Exception as e:
-                print(f"Error fetching article {pubmed_id}: {e}")
-        # Save articles to a file
-        if cache and os.path.exists("data/genes"):
-            with open(f"data/genes/{gene}.json", "w") as f:
-                json.dump(articles, f, indent=4)
-        return  articles
+        return self.retrieve_genes([gene], k, cache)[gene]
 
     def retrieve_pheno(self, pheno: str, k: int = 5, cache: bool = True) -> List[Dict]:
         """Retrieve top k most relevant articles from PubMed"""
-        pheno_file = pheno.strip().lower().replace(" ", "_")
-        # Check if the gene articles have already been retrieved
-        if os.path.exists(f"data/phenotypes/{pheno_file}.json"):
-            print(f"Skipping {pheno} (already retrieved)")
-            with open(f"data/phenotypes/{pheno_file}.json", "r") as f:
-                return json.load(f)
-        # Search PubMed and fetch articles
-        pheno_query = f"{pheno} AND (gene OR genetic OR mutation OR variant OR locus OR polymorphism OR SNP OR CNV OR deletion OR duplication OR translocation OR rearrangement OR fusion OR alteration OR aberration)"
-        print(f"Retrieving articles for {pheno_file}")
-        article_ids = self.search_pubmed(pheno_query, k)
-        # Introduce a delay to avoid hitting the API too quickly
-        time.sleep(0.1)                
-        articles = []
-        for pubmed_id in article_ids:
-            try:
-                article = self.fetch_article_details(pubmed_id)
-                # Introduce a delay to avoid hitting the API too quickly
-                time.sleep(0.1)                
-                if article:
-                    articles.append(article)
-            except Exception as e:
-                print(f"Error fetching article {pubmed_id}: {e}")
-        # Save articles to a file
-        if cache and os.path.exists("data/phenotypes"):
-            with open(f"data/phenotypes/{pheno_file}.json", "w") as f:
-                json.dump(articles, f, indent=4)
-        return  articles
+        return self.retrieve_phenos([pheno], k, cache)[pheno]
+
+    def retrieve_genes(self, genes: List[str], k: int = 5, cache: bool = True) -> Dict[str, List[Dict]]:
+        """Retrieve top k articles for each gene, fetching all missing articles in one batch"""
+        queries = {gene: (gene, gene) for gene in genes}
+        return self._retrieve_batch(GENE, queries, k, cache)
+
+    def retrieve_phenos(self, phenos: List[str], k: int = 5, cache: bool = True) -> Dict[str, List[Dict]]:
+        """Retrieve top k articles for each phenotype, fetching all missing articles in one batch"""
+        queries = {pheno: (phenotype_key(pheno), phenotype_query(pheno)) for pheno in phenos}
+        return self._retrieve_batch(PHENOTYPE, queries, k, cache)
+
+    def _retrieve_batch(self, kind: str, queries: Dict[str, Tuple[str, str]], k: int, cache: bool) -> Dict[str, List[Dict]]:
+        """Resolve {name: (store_key, query)} from the article store or PubMed"""
+        # Check which queries have already been retrieved with a single store lookup
+        with span("store.lookup", kind=kind, queries=len(queries)) as trace:
+            cached = self.store.get_queries(kind, [key for key, _ in queries.values()], k)
+            trace.set(hits=len(cached), misses=len(queries) - len(cached))
+        results = {}
+        missing = []
+        for name, (key, query) in queries.items():
+            if key in cached:
+                print(f"Skipping {name} (already retrieved)")
+                results[name] = cached[key]
+                continue
+            print(f"Retrieving articles for {name}")
+            missing.append(name)
+        # Search all missing queries concurrently; the shared limiter paces the requests
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            id_lists = executor.map(lambda name: self.search_pubmed(queries[name][1], k), missing)
+            search_results = dict(zip(missing, id_lists))
+        # Fetch the articles of every query in a single batch
+        all_ids = [pubmed_id for ids in search_results.values() for pubmed_id in ids]
+        try:
+            fetched = self.fetch_articles(all_ids)
+        except Exception as e:
+            print(f"Error fetching articles {', '.join(all_ids)}: {e}")
+            fetched = None
+        for name, article_ids in search_results.items():
+            results[name] = [fetched[pubmed_id] for pubmed_id in article_ids if pubmed_id in (fetched or {})]
+        # Save articles to the store; after a failed fetch nothing is stored, so the queries are retried next time
+        if cache and search_results and fetched is not None:
+            self.store.put_queries(kind, {queries[name][0]: results[name] for name in search_results}, k)
+        return {name: results[name] for name in queries}
+
+
+def phenotype_query(pheno: str) -> str:
+    """PubMed query restricting a phenotype search to genetics articles"""
+    return f"{pheno} AND (gene OR genetic OR mutation OR variant OR locus OR polymorphism OR SNP OR CNV OR deletion OR duplication OR translocation OR rearrangement OR fusion OR alteration OR aberration)"
+
+def parse_pubmed_article(article: ET.Element) -> Dict:
+    """Convert a PubmedArticle element into an article dict"""
+    title = article.find(".//ArticleTitle").text if article.find(".//ArticleTitle") is not None else ""
+    abstract = article.find(".//AbstractText").text if article.find(".//AbstractText") is not None else ""
+    authors = [author.find(".//LastName").text + " " + author.find(".//ForeName").text
+            for author in article.findall(".//Author")
+            if author.find(".//LastName") is not None and author.find(".//ForeName") is not None]
+
+    return {
+        "pubmed_id": article.findtext("MedlineCitation/PMID", ""),
+        "title": title,
+        "text": abstract,
+        "authors": authors
+    }
+
+def iter_pubmed_articles(stream) -> Iterator[Dict]:
+    """Incrementally parse an efetch XML stream, yielding one article at a time"""
+    root = None
+    for event, elem in ET.iterparse(stream, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            continue
+        if elem.tag == "PubmedArticle":
+            yield parse_pubmed_article(elem)
+            # Drop parsed articles so memory stays flat on large batches
+            root.clear()
 
 
 def test_retrieval():
@@ -127,31 +199,9 @@ def test_retrieval():
     
     for query in test_queries:
         print(f"\nQuery: {query}")
-        results = retriever.retrieve(query)
+        results = retriever.retrieve_gene(query)
         for i, result in enumerate(results):
             print(f"{i+1}. {result['title']} ")
 
-def retrieve_for_all_genes():
-    """Retrieve articles for a list of genes"""
-    retriever = ArticleRetriever()
-    
-    # with open("data/genes.list", "r") as f:
-    #     genes = [line.strip() for line in f.readlines()]
-    genes = ['C5orf42',]
-    for i, gene in enumerate(genes):
-        try:
-            if os.path.exists(f"data/genes/{gene}.json"):
-                print(f"Skipping {gene} (already retrieved)")
-                continue
-            print(f"Retrieving articles for {gene} ({i + 1} / {len(genes)})...")
-            articles = retriever.retrieve(gene)
-            # Save articles to a file
-            with open(f"data/genes/{gene}.json", "w") as f:
-                json.dump(articles, f, indent=4)
-        except Exception as e:
-            print(f"Error retrieving articles for {gene}: {e}")
-            time.sleep(0.5)
-
 if __name__ == "__main__":
-    #test_retrieval()
-    retrieve_for_all_genes()
\ No newline at end of file
+    test_retrieval()
@@ -0,0 +1,245 @@
+from typing import List, Dict, Iterable, Optional, Set
+import threading
+import argparse
+import sqlite3
+import json
+import time
+import os
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS articles (
+    pmid TEXT PRIMARY KEY,
+    title TEXT,
+    text TEXT,
+    authors TEXT,
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS queries (
+    kind TEXT,
+    name TEXT,
+    pmids TEXT,
+    k INTEGER,
+    updated_at REAL,
+    PRIMARY KEY (kind, name)
+);
+CREATE INDEX IF NOT EXISTS queries_updated ON queries (updated_at);
+"""
+
+GENE = "gene"
+PHENOTYPE = "phenotype"
+
+
+def phenotype_key(pheno: str) -> str:
+    """Normalize a phenotype label the way the JSON cache named its files"""
+    return pheno.strip().lower().replace(" ", "_")
+
+
+class ArticleStore:
+    def __init__(self, path: str = "data/articles.db", ttl: Optional[float] = None,
+                 max_articles: Optional[int] = None):
+        """SQLite store keeping each article once by PMID plus query -> PMID list mappings
+
+        Args:
+            path: Database file, shared safely by concurrent threads and processes.
+            ttl: Seconds after which a cached query is considered stale.
+            max_articles: Evict the oldest queries once more articles than this are stored.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_articles = max_articles
+        self.local = threading.local()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            # Stores created before k was recorded; their rows count as complete for their PMID count
+            if "k" not in [column[1] for column in conn.execute("PRAGMA table_info(queries)")]:
+                conn.execute("ALTER TABLE queries ADD COLUMN k INTEGER")
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def _fresh(self, updated_at: float) -> bool:
+        return self.ttl is None or time.time() - updated_at < self.ttl
+
+    def _query_rows(self, kind: str, names: List[str], k: Optional[int]) -> Dict[str, List[str]]:
+        """PMID lists of the fresh queries fetched with at least k results, cut to k"""
+        conn = self._connect()
+        pmid_lists = {}
+        # Stay below SQLite's bound parameter limit
+        for start in range(0, len(names), 500):
+            chunk = names[start:start + 500]
+            for name, pmids, stored_k, updated_at in conn.execute(
+                    f"SELECT name, pmids, k, updated_at FROM queries WHERE kind = ? AND name IN ({','.join('?' * len(chunk))})",
+                    [kind, *chunk]):
+                if not self._fresh(updated_at):
+                    continue
+                pmids = json.loads(pmids)
+                # Rows without k were stored with all the results they were fetched with
+                if k is None or (len(pmids) if stored_k is None else stored_k) >= k:
+                    pmid_lists[name] = pmids[:k]
+        return pmid_lists
+
+    def get_queries(self, kind: str, names: Iterable[str], k: Optional[int] = None) -> Dict[str, List[Dict]]:
+        """Return cached articles for each name that has a fresh entry, in one lookup
+
+        With k, entries fetched with fewer than k results count as missing and
+        the others are cut to their first k articles.
+        """
+        names = list(dict.fromkeys(names))
+        pmid_lists = self._query_rows(kind, names, k)
+        articles = self.get_articles(pmid for pmids in pmid_lists.values() for pmid in pmids)
+        return {name: [articles[pmid] for pmid in pmid_lists[name] if pmid in articles]
+                for name in names if name in pmid_lists}
+
+    def get_query(self, kind: str, name: str, k: Optional[int] = None) -> Optional[List[Dict]]:
+        """Return cached articles for a single query, or None when missing or stale"""
+        return self.get_queries(kind, [name], k).get(name)
+
+    def get_query_pmids(self, kind: str, names: Iterable[str], k: Optional[int] = None) -> Dict[str, List[str]]:
+        """Return the PMID list of each cached query without loading the articles (see get_queries for k)"""
+        return self._query_rows(kind, list(dict.fromkeys(names)), k)
+
+    def get_articles(self, pmids: Iterable[str]) -> Dict[str, Dict]:
+        """Return stored articles keyed by PMID"""
+        pmids = list(dict.fromkeys(pmids))
+        conn = self._connect()
+        articles = {}
+        for start in range(0, len(pmids), 500):
+            chunk = pmids[start:start + 500]
+            for pmid, title, text, authors in conn.execute(
+                    f"SELECT pmid, title, text, authors FROM articles WHERE pmid IN ({','.join('?' * len(chunk))})",
+                    chunk):
+                articles[pmid] = {"pubmed_id": pmid, "title": title, "text": text, "authors": json.loads(authors)}
+        return articles
+
+    def query_names(self, kind: str) -> Set[str]:
+        """Return the names of all fresh cached queries of a kind"""
+        rows = self._connect().execute("SELECT name, updated_at FROM queries WHERE kind = ?", (kind,))
+        return {name for name, updated_at in rows if self._fresh(updated_at)}
+
+    def put_queries(self, kind: str, results: Dict[str, List[Dict]], k: Optional[int] = None) -> None:
+        """Atomically store articles and the PMID list of each query
+
+        `k` is the number of results the queries were searched with (default:
+        the number of articles of each), so later lookups asking for more
+        treat them as missing.
+        """
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for name, articles in results.items():
+                conn.executemany(
+                    "INSERT OR REPLACE INTO articles (pmid, title, text, authors, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    [(str(a["pubmed_id"]), a.get("title"), a.get("text"), json.dumps(a.get("authors", [])), now)
+                     for a in articles])
+                conn.execute(
+                    "INSERT OR REPLACE INTO queries (kind, name, pmids, k, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    (kind, name, json.dumps([str(a["pubmed_id"]) for a in articles]),
+                     len(articles) if k is None else k, now))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if self.max_articles is not None:
+            self.evict()
+
+    def put_query(self, kind: str, name: str, articles: List[Dict], k: Optional[int] = None) -> None:
+        self.put_queries(kind, {name: articles}, k)
+
+    def evict(self) -> int:
+        """Drop stale queries, then the oldest ones above max_articles, and orphaned articles"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            removed = 0
+            if self.ttl is not None:
+                removed += conn.execute("DELETE FROM queries WHERE updated_at < ?",
+                                        (time.time() - self.ttl,)).rowcount
+            if self.max_articles is not None:
+                count = conn.execute("SELECT COUNT(*) FROM articles").fetchone()[0]
+                if count > self.max_articles:
+                    # Remove the oldest queries, then whatever articles no query still references
+                    oldest = conn.execute("SELECT kind, name, pmids FROM queries ORDER BY updated_at").fetchall()
+                    referenced = {}
+                    for _, _, pmids in oldest:
+                        for pmid in json.loads(pmids):
+                            referenced[pmid] = referenced.get(pmid, 0) + 1
+                    for kind, name, pmids in oldest:
+                        if len(referenced) <= self.max_articles:
+                            break
+                        conn.execute("DELETE FROM queries WHERE kind = ? AND name = ?", (kind, name))
+                        removed += 1
+                        for pmid in json.loads(pmids):
+                            referenced[pmid] -= 1
+                            if referenced[pmid] == 0:
+                                del referenced[pmid]
+            self._delete_orphans(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return removed
+
+    def _delete_orphans(self, conn: sqlite3.Connection) -> None:
+        referenced = set()
+        for (pmids,) in conn.execute("SELECT pmids FROM queries"):
+            referenced.update(json.loads(pmids))
+        stored = [pmid for (pmid,) in conn.execute("SELECT pmid FROM articles")]
+        conn.executemany("DELETE FROM articles WHERE pmid = ?", [(pmid,) for pmid in stored if pmid not in referenced])
+
+    def import_json_cache(self, genes_dir: str = "data/genes", phenotypes_dir: str = "data/phenotypes") -> Dict[str, int]:
+        """Import the legacy per-gene and per-phenotype JSON files"""
+        counts = {}
+        for kind, directory in ((GENE, genes_dir), (PHENOTYPE, phenotypes_dir)):
+            results = {}
+            if os.path.isdir(directory):
+                for filename in os.listdir(directory):
+                    if not filename.endswith(".json"):
+                        continue
+                    with open(os.path.join(directory, filename)) as f:
+                        results[filename[:-len(".json")]] = json.load(f)
+            self.put_queries(kind, results)
+            counts[kind] = len(results)
+        return counts
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+def default_store() -> ArticleStore:
+    """Return the article store shared by the retriever and analysis scripts"""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = ArticleStore()
+        return _default_store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the local PubMed article store")
+    parser.add_argument("command", choices=["import", "evict"])
+    parser.add_argument("--db", default="data/articles.db", help="Article store database")
+    parser.add_argument("--genes", default="data/genes", help="Legacy gene JSON cache directory")
+    parser.add_argument("--phenotypes", default="data/phenotypes", help="Legacy phenotype JSON cache directory")
+    parser.add_argument("--ttl", type=float, help="Maximum age of cached queries in seconds")
+    parser.add_argument("--max_articles", type=int, help="Maximum number of stored articles")
+    args = parser.parse_args()
+
+    store = ArticleStore(args.db, ttl=args.ttl, max_articles=args.max_articles)
+    if args.command == "import":
+        counts = store.import_json_cache(args.genes, args.phenotypes)
+        print(f"Imported {counts[GENE]} genes and {counts[PHENOTYPE]} phenotypes into {args.db}")
+    else:
+        print(f"Evicted {store.evict()} queries from {args.db}")
+
+if __name__ == "__main__":
+    main()
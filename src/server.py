@@ -0,0 +1,353 @@
+"""Interpretation service: generate_interpretation over a local HTTP API.
+
+    python server.py --port 8080 --workers 4 --llm_cache record --models other/model-a,other/model-b
+
+One long-running process keeps camel, the agent pool, the HTTP connection
+pools, the HPO ontology and the article store warm across requests. Jobs are
+submitted and polled:
+
+    POST /jobs      {"genes": ["SCN1A", "KCNQ2"], "phenotypes": ["Seizure"], "model": "..."}
+                    -> 202 {"id": "...", "status": "queued"}
+                    -> 200 {"id": "...", "status": "done", "cached": true, "result": {...}}
+    GET  /jobs/<id> -> {"id": "...", "status": "queued" | "running" | "done" | "failed", ...}
+    GET  /health    -> queue depth, running and tracked jobs
+
+Clients are identified by the X-Client-Id header (else their address). A
+client may have at most --per_client jobs queued or running (429 beyond
+that) and the queue holds at most --queue_size jobs (503 when full).
+Jobs may only name the default model or one given with --models (400
+otherwise); each has one agent pool, warmed at startup. Results are cached
+by model, settings and the sorted gene and phenotype sets, so a patient
+interpreted before is answered without queueing.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+import threading
+import argparse
+import hashlib
+import queue
+import json
+import math
+import time
+import uuid
+
+from agents import get_agent_pool, rank_genes
+from http_client import get_client
+from llm_cache import MODES, OFF, RECORD, ResponseCache, configure_cache
+from ontology.hpo import get_ontology
+from prefilter import get_scorer, prefilter_genes
+from retrieval.store import default_store
+
+DEFAULT_MODEL = "deepseek/deepseek-chat-v3-0324:free"
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+# Settings a job may override, with their types and defaults; integer settings must be positive
+SETTINGS = {"token_budget": (int, None), "shard_size": (int, None), "shard_concurrency": (int, 4),
+            "shard_top": (int, 5), "prefilter_top_k": (int, None), "prefilter_threshold": (float, None)}
+
+
+class RejectedError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def _setting(name: str, value, kind: type, default):
+    """Coerce a job setting to its type; null (or absent) means the default
+
+    Raises:
+        RejectedError: If the value does not convert or an integer is not positive.
+    """
+    if value is None:
+        return default
+    try:
+        if isinstance(value, bool) or (kind is int and isinstance(value, float) and not value.is_integer()):
+            raise ValueError(value)
+        coerced = kind(value)
+    except (TypeError, ValueError):
+        raise RejectedError(400, f"{name} must be {'an integer' if kind is int else 'a number'}, got {value!r}")
+    if kind is int and coerced < 1:
+        raise RejectedError(400, f"{name} must be positive, got {coerced}")
+    if kind is float and not math.isfinite(coerced):
+        raise RejectedError(400, f"{name} must be finite, got {coerced}")
+    return coerced
+
+
+def _split(value, name: str = "value") -> List[str]:
+    """A list of names from a JSON list or a comma-separated string, stripped and deduplicated
+
+    Raises:
+        RejectedError: If the value is neither (nor None) or lists anything but strings.
+    """
+    if value is None:
+        return []
+    if isinstance(value, str):
+        items = value.split(",")
+    elif isinstance(value, list) and all(isinstance(item, str) for item in value):
+        items = value
+    else:
+        raise RejectedError(400, f"{name} must be a list of strings or a comma-separated string")
+    return list(dict.fromkeys(item.strip() for item in items if item.strip()))
+
+def result_key(model: str, genes: List[str], phenotypes: List[str], settings: Dict) -> str:
+    """Cache key of an interpretation: the same gene and phenotype sets share it whatever their order"""
+    payload = json.dumps({"model": model, "genes": sorted(genes), "phenotypes": sorted(phenotypes),
+                          "settings": settings}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class Job:
+    def __init__(self, client: str, model: str, genes: List[str], phenotypes: List[str], settings: Dict, key: str):
+        self.id = uuid.uuid4().hex
+        self.client = client
+        self.model = model
+        self.genes = genes
+        self.phenotypes = phenotypes
+        self.settings = settings
+        self.key = key
+        self.status = QUEUED
+        self.result: Optional[Dict] = None
+        self.error: Optional[str] = None
+        self.cached = False
+        self.submitted = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+
+    def to_dict(self) -> Dict:
+        record = {"id": self.id, "status": self.status, "model": self.model, "genes": len(self.genes),
+                  "submitted": self.submitted, "started": self.started, "finished": self.finished}
+        if self.status == DONE:
+            record.update(cached=self.cached, result=self.result)
+        elif self.status == FAILED:
+            record["error"] = self.error
+        return record
+
+
+class InterpretationService:
+    def __init__(self, model: str = DEFAULT_MODEL, workers: int = 4, queue_size: int = 64, per_client: int = 2,
+                 results_path: str = "data/interpretations.db", job_ttl: float = 3600.0,
+                 models: Optional[List[str]] = None):
+        """Run interpretation jobs on a fixed set of worker threads sharing warm process-wide state
+
+        Args:
+            model: Model of jobs that do not name one.
+            workers: Jobs interpreted concurrently, and agent sets per model.
+            queue_size: Jobs waiting for a worker beyond which submissions are refused.
+            per_client: Jobs a client may have queued or running at once.
+            results_path: SQLite database of finished interpretations.
+            job_ttl: Seconds a finished job stays available for polling.
+            models: Other models jobs may name; every allowed model's agent pool is warmed at startup.
+        """
+        self.model = model
+        self.models = list(dict.fromkeys([model, *(models or [])]))
+        self.workers = workers
+        self.per_client = per_client
+        self.job_ttl = job_ttl
+        self.results = ResponseCache(results_path, RECORD)
+        self.queue: "queue.Queue[Job]" = queue.Queue(maxsize=queue_size)
+        self.jobs: Dict[str, Job] = {}
+        # Queued or running job of each result key, so identical submissions share it
+        self.pending: Dict[str, Job] = {}
+        self.active: Dict[str, int] = {}
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self._worker, name=f"interpret-{i}", daemon=True)
+                        for i in range(workers)]
+
+    def warm(self) -> None:
+        """Load everything a first request would otherwise wait for, then start the workers"""
+        started = time.monotonic()
+        get_client()
+        default_store()
+        get_ontology()
+        get_scorer()
+        for model in self.models:
+            get_agent_pool(model, size=self.workers).warm()
+        print(f"Warmed up in {time.monotonic() - started:.1f}s")
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, client: str, request: Dict) -> Job:
+        """Queue a job, or return a finished or pending one for the same interpretation
+
+        Raises:
+            RejectedError: On invalid requests, per-client limits and a full queue.
+        """
+        if not isinstance(request, dict):
+            raise RejectedError(400, "Request body must be a JSON object")
+        genes = _split(request.get("genes"), "genes")
+        phenotypes = _split(request.get("phenotypes"), "phenotypes")
+        if not genes or not phenotypes:
+            raise RejectedError(400, "Both genes and phenotypes are required")
+        model = request.get("model") or self.model
+        if model not in self.models:
+            raise RejectedError(400, f"Model {model} is not served; available: {', '.join(self.models)}")
+        settings = {name: _setting(name, request.get(name), kind, default)
+                    for name, (kind, default) in SETTINGS.items()}
+        key = result_key(model, genes, phenotypes, settings)
+        job = Job(client, model, genes, phenotypes, settings, key)
+
+        cached = self.results.get(key)
+        with self.lock:
+            self._expire()
+            if cached is not None:
+                job.status, job.cached, job.result = DONE, True, json.loads(cached)
+                job.started = job.finished = job.submitted
+                self.jobs[job.id] = job
+                return job
+            if key in self.pending:
+                return self.pending[key]
+            if self.active.get(client, 0) >= self.per_client:
+                raise RejectedError(429, f"Client {client} already has {self.per_client} jobs queued or running")
+            try:
+                self.queue.put_nowait(job)
+            except queue.Full:
+                raise RejectedError(503, f"Job queue is full ({self.queue.maxsize} jobs)")
+            self.jobs[job.id] = job
+            self.pending[key] = job
+            self.active[client] = self.active.get(client, 0) + 1
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def health(self) -> Dict:
+        with self.lock:
+            running = sum(job.status == RUNNING for job in self.jobs.values())
+            return {"model": self.model, "models": self.models, "workers": self.workers, "queued": self.queue.qsize(),
+                    "queue_size": self.queue.maxsize, "running": running, "jobs": len(self.jobs)}
+
+    def _expire(self) -> None:
+        """Forget finished jobs older than job_ttl; their results stay in the result cache"""
+        cutoff = time.time() - self.job_ttl
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished and job.finished < cutoff]:
+            del self.jobs[job_id]
+
+    def _worker(self) -> None:
+        while True:
+            job = self.queue.get()
+            job.status, job.started = RUNNING, time.time()
+            try:
+                job.result = self._interpret(job)
+                self.results.put(job.key, json.dumps(job.result))
+                job.status = DONE
+            except Exception as e:
+                job.error = f"{type(e).__name__}: {e}"
+                job.status = FAILED
+                print(f"Job {job.id} failed: {job.error}")
+            finally:
+                job.finished = time.time()
+                with self.lock:
+                    self.pending.pop(job.key, None)
+                    self.active[job.client] -= 1
+                    if not self.active[job.client]:
+                        del self.active[job.client]
+                self.queue.task_done()
+
+    def _interpret(self, job: Job) -> Dict:
+        settings = job.settings
+        genes = job.genes
+        hints = None
+        if settings["prefilter_top_k"] is not None or settings["prefilter_threshold"] is not None:
+            hints = prefilter_genes(genes, job.phenotypes, settings["prefilter_top_k"],
+                                    settings["prefilter_threshold"])
+            genes = list(hints)
+        interpretation = rank_genes(', '.join(genes), ', '.join(job.phenotypes), job.model,
+                                    settings["token_budget"], settings["shard_size"],
+                                    settings["shard_concurrency"], settings["shard_top"], hints)
+        return {"interpretation": interpretation.text, "rankings": interpretation.records()}
+
+
+def make_server(service: InterpretationService, host: str = "127.0.0.1", port: int = 8080) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status: int, body: Dict, headers: Optional[Dict] = None) -> None:
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            path = self.path.split("?")[0].rstrip("/")
+            if path == "/health":
+                self._send(200, service.health())
+            elif path.startswith("/jobs/"):
+                job = service.get(path[len("/jobs/"):])
+                if job is None:
+                    self._send(404, {"error": "Unknown or expired job"})
+                else:
+                    self._send(200, job.to_dict())
+            else:
+                self._send(404, {"error": "Not found"})
+
+        def do_POST(self):
+            if self.path.split("?")[0].rstrip("/") != "/jobs":
+                self._send(404, {"error": "Not found"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                if length < 0:
+                    raise ValueError(length)
+            except ValueError:
+                self._send(400, {"error": "Invalid Content-Length"})
+                return
+            try:
+                request = json.loads(self.rfile.read(length) or b"{}")
+                client = self.headers.get("X-Client-Id") or self.client_address[0]
+                job = service.submit(client, request)
+            except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                self._send(400, {"error": f"Invalid JSON: {e}"})
+            except RejectedError as e:
+                self._send(e.status, {"error": str(e)}, {"Retry-After": "5"} if e.status in (429, 503) else None)
+            else:
+                if job.status == DONE:
+                    self._send(200, job.to_dict())
+                else:
+                    self._send(202, job.to_dict(), {"Location": f"/jobs/{job.id}"})
+
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    httpd.daemon_threads = True
+    return httpd
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve gene interpretations over a local HTTP job API")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on (default: 8080)")
+    parser.add_argument("--openrouter_model", default=DEFAULT_MODEL, help="Default model, warmed up at startup")
+    parser.add_argument("--models", help="Other models jobs may request, comma-separated; any other model gets 400")
+    parser.add_argument("--workers", type=int, default=4, help="Jobs interpreted concurrently (default: 4)")
+    parser.add_argument("--queue_size", type=int, default=64, help="Queued jobs beyond which requests get 503 (default: 64)")
+    parser.add_argument("--per_client", type=int, default=2,
+                        help="Jobs a client may have queued or running at once (default: 2)")
+    parser.add_argument("--results_db", default="data/interpretations.db", help="Cache of finished interpretations")
+    parser.add_argument("--llm_cache", choices=MODES, default=OFF,
+                        help="LLM response cache: record new responses, replay cached ones only, or off (default: off)")
+    parser.add_argument("--llm_cache_path", default="data/llm_cache.db", help="LLM response cache database")
+    args = parser.parse_args()
+
+    configure_cache(args.llm_cache, args.llm_cache_path)
+    service = InterpretationService(args.openrouter_model, args.workers, args.queue_size, args.per_client,
+                                    args.results_db, models=_split(args.models))
+    service.warm()
+    httpd = make_server(service, args.host, args.port)
+    print(f"Serving interpretations on http://{args.host}:{args.port}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+
+if __name__ == "__main__":
+    main()
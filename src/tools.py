@@ -1,34 +1,60 @@
-from camel.toolkits import FunctionTool
 from retrieval.retriever import ArticleRetriever
-import requests
+from http_client import get_client
+from tracing import span
 import re
 CLEANR = re.compile('<.*?>') 
+# Articles per gene in the context, and the PubMed pool they are reranked from
+TOP_ARTICLES = 5
+RERANK_POOL = 20
 from urllib.parse import quote
+import os
+
+ABEROWL_URL = os.getenv("ABEROWL_URL", "http://aber-owl.net")
 
 def cleanhtml(raw_html):
   cleantext = re.sub(CLEANR, '', raw_html)
   return cleantext
 
-def genes_articles(genes: str) -> str:
+def format_articles(article_lists) -> str:
+    """Format lists of articles as one context string, built with a single join"""
+    parts = []
+    for articles in article_lists:
+        for article in articles:
+            if 'text' in article and article['text']:
+                parts.append(f"Title: {article['title']}\n"
+                             f"Authors: {', '.join(article['authors'])}\n"
+                             f"Abstract: {article['text']}\n\n")
+    return "".join(parts).strip()
+
+def select_gene_articles(genes: list, phenotypes: list) -> dict:
+    """Retrieve the articles of each gene, reranked against the phenotypes when given"""
+    retriever = ArticleRetriever()
+    # Retrieve a wider pool per gene when it will be reranked against the phenotypes
+    k = RERANK_POOL if phenotypes else TOP_ARTICLES
+    gene_articles = retriever.retrieve_genes(genes, k)
+    if phenotypes:
+        # Imported here so that numpy and the embedding stack load only when reranking
+        from retrieval.embeddings import phenotype_query, rerank_articles
+
+        # The phenotypes are embedded once and every gene's pool is scored against them
+        query = phenotype_query(phenotypes)
+        gene_articles = {gene: rerank_articles(articles, query, TOP_ARTICLES)
+                         for gene, articles in gene_articles.items()}
+    return gene_articles
+
+def genes_articles(genes: str, phenotypes: str = "") -> str:
     """Retrieve articles related to a specific gene and format the context for the model
     Args:
         genes (str): List of gene symbols to search for, comma separated.
+        phenotypes (str): Patient phenotypes, comma separated. When given, the
+            articles most similar to them are selected for each gene.
     Returns:
         str: Formatted context string containing article titles, authors, and abstracts.
     """
-    retriever = ArticleRetriever()
     genes = [gene.strip() for gene in genes.split(',')]
-    context = ""
-    for gene in genes:
-        articles = retriever.retrieve_gene(gene)
-        for article in articles:
-            if 'text' in article and article['text']:
-                context += f"Title: {article['title']}\n"
-                context += f"Authors: {', '.join(article['authors'])}\n"
-                context += f"Abstract: {article['text']}\n\n"
-    return context.strip()
+    phenotypes = [pheno.strip() for pheno in phenotypes.split(',') if pheno.strip()]
+    return format_articles(select_gene_articles(genes, phenotypes).values())
 
-genes_articles_tool = FunctionTool(genes_articles)
 
 def phenotypes_articles(phenotypes: str) -> str:
     """Retrieve articles related to a phenotype and format the context for the model
@@ -39,17 +65,8 @@ def phenotypes_articles(phenotypes: str) -> str:
     """
     retriever = ArticleRetriever()
     phenotypes = [pheno.strip() for pheno in phenotypes.split(',')]
-    context = ""
-    for pheno in phenotypes:
-        articles = retriever.retrieve_pheno(pheno)
-        for article in articles:
-            if 'text' in article and article['text']:
-                context += f"Title: {article['title']}\n"
-                context += f"Authors: {', '.join(article['authors'])}\n"
-                context += f"Abstract: {article['text']}\n\n"
-    return context.strip()
+    return format_articles(retriever.retrieve_phenos(phenotypes).values())
 
-phenotypes_articles_tool = FunctionTool(phenotypes_articles)
 
 
 def aberowl_hpo(phenotype: str) -> str:
@@ -59,10 +76,25 @@ def aberowl_hpo(phenotype: str) -> str:
     Returns:
         str: Background knowledge about the phenotype.
     """
-    phenotype = phenotype.strip().lower()
+    from ontology.hpo import get_ontology
+
+    phenotype = phenotype.strip()
+    with span("aberowl.lookup", phenotype=phenotype) as trace:
+        # Answer from the local HPO release when one is available, without a network round-trip;
+        # IDs are looked up case-sensitively, so the original case is kept for it
+        ontology = get_ontology()
+        if ontology is not None:
+            knowledge = ontology.background_knowledge(phenotype)
+            if knowledge is not None:
+                trace.set(source="local")
+                return knowledge
+        trace.set(source="remote")
+        return _aberowl_dlquery(phenotype.lower())
+
+def _aberowl_dlquery(phenotype: str) -> str:
     print("Retrieving background knowledge about phenotype:", phenotype)
-    response = requests.get(f"http://aber-owl.net/api/dlquery",
-                            params=f"axioms=true&labels=true&type=equivalent&query=%27{quote(phenotype)}%27&ontology=HP")
+    response = get_client().get(f"{ABEROWL_URL}/api/dlquery",
+                                params=f"axioms=true&labels=true&type=equivalent&query=%27{quote(phenotype)}%27&ontology=HP")
     response.raise_for_status()
     data = response.json()
     if 'status' in data and data['status'] == 'ok' and len(data['result']) > 0:
@@ -74,4 +106,19 @@ Definition: {', '.join(result.get('definition', [])) if 'definition' in result e
 Synonyms: {', '.join(result.get('synonyms', [])) if 'synonyms' in result else 'No synonyms available'}\n
 Subclass of: {', '.join(result.get('SubClassOf', [])) if 'SubClassOf' in result else 'No superclasses available'}\n"""
     return f"No background knowledge found for phenotype in AberOWL: {phenotype}"
-aberowl_hpo_tool = FunctionTool(aberowl_hpo)
\ No newline at end of file
+
+
+# camel FunctionTool wrappers for the agents, created on first access so importing tools does not import camel
+_TOOLS = {
+    "genes_articles_tool": genes_articles,
+    "phenotypes_articles_tool": phenotypes_articles,
+    "aberowl_hpo_tool": aberowl_hpo,
+}
+
+def __getattr__(name):
+    if name in _TOOLS:
+        from camel.toolkits import FunctionTool
+
+        globals()[name] = FunctionTool(_TOOLS[name])
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
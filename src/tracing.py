@@ -0,0 +1,185 @@
+"""Lightweight span tracing for finding where a patient's wall time goes.
+
+Tracing is off by default and span() is then a shared no-op. Once enabled,
+every finished span is kept in memory and appended to a JSON lines file:
+
+    {"name": "pubmed.search", "ts": 1718000000.12, "duration": 0.41, "thread": 1234,
+     "parent": "interpret", "attrs": {"query": "BRCA1", "results": 20}}
+
+Attributes with the keys bytes, prompt_tokens, completion_tokens and cost are
+totalled in the summary table. `python tracing.py trace.jsonl --chrome trace.json`
+summarizes a saved trace and converts it for chrome://tracing or Perfetto.
+"""
+from typing import Dict, List, Optional
+import threading
+import argparse
+import json
+import time
+import os
+
+TOTALLED = ("bytes", "prompt_tokens", "completion_tokens", "cost")
+
+
+class Span:
+    def __init__(self, tracer: "Tracer", name: str, attrs: Dict):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs) -> None:
+        """Add attributes known only once the work is done, e.g. bytes or token usage"""
+        self.attrs.update(attrs)
+
+    def __enter__(self) -> "Span":
+        stack = self.tracer.stack()
+        self.parent = stack[-1].name if stack else None
+        stack.append(self)
+        self.ts = time.time()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        duration = time.perf_counter() - self.started
+        self.tracer.stack().pop()
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.tracer.record({"name": self.name, "ts": self.ts, "duration": duration,
+                            "thread": threading.get_ident(), "parent": self.parent, "attrs": self.attrs})
+
+
+class _NoopSpan:
+    def set(self, **attrs) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+_NOOP = _NoopSpan()
+
+
+class Tracer:
+    def __init__(self, path: Optional[str] = None):
+        """Collect finished spans, appending them to `path` as JSON lines when given"""
+        self.path = path
+        self.records: List[Dict] = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.file = None
+        if path:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.file = open(path, "a", buffering=1)
+
+    def stack(self) -> List[Span]:
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def record(self, record: Dict) -> None:
+        with self.lock:
+            self.records.append(record)
+            if self.file is not None:
+                self.file.write(json.dumps(record, default=str) + "\n")
+
+    def close(self) -> None:
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+_tracer: Optional[Tracer] = None
+
+def enable(path: Optional[str] = None) -> Tracer:
+    """Start tracing for the rest of the process"""
+    global _tracer
+    _tracer = Tracer(path)
+    return _tracer
+
+def disable() -> Optional[Tracer]:
+    """Stop tracing and return the tracer with the collected spans"""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is not None:
+        tracer.close()
+    return tracer
+
+def enabled() -> bool:
+    return _tracer is not None
+
+def span(name: str, **attrs):
+    """Context manager timing a stage; a no-op unless tracing is enabled"""
+    if _tracer is None:
+        return _NOOP
+    return Span(_tracer, name, attrs)
+
+def traced(name: str):
+    """Decorator wrapping every call of a function in a span"""
+    def decorate(fn):
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        wrapper.__name__ = fn.__name__
+        wrapper.__doc__ = fn.__doc__
+        return wrapper
+    return decorate
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))] if ordered else 0.0
+
+def summary(records: List[Dict]) -> str:
+    """Per-stage table: calls, total and percentile durations, and the totalled attributes"""
+    stages: Dict[str, List[Dict]] = {}
+    for record in records:
+        stages.setdefault(record["name"], []).append(record)
+    header = (f"{'stage':<24}{'calls':>7}{'total s':>10}{'mean s':>9}{'p50 s':>9}{'p95 s':>9}{'max s':>9}"
+              f"{'bytes':>12}{'tokens in':>11}{'tokens out':>11}{'cost $':>9}")
+    lines = [header, "-" * len(header)]
+    for name, spans in sorted(stages.items(), key=lambda item: -sum(r["duration"] for r in item[1])):
+        durations = [r["duration"] for r in spans]
+        totals = {key: sum(r["attrs"].get(key) or 0 for r in spans) for key in TOTALLED}
+        lines.append(f"{name:<24}{len(spans):>7}{sum(durations):>10.2f}{sum(durations) / len(spans):>9.3f}"
+                     f"{percentile(durations, 50):>9.3f}{percentile(durations, 95):>9.3f}{max(durations):>9.3f}"
+                     f"{totals['bytes']:>12}{totals['prompt_tokens']:>11}{totals['completion_tokens']:>11}"
+                     f"{totals['cost']:>9.4f}")
+    return "\n".join(lines)
+
+def export_chrome(records: List[Dict], path: str) -> None:
+    """Write spans in the Chrome trace event format (complete events, one track per thread)"""
+    events = [{"name": r["name"], "cat": r["name"].split(".")[0], "ph": "X", "ts": r["ts"] * 1e6,
+               "dur": r["duration"] * 1e6, "pid": os.getpid(), "tid": r["thread"], "args": r["attrs"]}
+              for r in records]
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
+
+def finish(chrome_path: Optional[str] = None) -> None:
+    """Stop tracing, print the summary table and optionally export a Chrome trace"""
+    tracer = disable()
+    if tracer is None:
+        return
+    print(f"\nProfile ({len(tracer.records)} spans{f', written to {tracer.path}' if tracer.path else ''}):")
+    print(summary(tracer.records))
+    if chrome_path:
+        export_chrome(tracer.records, chrome_path)
+        print(f"Chrome trace written to {chrome_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize a JSON lines trace written with --profile")
+    parser.add_argument("trace", help="Trace file")
+    parser.add_argument("--chrome", help="Also write a Chrome trace to this file")
+    args = parser.parse_args()
+    with open(args.trace) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    print(summary(records))
+    if args.chrome:
+        export_chrome(records, args.chrome)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""Variant filter expressions over VEP CSQ fields.
+
+    IMPACT in (HIGH, MODERATE) and (gnomAD_AF < 0.001 or gnomAD_AF is missing)
+    Consequence in (stop_gained, frameshift_variant) and not SYMBOL in (TTN, MUC16)
+    CADD_PHRED >= 25 or CLIN_SIG == pathogenic
+
+Predicates compare one CSQ field: <, <=, >, >= numerically (empty or
+non-numeric values never match); ==, != and in (...), not in (...) as
+strings; `is missing` / `is not missing` test for an empty value. Values
+holding several &-separated terms (e.g. "stop_gained&splice_region_variant")
+match when any term does; != and not in are the negations of == and in.
+Predicates combine with and, or, not and parentheses.
+
+An expression is compiled once against the CSQ layout of the VCF header and
+evaluated on batches of annotations, one dictionary-encoded NumPy column per
+referenced field. Every predicate counts how many annotations it passed.
+"""
+from operator import itemgetter
+from typing import Dict, Iterable, List, Optional, Tuple
+import operator
+import re
+
+import numpy as np
+
+TOKEN = re.compile(r"\s*(?:(<=|>=|==|!=|<|>)|([(),])|'([^']*)'|\"([^\"]*)\"|([^\s(),<>=!'\"]+))")
+KEYWORDS = {"and", "or", "not", "in", "is", "missing"}
+NUMERIC_OPS = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+
+
+class FilterSyntaxError(ValueError):
+    """Raised when a filter expression cannot be parsed"""
+
+
+class Columns:
+    def __init__(self, annotations: Iterable[str], width: int):
+        """Columnar views of a batch of raw CSQ annotations, built once per referenced field
+
+        Only the first `width` fields of an annotation are split off, so wide
+        VEP annotations cost little beyond the fields in use; fields an
+        annotation lacks read as empty.
+        """
+        self.rows = [annotation.split("|", width) for annotation in annotations]
+        self.size = len(self.rows)
+        self.complete = not self.rows or min(map(len, self.rows)) >= width
+        self.cache = {}
+
+    def column(self, index: int) -> List[str]:
+        """Values of one field, one per annotation"""
+        key = ("column", index)
+        if key not in self.cache:
+            if self.complete:
+                self.cache[key] = list(map(itemgetter(index), self.rows))
+            else:
+                self.cache[key] = [row[index] if index < len(row) else "" for row in self.rows]
+        return self.cache[key]
+
+    def encoded(self, index: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Distinct values of a field and the position of each annotation's value among them
+
+        Predicates are evaluated on the distinct values only, which are few for
+        fields like Consequence or IMPACT, and mapped back through the codes.
+        """
+        key = ("encoded", index)
+        if key not in self.cache:
+            column = self.column(index)
+            ids = {value: i for i, value in enumerate(dict.fromkeys(column))}
+            codes = np.fromiter(map(ids.__getitem__, column), dtype=np.intp, count=self.size)
+            self.cache[key] = (np.array(list(ids), dtype=str), codes)
+        return self.cache[key]
+
+    def terms(self, index: int) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """&-separated terms of the distinct values of a field and the value owning each term
+
+        Owners are None when no value has several terms.
+        """
+        key = ("terms", index)
+        if key not in self.cache:
+            distinct, _ = self.encoded(index)
+            separators = np.char.count(distinct, "&")
+            if not separators.any():
+                self.cache[key] = (distinct, None)
+            else:
+                terms = "&".join(distinct.tolist()).split("&")
+                owners = np.repeat(np.arange(len(distinct)), separators + 1)
+                self.cache[key] = (np.array(terms, dtype=str), owners)
+        return self.cache[key]
+
+    def numbers(self, index: int) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Terms of the distinct values of a field as floats, NaN where empty or not a number"""
+        key = ("numbers", index)
+        if key not in self.cache:
+            terms, owners = self.terms(index)
+            try:
+                values = np.where(terms == "", "nan", terms).astype(float)
+            except ValueError:
+                values = np.array([_to_float(term) for term in terms.tolist()], dtype=float)
+            self.cache[key] = (values, owners)
+        return self.cache[key]
+
+    def any(self, index: int, matches: np.ndarray, owners: Optional[np.ndarray]) -> np.ndarray:
+        """Per-annotation mask of values with at least one matching term"""
+        distinct, codes = self.encoded(index)
+        if owners is not None:
+            matches = np.bincount(owners[matches], minlength=len(distinct)) > 0
+        return matches[codes]
+
+
+def _to_float(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return float("nan")
+
+
+class Predicate:
+    def __init__(self, id: int, text: str, field: str, index: int, op: str, values: List[str]):
+        """One comparison of a CSQ field; `id` indexes the pass counts of the filter"""
+        self.id = id
+        self.text = text
+        self.field = field
+        self.index = index
+        self.op = op
+        self.values = values
+        if op in NUMERIC_OPS:
+            try:
+                self.threshold = float(values[0])
+            except ValueError:
+                raise FilterSyntaxError(f"{text}: {op} needs a number, got {values[0]}")
+
+    def evaluate(self, columns: Columns, counts: np.ndarray) -> np.ndarray:
+        if self.op in NUMERIC_OPS:
+            values, owners = columns.numbers(self.index)
+            with np.errstate(invalid="ignore"):
+                mask = columns.any(self.index, NUMERIC_OPS[self.op](values, self.threshold), owners)
+        elif self.op in ("missing", "not missing"):
+            distinct, codes = columns.encoded(self.index)
+            mask = (distinct == "")[codes]
+            mask = ~mask if self.op == "not missing" else mask
+        else:
+            terms, owners = columns.terms(self.index)
+            if self.op in ("==", "!="):
+                matches = terms == self.values[0]
+            else:
+                matches = np.isin(terms, self.values)
+            mask = columns.any(self.index, matches, owners)
+            mask = ~mask if self.op in ("!=", "not in") else mask
+        counts[self.id] += np.count_nonzero(mask)
+        return mask
+
+
+class Not:
+    def __init__(self, child):
+        self.child = child
+
+    def evaluate(self, columns: Columns, counts: np.ndarray) -> np.ndarray:
+        return ~self.child.evaluate(columns, counts)
+
+
+class Combine:
+    def __init__(self, op: str, children: List):
+        self.op = op
+        self.children = children
+
+    def evaluate(self, columns: Columns, counts: np.ndarray) -> np.ndarray:
+        # Every child is evaluated on the whole batch so each predicate's count covers all annotations
+        masks = [child.evaluate(columns, counts) for child in self.children]
+        reduce = np.logical_and.reduce if self.op == "and" else np.logical_or.reduce
+        return reduce(masks)
+
+
+class _Parser:
+    def __init__(self, expression: str, fields: Dict[str, int]):
+        self.expression = expression
+        self.fields = fields
+        self.tokens = self._tokenize(expression)
+        self.pos = 0
+        self.predicates: List[Predicate] = []
+
+    def _tokenize(self, expression: str) -> List[Tuple[str, str]]:
+        """(kind, text) tokens; kinds are op, punct, word and string (quoted)"""
+        tokens = []
+        pos = 0
+        expression = expression.rstrip()
+        while pos < len(expression):
+            match = TOKEN.match(expression, pos)
+            if not match or match.end() == pos:
+                raise FilterSyntaxError(f"Unexpected character at {pos} in filter: {expression[pos:]}")
+            op, punct, single, double, word = match.groups()
+            if op:
+                tokens.append(("op", op))
+            elif punct:
+                tokens.append(("punct", punct))
+            elif word is not None:
+                tokens.append(("keyword" if word.lower() in KEYWORDS else "word", word))
+            else:
+                tokens.append(("string", single if single is not None else double))
+            pos = match.end()
+        return tokens
+
+    def peek(self, offset: int = 0) -> Tuple[Optional[str], Optional[str]]:
+        position = self.pos + offset
+        return self.tokens[position] if position < len(self.tokens) else (None, None)
+
+    def keyword(self, word: str, offset: int = 0) -> bool:
+        kind, text = self.peek(offset)
+        return kind == "keyword" and text.lower() == word
+
+    def take(self, description: str) -> Tuple[str, str]:
+        if self.pos >= len(self.tokens):
+            raise FilterSyntaxError(f"Filter ended early, expected {description}: {self.expression}")
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def expect(self, text: str) -> None:
+        kind, found = self.take(f"'{text}'")
+        if found.lower() != text:
+            raise FilterSyntaxError(f"Expected '{text}' but found '{found}' in filter: {self.expression}")
+
+    def parse(self):
+        node = self.parse_or()
+        if self.pos < len(self.tokens):
+            raise FilterSyntaxError(f"Unexpected '{self.tokens[self.pos][1]}' in filter: {self.expression}")
+        return node
+
+    def parse_or(self):
+        children = [self.parse_and()]
+        while self.keyword("or"):
+            self.pos += 1
+            children.append(self.parse_and())
+        return children[0] if len(children) == 1 else Combine("or", children)
+
+    def parse_and(self):
+        children = [self.parse_not()]
+        while self.keyword("and"):
+            self.pos += 1
+            children.append(self.parse_not())
+        return children[0] if len(children) == 1 else Combine("and", children)
+
+    def parse_not(self):
+        if self.keyword("not"):
+            self.pos += 1
+            return Not(self.parse_not())
+        if self.peek() == ("punct", "("):
+            self.pos += 1
+            node = self.parse_or()
+            self.expect(")")
+            return node
+        return self.parse_predicate()
+
+    def value(self) -> str:
+        kind, text = self.take("a value")
+        if kind not in ("word", "string"):
+            raise FilterSyntaxError(f"Expected a value but found '{text}' in filter: {self.expression}")
+        return text
+
+    def parse_predicate(self) -> Predicate:
+        start = self.pos
+        kind, field = self.take("a CSQ field")
+        if kind != "word":
+            raise FilterSyntaxError(f"Expected a CSQ field but found '{field}' in filter: {self.expression}")
+        if field not in self.fields:
+            raise ValueError(f"CSQ field {field} of the filter is not in the VCF header "
+                             f"(fields: {'|'.join(self.fields)})")
+        if self.keyword("is"):
+            self.pos += 1
+            negated = self.keyword("not")
+            self.pos += negated
+            self.expect("missing")
+            op, values = ("not missing" if negated else "missing"), []
+        elif self.keyword("in") or (self.keyword("not") and self.keyword("in", 1)):
+            negated = self.keyword("not")
+            self.pos += 1 + negated
+            self.expect("(")
+            values = [self.value()]
+            while self.peek() == ("punct", ","):
+                self.pos += 1
+                values.append(self.value())
+            self.expect(")")
+            op = "not in" if negated else "in"
+        else:
+            kind, op = self.take("a comparison")
+            if kind != "op":
+                raise FilterSyntaxError(f"Expected a comparison after {field} but found '{op}' in filter: "
+                                        f"{self.expression}")
+            values = [self.value()]
+        text = " ".join(token for _, token in self.tokens[start:self.pos]).replace("( ", "(").replace(" )", ")")
+        predicate = Predicate(len(self.predicates), text.replace(" ,", ","), field, self.fields[field], op, values)
+        self.predicates.append(predicate)
+        return predicate
+
+
+class VariantFilter:
+    def __init__(self, expression: str, csq_fields: List[str]):
+        """Compile `expression` against the CSQ sub-fields of a VCF header
+
+        Raises:
+            FilterSyntaxError: When the expression cannot be parsed.
+            ValueError: When it names a field the CSQ annotation does not have.
+        """
+        self.expression = expression
+        parser = _Parser(expression, {name: i for i, name in enumerate(csq_fields)})
+        self.root = parser.parse()
+        self.predicates = parser.predicates
+        # Leading CSQ fields the expression reads
+        self.width = max(predicate.index for predicate in self.predicates) + 1
+        self.counts = np.zeros(len(self.predicates), dtype=np.int64)
+        self.evaluated = 0
+        self.passed = 0
+
+    def fresh(self) -> "VariantFilter":
+        """A copy sharing the compiled expression with its own zeroed counts, e.g. for one scan task"""
+        copy = VariantFilter.__new__(VariantFilter)
+        copy.expression, copy.root, copy.predicates, copy.width = self.expression, self.root, self.predicates, self.width
+        copy.counts = np.zeros_like(self.counts)
+        copy.evaluated = copy.passed = 0
+        return copy
+
+    def evaluate(self, columns: Columns) -> np.ndarray:
+        """Mask of the annotations of a batch that pass, updating the pass counts"""
+        if not columns.size:
+            return np.zeros(0, dtype=bool)
+        mask = self.root.evaluate(columns, self.counts)
+        self.evaluated += columns.size
+        self.passed += int(np.count_nonzero(mask))
+        return mask
+
+    def add_counts(self, counts: np.ndarray, evaluated: int, passed: int) -> None:
+        """Merge the counts of a copy of this filter that ran in another process"""
+        self.counts += counts
+        self.evaluated += evaluated
+        self.passed += passed
+
+    def report(self) -> str:
+        """Pass counts of every predicate and of the whole filter"""
+        width = max([len(p.text) for p in self.predicates] + [len("filter")])
+        lines = [f"{'predicate':<{width}}{'passed':>12}{'of':>12}{'%':>8}"]
+        for text, passed in [(p.text, int(self.counts[p.id])) for p in self.predicates] + [("filter", self.passed)]:
+            share = 100 * passed / self.evaluated if self.evaluated else 0.0
+            lines.append(f"{text:<{width}}{passed:>12}{self.evaluated:>12}{share:>8.1f}")
+        return "\n".join(lines)
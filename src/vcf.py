@@ -0,0 +1,525 @@
+from collections import defaultdict
+from typing import List, Dict, Iterator, Optional, Tuple
+import struct
+import gzip
+import zlib
+import re
+import os
+
+from tracing import span
+
+HIGH_IMPACT_CONSEQUENCES = {
+    'transcript_ablation',
+    'splice_acceptor_variant',
+    'splice_donor_variant',
+    'stop_gained',
+    'frameshift_variant',
+    'stop_lost'
+}
+
+# The default variant filter; see variant_filter.py for the expression language
+DEFAULT_FILTER = f"Consequence in ({', '.join(sorted(HIGH_IMPACT_CONSEQUENCES))})"
+# Data lines whose CSQ annotations are evaluated together by the variant filter
+FILTER_BATCH = 4096
+
+# Field order used when the VCF has no CSQ header line (VEP's default layout starts with these)
+DEFAULT_CSQ_FIELDS = ['Allele', 'Consequence', 'IMPACT', 'SYMBOL']
+
+CSQ_HEADER = re.compile(r'##INFO=<ID=CSQ,.*Format: ([^"]+)"')
+REGION = re.compile(r'^([^:]+)(?::([\d,]+)(?:-([\d,]+))?)?$')
+
+
+class VcfHeader:
+    def __init__(self, csq_fields: List[str], samples: List[str]):
+        """Column layout resolved once from the VCF header"""
+        self.csq_fields = csq_fields
+        self.samples = samples
+        self.csq_index = {name: i for i, name in enumerate(csq_fields)}
+
+    def field(self, name: str) -> int:
+        """Index of a CSQ sub-field, failing early when the annotation does not provide it"""
+        if name not in self.csq_index:
+            raise ValueError(f"CSQ field {name} not found in VCF header (fields: {'|'.join(self.csq_fields)})")
+        return self.csq_index[name]
+
+
+def is_gzipped(path: str) -> bool:
+    with open(path, 'rb') as f:
+        return f.read(2) == b'\x1f\x8b'
+
+def open_vcf(path: str):
+    """Open a plain, gzip or bgzip VCF as text"""
+    if is_gzipped(path):
+        return gzip.open(path, 'rt')
+    return open(path, 'r')
+
+def read_header(path: str) -> VcfHeader:
+    """Read the meta-information lines and resolve the CSQ layout and sample names"""
+    csq_fields = DEFAULT_CSQ_FIELDS
+    samples = []
+    with open_vcf(path) as vcf:
+        for line in vcf:
+            if line.startswith('##'):
+                match = CSQ_HEADER.match(line)
+                if match:
+                    csq_fields = match.group(1).strip().split('|')
+            elif line.startswith('#'):
+                samples = line.rstrip('\n').split('\t')[9:]
+            else:
+                break
+    return VcfHeader(csq_fields, samples)
+
+def info_value(info: str, key: str) -> Optional[str]:
+    """Value of one key of an INFO column without splitting the rest (None when absent)"""
+    prefix = key + '='
+    start = info.find(prefix)
+    while start > 0 and info[start - 1] != ';':
+        start = info.find(prefix, start + 1)
+    if start < 0:
+        return None
+    end = info.find(';', start)
+    return info[start + len(prefix):end if end >= 0 else len(info)]
+
+def parse_region(region: str) -> Tuple[str, int, int]:
+    """Parse chrom[:start[-end]] (1-based, inclusive) into a 0-based half-open interval"""
+    match = REGION.match(region.strip())
+    if not match:
+        raise ValueError(f"Invalid region: {region}")
+    chrom, start, end = match.groups()
+    start = int(start.replace(',', '')) - 1 if start else 0
+    end = int(end.replace(',', '')) if end else 1 << 31
+    return chrom, start, end
+
+
+class BgzfReader:
+    def __init__(self, path: str):
+        """Read lines from a BGZF file addressed by virtual offsets (coffset << 16 | uoffset)"""
+        self.file = open(path, 'rb')
+        self.block_offset = 0
+        self.next_block_offset = 0
+        self.data = b''
+        self.pos = 0
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _load_block(self, offset: int) -> None:
+        self.file.seek(offset)
+        header = self.file.read(18)
+        self.block_offset = offset
+        self.pos = 0
+        if len(header) < 18:
+            self.data = b''
+            self.next_block_offset = offset
+            return
+        if header[:4] != b'\x1f\x8b\x08\x04' or header[12:14] != b'BC':
+            raise ValueError(f"Not a BGZF block at offset {offset}")
+        block_size = struct.unpack('<H', header[16:18])[0] + 1
+        block = header + self.file.read(block_size - 18)
+        self.data = zlib.decompress(block, 31)
+        self.next_block_offset = offset + block_size
+
+    def seek(self, voffset: int) -> None:
+        self._load_block(voffset >> 16)
+        self.pos = voffset & 0xFFFF
+
+    def tell(self) -> int:
+        # Normalize the end of a block to the start of the next one
+        while self.pos >= len(self.data) and self.next_block_offset > self.block_offset:
+            self._load_block(self.next_block_offset)
+        return (self.block_offset << 16) | self.pos
+
+    def readline(self) -> bytes:
+        parts = []
+        while True:
+            newline = self.data.find(b'\n', self.pos)
+            if newline >= 0:
+                parts.append(self.data[self.pos:newline + 1])
+                self.pos = newline + 1
+                return b''.join(parts)
+            parts.append(self.data[self.pos:])
+            self.pos = len(self.data)
+            if self.next_block_offset == self.block_offset:
+                return b''.join(parts)
+            self._load_block(self.next_block_offset)
+
+
+class TabixIndex:
+    def __init__(self, names: List[str], bins: List[Dict[int, List[Tuple[int, int]]]],
+                 linear: List[List[int]], loffsets: List[Dict[int, int]], min_shift: int, depth: int):
+        """Binning index loaded from a .tbi or .csi file"""
+        self.names = names
+        self.ref_ids = {name: i for i, name in enumerate(names)}
+        self.bins = bins
+        self.linear = linear
+        self.loffsets = loffsets
+        self.min_shift = min_shift
+        self.depth = depth
+
+    @classmethod
+    def find(cls, vcf_path: str) -> Optional['TabixIndex']:
+        """Load the .csi or .tbi index next to a VCF, if there is one"""
+        if os.path.exists(vcf_path + '.csi'):
+            return cls.load(vcf_path + '.csi')
+        if os.path.exists(vcf_path + '.tbi'):
+            return cls.load(vcf_path + '.tbi')
+        return None
+
+    @classmethod
+    def load(cls, path: str) -> 'TabixIndex':
+        with gzip.open(path, 'rb') as f:
+            buf = f.read()
+        offset = 0
+
+        def unpack(fmt):
+            nonlocal offset
+            values = struct.unpack_from(fmt, buf, offset)
+            offset += struct.calcsize(fmt)
+            return values
+
+        magic = buf[:4]
+        offset = 4
+        if magic == b'TBI\x01':
+            min_shift, depth = 14, 5
+            n_ref, = unpack('<i')
+            _, _, _, _, _, _, l_nm = unpack('<7i')
+            names_blob = buf[offset:offset + l_nm]
+            offset += l_nm
+        elif magic == b'CSI\x01':
+            min_shift, depth, l_aux = unpack('<3i')
+            aux = buf[offset:offset + l_aux]
+            offset += l_aux
+            # Tabix-style CSI indices carry the sequence names in the aux block
+            l_nm = struct.unpack_from('<i', aux, 24)[0] if l_aux >= 28 else 0
+            names_blob = aux[28:28 + l_nm]
+            n_ref, = unpack('<i')
+        else:
+            raise ValueError(f"Unsupported index format: {path}")
+        names = [name.decode() for name in names_blob.split(b'\x00') if name]
+
+        bins, linear, loffsets = [], [], []
+        for _ in range(n_ref):
+            ref_bins, ref_loffsets = {}, {}
+            n_bin, = unpack('<i')
+            for _ in range(n_bin):
+                if magic == b'TBI\x01':
+                    bin_id, n_chunk = unpack('<Ii')
+                else:
+                    bin_id, loffset, n_chunk = unpack('<IQi')
+                    ref_loffsets[bin_id] = loffset
+                chunks = struct.unpack_from(f'<{2 * n_chunk}Q', buf, offset)
+                offset += 16 * n_chunk
+                ref_bins[bin_id] = list(zip(chunks[::2], chunks[1::2]))
+            ioffs = []
+            if magic == b'TBI\x01':
+                n_intv, = unpack('<i')
+                ioffs = list(struct.unpack_from(f'<{n_intv}Q', buf, offset))
+                offset += 8 * n_intv
+            bins.append(ref_bins)
+            linear.append(ioffs)
+            loffsets.append(ref_loffsets)
+        return cls(names, bins, linear, loffsets, min_shift, depth)
+
+    def reg2bins(self, beg: int, end: int) -> List[int]:
+        """Bins overlapping the 0-based half-open interval [beg, end)"""
+        end = min(end, 1 << (self.min_shift + 3 * self.depth)) - 1
+        bins = []
+        level, first, shift = 0, 0, self.min_shift + 3 * self.depth
+        while level <= self.depth:
+            bins.extend(range(first + (beg >> shift), first + (end >> shift) + 1))
+            shift -= 3
+            first += 1 << (level * 3)
+            level += 1
+        return bins
+
+    def chunks(self, chrom: str, beg: int, end: int) -> List[Tuple[int, int]]:
+        """Merged virtual-offset chunks that may hold records overlapping the region"""
+        ref = self.ref_ids.get(chrom)
+        if ref is None:
+            return []
+        min_offset = 0
+        if self.linear[ref]:
+            window = min(beg >> self.min_shift, len(self.linear[ref]) - 1)
+            min_offset = self.linear[ref][window]
+        elif self.loffsets[ref]:
+            # CSI keeps the smallest offset per bin; use the closest existing bin containing beg
+            bin_id = ((1 << (3 * self.depth)) - 1) // 7 + (beg >> self.min_shift)
+            while bin_id > 0 and bin_id not in self.loffsets[ref]:
+                bin_id = (bin_id - 1) >> 3
+            min_offset = self.loffsets[ref].get(bin_id, 0)
+        chunks = []
+        for bin_id in self.reg2bins(beg, end):
+            chunks.extend(c for c in self.bins[ref].get(bin_id, []) if c[1] > min_offset)
+        chunks.sort()
+        merged = []
+        for chunk_beg, chunk_end in chunks:
+            if merged and chunk_beg <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], chunk_end))
+            else:
+                merged.append((chunk_beg, chunk_end))
+        return merged
+
+
+def iter_region_lines(vcf_path: str, index: TabixIndex, region: str) -> Iterator[str]:
+    """Yield the data lines of a bgzipped VCF that overlap a region"""
+    chrom, beg, end = parse_region(region)
+    with BgzfReader(vcf_path) as reader:
+        for chunk_beg, chunk_end in index.chunks(chrom, beg, end):
+            reader.seek(chunk_beg)
+            while reader.tell() < chunk_end:
+                line = reader.readline()
+                if not line:
+                    break
+                line = line.decode()
+                fields = line.split('\t', 3)
+                if len(fields) < 4 or fields[0] != chrom:
+                    continue
+                pos = int(fields[1]) - 1
+                if pos >= end:
+                    break
+                if pos >= beg:
+                    yield line
+
+def iter_chunk_lines(vcf_path: str, start: int, end: int, bgzf: bool) -> Iterator[str]:
+    """Yield the lines that start inside [start, end], in byte or BGZF virtual offsets
+
+    A worker skips the (partial) line at its start offset because the
+    previous chunk reads every line starting at or before its end offset.
+    """
+    if bgzf:
+        reader = BgzfReader(vcf_path)
+        reader.seek(start)
+    else:
+        reader = open(vcf_path, 'rb')
+        reader.seek(start)
+    with reader:
+        if start:
+            reader.readline()
+        while reader.tell() <= end:
+            line = reader.readline()
+            if not line:
+                break
+            yield line.decode()
+
+def _find_block(f, offset: int) -> int:
+    """Offset of the first BGZF block starting at or after offset"""
+    f.seek(offset)
+    buf = f.read(1 << 17)
+    while buf:
+        i = buf.find(b'\x1f\x8b\x08\x04')
+        while i >= 0:
+            if buf[i + 12:i + 14] == b'BC':
+                return offset + i
+            i = buf.find(b'\x1f\x8b\x08\x04', i + 1)
+        offset += len(buf) - 13
+        f.seek(offset)
+        buf = f.read(1 << 17)
+        if len(buf) < 14:
+            break
+    return os.path.getsize(f.name)
+
+def split_chunks(vcf_path: str, n_chunks: int) -> List[Tuple[int, int]]:
+    """Split a plain or bgzipped VCF into roughly equal byte ranges aligned for iter_chunk_lines"""
+    size = os.path.getsize(vcf_path)
+    bgzf = is_gzipped(vcf_path)
+    boundaries = [0]
+    with open(vcf_path, 'rb') as f:
+        for i in range(1, n_chunks):
+            offset = size * i // n_chunks
+            if bgzf:
+                offset = _find_block(f, offset)
+            if offset > boundaries[-1] and offset < size:
+                boundaries.append(offset)
+    boundaries.append(size)
+    if bgzf:
+        # Chunk ends are virtual offsets at the start of a block
+        boundaries = [b << 16 for b in boundaries]
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def sample_gts(fields: List[str]) -> List[str]:
+    """GT value of every sample column of a split data line ('.' when FORMAT has no GT)"""
+    format_keys = fields[8].split(':') if len(fields) > 8 else []
+    if 'GT' not in format_keys:
+        return ['.'] * len(fields[9:])
+    gt_idx = format_keys.index('GT')
+    if gt_idx == 0:
+        return [sample.partition(':')[0] for sample in fields[9:]]
+    return [(sample.split(':') + ['.'] * gt_idx)[gt_idx] for sample in fields[9:]]
+
+def scan_lines(lines, header: VcfHeader, genotypes: bool = False, variant_filter=None) -> Dict[str, List[Dict]]:
+    """Collect genes with variants passing a filter from VCF data lines
+
+    CSQ annotations are handed to `variant_filter` (a
+    variant_filter.VariantFilter, by default DEFAULT_FILTER) FILTER_BATCH
+    lines at a time; only the annotations that pass are looked at again.
+    With `genotypes`, every variant also gets a 'genotypes' row of the int8
+    genotype matrix of the scanned lines (see inheritance.py).
+    """
+    from itertools import chain
+    import numpy as np
+    from variant_filter import Columns, VariantFilter
+
+    if variant_filter is None:
+        variant_filter = VariantFilter(DEFAULT_FILTER, header.csq_fields)
+    consequence_idx = header.field('Consequence')
+    gene_idx = header.field('SYMBOL')
+    width = max(variant_filter.width, consequence_idx + 1, gene_idx + 1)
+    genes = defaultdict(list)
+    gt_rows = []
+    variant_rows = []
+    # Split lines holding a CSQ annotation and their CSQ values
+    batch_fields, batch_csq = [], []
+
+    def collect():
+        annotations = [csq.split(',') for csq in batch_csq]
+        columns = Columns(chain.from_iterable(annotations), width)
+        passed = np.flatnonzero(variant_filter.evaluate(columns))
+        if not len(passed):
+            return
+        line_of = np.repeat(np.arange(len(batch_fields)), list(map(len, annotations)))[passed].tolist()
+        consequences = columns.column(consequence_idx)
+        symbols = columns.column(gene_idx)
+        for i, line in zip(passed.tolist(), line_of):
+            fields = batch_fields[line]
+            variant = {
+                'chrom': fields[0],
+                'pos': fields[1],
+                'ref': fields[3],
+                'alt': fields[4],
+                'consequence': consequences[i]
+            }
+            genes[symbols[i]].append(variant)
+            if genotypes:
+                # Annotations of the same line share its genotype row
+                if not gt_rows or gt_rows[-1] is not fields:
+                    gt_rows.append(fields)
+                variant_rows.append((variant, len(gt_rows) - 1))
+
+    for line in lines:
+        if line.startswith('#'):
+            continue
+
+        fields = line.rstrip('\n').split('\t')
+        csq = info_value(fields[7], 'CSQ')
+
+        if csq is None:
+            continue
+
+        batch_fields.append(fields)
+        batch_csq.append(csq)
+        if len(batch_fields) >= FILTER_BATCH:
+            collect()
+            batch_fields, batch_csq = [], []
+    if batch_fields:
+        collect()
+
+    if genotypes:
+        from inheritance import decode_genotypes
+
+        matrix = decode_genotypes([sample_gts(fields) for fields in gt_rows])
+        for variant, row in variant_rows:
+            variant['genotypes'] = matrix[row]
+    return genes
+
+def _scan_task(task) -> Tuple[Dict[str, List[Dict]], Tuple]:
+    """Process-pool entry point scanning one region or byte range"""
+    vcf_path, header, kind, args, genotypes, variant_filter = task
+    # Counts are kept per task and merged by process_vcf, whether or not the task ran in a worker process
+    variant_filter = variant_filter.fresh()
+    if kind == 'region':
+        lines = iter_region_lines(vcf_path, TabixIndex.find(vcf_path), args)
+    elif kind == 'chunk':
+        lines = iter_chunk_lines(vcf_path, args[0], args[1], is_gzipped(vcf_path))
+    else:
+        lines = open_vcf(vcf_path)
+    try:
+        genes = scan_lines(lines, header, genotypes, variant_filter)
+        return genes, (variant_filter.counts, variant_filter.evaluated, variant_filter.passed)
+    finally:
+        if hasattr(lines, 'close'):
+            lines.close()
+
+def process_vcf(vcf_path: str, regions: Optional[List[str]] = None, workers: int = 1,
+                ped_path: Optional[str] = None, models: Optional[List[str]] = None,
+                filter_expression: Optional[str] = None) -> dict:
+    """Parse VCF file and return genes with high-impact variants
+
+    Args:
+        vcf_path: Plain, gzip or bgzip VCF annotated with VEP.
+        regions: Restrict parsing to these chrom[:start-end] regions (needs a .tbi/.csi index).
+        workers: Number of processes used to parse chunks of the file.
+        ped_path: PED file of the samples; only variants fitting an inheritance model are kept.
+        models: Inheritance models tested with ped_path (default: all, see inheritance.MODELS).
+        filter_expression: Variant filter over CSQ fields (default: DEFAULT_FILTER, see variant_filter.py);
+            its per-predicate pass counts are printed.
+    """
+    with span("vcf.parse", path=vcf_path, bytes=os.path.getsize(vcf_path), workers=workers) as trace:
+        genes = _process_vcf(vcf_path, regions, workers, ped_path, models, filter_expression)
+        trace.set(genes=len(genes))
+        return genes
+
+def _process_vcf(vcf_path: str, regions: Optional[List[str]], workers: int,
+                 ped_path: Optional[str], models: Optional[List[str]], filter_expression: Optional[str]) -> dict:
+    from variant_filter import VariantFilter
+
+    header = read_header(vcf_path)
+    # Compiled once against the CSQ layout, so unknown fields fail before any data is read
+    variant_filter = VariantFilter(filter_expression or DEFAULT_FILTER, header.csq_fields)
+    inheritance = None
+    if ped_path:
+        from inheritance import MODELS, InheritanceFilter, parse_ped
+
+        # Built before scanning so a pedigree that does not match the samples fails fast
+        inheritance = InheritanceFilter(parse_ped(ped_path), header.samples, models or MODELS)
+    genotypes = inheritance is not None
+    index = TabixIndex.find(vcf_path) if is_gzipped(vcf_path) else None
+    if regions:
+        if index is None:
+            raise ValueError(f"Region queries need a bgzipped VCF with a .tbi or .csi index: {vcf_path}")
+        tasks = [(vcf_path, header, 'region', region, genotypes, variant_filter) for region in regions]
+    elif workers > 1 and index is not None:
+        tasks = [(vcf_path, header, 'region', name, genotypes, variant_filter) for name in index.names]
+    elif workers > 1:
+        # Plain gzip (not BGZF) streams cannot be split
+        bgzf = not is_gzipped(vcf_path) or _is_bgzf(vcf_path)
+        chunks = split_chunks(vcf_path, workers * 4) if bgzf else [None]
+        tasks = [(vcf_path, header, 'chunk', chunk, genotypes, variant_filter) if chunk
+                 else (vcf_path, header, 'file', None, genotypes, variant_filter) for chunk in chunks]
+    else:
+        tasks = [(vcf_path, header, 'file', None, genotypes, variant_filter)]
+
+    if len(tasks) > 1 and workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_scan_task, tasks))
+    else:
+        results = [_scan_task(task) for task in tasks]
+
+    # Merge in task order so variants keep their file order
+    genes = defaultdict(list)
+    for result, counts in results:
+        for gene, variants in result.items():
+            genes[gene].extend(variants)
+        variant_filter.add_counts(*counts)
+    if filter_expression:
+        print(f"Variant filter: {filter_expression}\n{variant_filter.report()}")
+    if inheritance is not None:
+        with span("inheritance.filter", models=inheritance.models) as trace:
+            kept = inheritance.apply(genes)
+            trace.set(genes_in=len(genes), genes_out=len(kept))
+        print(f"Inheritance filter ({', '.join(inheritance.models)}) kept {len(kept)} of {len(genes)} genes")
+        genes = defaultdict(list, kept)
+    return genes
+
+def _is_bgzf(path: str) -> bool:
+    with open(path, 'rb') as f:
+        header = f.read(18)
+    return header[:4] == b'\x1f\x8b\x08\x04' and header[12:14] == b'BC'